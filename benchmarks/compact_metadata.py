@@ -0,0 +1,59 @@
+'''
+Memory of the metadata of many books kept in memory: the odict results
+versus the compact EpubMetadata results (slots, tuples, interned strings).
+
+Each sample is extracted once, then copied (pickle round trips, so every
+copy has its own strings, like separate extractions) up to --books results.
+
+    python benchmarks/compact_metadata.py [--books 20000] [epub files...]
+'''
+import argparse
+import gc
+import glob
+import os
+import pickle
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from epub_meta import EpubMetadata, get_epub_metadata  # noqa: E402
+
+
+def measure(blobs, books, convert):
+    gc.collect()
+    tracemalloc.start()
+    results = [convert(pickle.loads(blobs[i % len(blobs)])) for i in range(books)]
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del results
+    return current
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('files', nargs='*', help='ePub files (default: samples/*.epub)')
+    parser.add_argument('--books', type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    samples = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'samples', '*.epub')
+    blobs = []
+    for filepath in args.files or sorted(glob.glob(samples)):
+        try:
+            data = get_epub_metadata(filepath, read_cover_image=False)
+        except Exception as e:
+            print('Skipping {}: {}'.format(filepath, e))
+            continue
+        blobs.append(pickle.dumps(dict(data)))
+
+    print('{} books ({} distinct), metadata with the ToC, without the cover'.format(args.books, len(blobs)))
+    results = {}
+    for name, convert in (('odict', lambda data: data), ('compact', EpubMetadata.from_dict)):
+        results[name] = measure(blobs, args.books, convert)
+        print('{:>8}: {:8.1f} MiB, {:6.0f} bytes per book'.format(
+            name, results[name] / 1024.0 ** 2, results[name] / float(args.books)))
+    print('{:>8}: {:.1f}x less memory'.format('ratio', results['odict'] / float(results['compact'])))
+
+
+if __name__ == '__main__':
+    main()
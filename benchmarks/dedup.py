@@ -0,0 +1,71 @@
+'''
+Deduplication: extracting a library where each book has several copies
+(byte-identical and repackaged), with get_epub_metadata versus a DedupIndex
+which only reads the central directory of the copies.
+
+    python benchmarks/dedup.py [--copies 10] [epub files...]
+'''
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from epub_meta import DedupIndex, get_epub_metadata  # noqa: E402
+
+
+def library(filepaths, copies, tmp_dir):
+    paths = []
+    for i, filepath in enumerate(filepaths):
+        for copy in range(copies):
+            path = os.path.join(tmp_dir, '{}-{}.epub'.format(i, copy))
+            if copy % 2:
+                shutil.copy(filepath, path)
+            else:
+                with zipfile.ZipFile(filepath) as source, zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+                    for zinfo in source.infolist():
+                        zf.writestr(zinfo.filename, source.read(zinfo))
+            paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('files', nargs='*', help='ePub files (default: samples/*.epub)')
+    parser.add_argument('--copies', type=int, default=10)
+    args = parser.parse_args(argv)
+    samples = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'samples', '*.epub')
+    filepaths = []
+    for filepath in args.files or sorted(glob.glob(samples)):
+        try:
+            get_epub_metadata(filepath)
+            filepaths.append(filepath)
+        except Exception as e:
+            print('Skipping {}: {}'.format(filepath, e))
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        paths = library(filepaths, args.copies, tmp_dir)
+        print('{} books, {} copies each'.format(len(filepaths), args.copies))
+        start = time.perf_counter()
+        for path in paths:
+            get_epub_metadata(path)
+        print('{:>18}: {:8.1f} ms'.format('get_epub_metadata', (time.perf_counter() - start) * 1000))
+        index = DedupIndex(os.path.join(tmp_dir, 'dedup.db'))
+        start = time.perf_counter()
+        for path in paths:
+            index.get_epub_metadata(path)
+        print('{:>18}: {:8.1f} ms, {} duplicate groups'.format('DedupIndex', (time.perf_counter() - start) * 1000,
+                                                              len(index.duplicates())))
+        index.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
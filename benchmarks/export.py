@@ -0,0 +1,80 @@
+'''
+Exporting scan results to Parquet: collecting the odict results in a list
+then converting it to a table, versus streaming them into the column
+builders of epub_meta.export (row groups of --row-group-size rows).
+
+Peak memory of the Python objects (tracemalloc). The Arrow buffers are
+bounded by the row groups too in the streaming case.
+
+    python benchmarks/export.py [--books 20000] [epub files...]
+'''
+import argparse
+import gc
+import glob
+import os
+import pickle
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from epub_meta import get_epub_metadata  # noqa: E402
+from epub_meta import export  # noqa: E402
+
+
+def results(blobs, books):
+    # New objects for each book, like a scan
+    for i in range(books):
+        yield 'book{}.epub'.format(i), pickle.loads(blobs[i % len(blobs)])
+
+
+def list_then_table(blobs, books, filepath, row_group_size):
+    import pyarrow.parquet
+    rows = [dict(data, path=path, error=None) for path, data in results(blobs, books)]
+    table = pyarrow.Table.from_pylist(rows, schema=export.arrow_schema())
+    pyarrow.parquet.write_table(table, filepath, row_group_size=row_group_size)
+
+
+def streaming(blobs, books, filepath, row_group_size):
+    export.export_metadata(results(blobs, books), filepath, row_group_size=row_group_size)
+
+
+def measure(function, *args):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    function(*args)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('files', nargs='*', help='ePub files (default: samples/*.epub)')
+    parser.add_argument('--books', type=int, default=20000)
+    parser.add_argument('--row-group-size', type=int, default=2000)
+    args = parser.parse_args(argv)
+    if export.pyarrow is None:
+        sys.exit('pyarrow is required: pip install pyarrow')
+
+    samples = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'samples', '*.epub')
+    blobs = []
+    for filepath in args.files or sorted(glob.glob(samples)):
+        try:
+            blobs.append(pickle.dumps(dict(get_epub_metadata(filepath, read_cover_image=False))))
+        except Exception as e:
+            print('Skipping {}: {}'.format(filepath, e))
+
+    print('{} books to Parquet, row groups of {} rows'.format(args.books, args.row_group_size))
+    with tempfile.NamedTemporaryFile(suffix='.parquet') as f:
+        for name, function in (('list + table', list_then_table), ('streaming', streaming)):
+            seconds, peak = measure(function, blobs, args.books, f.name, args.row_group_size)
+            print('{:>12}: {:8.2f} s, peak memory {:8.1f} MiB'.format(name, seconds, peak / 1024.0 ** 2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+'''
+Selective extraction: the default metadata (without cover and ToC) versus
+get_epub_metadata(fields=...) for a dedup job (identifiers) and a listing
+(title, authors), on the samples/ corpus and the huge_opf stress file.
+
+    python benchmarks/fields.py [epub files...]
+'''
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+BENCHMARKS_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..'))
+
+from epub_meta import get_epub_metadata  # noqa: E402
+from stress_epubs import huge_opf  # noqa: E402
+
+
+CASES = [
+    ('all fields', {}),
+    ('identifiers', {'fields': {'identifiers'}}),
+    ('title, authors', {'fields': {'title', 'authors'}}),
+    ('file size', {'fields': {'file_size_in_bytes'}}),
+]
+
+
+def main(filepaths, number=20):
+    print('{} ePub files, ms per corpus (best of 5)'.format(len(filepaths)))
+    baseline = None
+    for name, options in CASES:
+        def run():
+            for filepath in filepaths:
+                get_epub_metadata(filepath, read_cover_image=False, read_toc=False, **options)
+        seconds = min(timeit.repeat(run, number=number, repeat=5)) / number
+        baseline = baseline or seconds
+        print('{:>16}: {:8.3f} ms ({:.1f}x)'.format(name, seconds * 1000, baseline / seconds))
+
+
+if __name__ == '__main__':
+    samples = sys.argv[1:] or sorted(glob.glob(os.path.join(BENCHMARKS_DIR, '..', 'samples', '*.epub')))
+    print('samples')
+    main(samples)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        print('huge_opf')
+        main([huge_opf(os.path.join(tmp_dir, 'huge_opf.epub'))], number=3)
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,60 @@
+'''
+Metadata of ePub files already in memory (e.g. uploads): writing them to a
+temporary file first versus reading the bytes in place.
+
+    python benchmarks/memory_input.py [epub files...]
+'''
+import glob
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from epub_meta import get_epub_metadata  # noqa: E402
+
+
+def temp_file(content, **options):
+    with tempfile.NamedTemporaryFile(suffix='.epub') as f:
+        f.write(content)
+        f.flush()
+        return get_epub_metadata(f.name, **options)
+
+
+def in_memory(content, **options):
+    return get_epub_metadata(content, **options)
+
+
+def run(function, contents, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        for content in contents:
+            function(content, read_cover_image=False)
+    seconds = time.time() - start
+    tracemalloc.start()
+    for content in contents:
+        function(content, read_cover_image=False)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main(filepaths, repeat=20):
+    contents = []
+    for filepath in filepaths:
+        with open(filepath, 'rb') as f:
+            contents.append(f.read())
+    total = sum(len(content) for content in contents)
+    print('{} ePub files ({:.1f} MiB), metadata without the cover, {} times'.format(
+        len(contents), total / 1024.0 ** 2, repeat))
+    for name, function in (('temp file', temp_file), ('in memory', in_memory)):
+        seconds, peak = run(function, contents, repeat)
+        print('{:>10}: {:.2f} ms per file, peak allocations {:.0f} KiB'.format(
+            name, seconds * 1000 / (len(contents) * repeat), peak / 1024.0))
+
+
+if __name__ == '__main__':
+    samples = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'samples', '*.epub')
+    main(sys.argv[1:] or sorted(glob.glob(samples)))
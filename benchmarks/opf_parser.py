@@ -0,0 +1,101 @@
+'''
+Compares the single-pass OPF engine with the previous minidom implementation
+on the samples/ corpus (time and peak memory of the metadata parsing).
+
+    python benchmarks/opf_parser.py [epub files...]
+'''
+import glob
+import os
+import sys
+import timeit
+import tracemalloc
+import zipfile
+from xml.dom import minidom
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from epub_meta import discovery  # noqa: E402
+from epub_meta.parser import iterate_elements, parse_container, parse_opf  # noqa: E402
+
+
+DC_FIELDS = (('title', True), ('language', True), ('description', True), ('creator', False),
+             ('publisher', True), ('date', True), ('identifier', False), ('subject', False))
+
+HTML_MEMBERS = ('OEBPS/pr01.html', 'OEBPS/pr02.html')
+
+
+def minidom_dc(xmldoc, name, first_only=True):
+    # Previous implementation: one full scan per tag name, with and without the dc: prefix
+    value = None
+    for tag_name in (name, 'dc:{}'.format(name)):
+        tags = xmldoc.getElementsByTagName(tag_name)
+        if first_only:
+            value = tags[0].firstChild.nodeValue if tags and tags[0].firstChild else None
+        else:
+            value = [n.firstChild.nodeValue for n in tags if n.firstChild]
+        if value:
+            break
+    return value
+
+
+def minidom_engine(members):
+    container = minidom.parseString(members['META-INF/container.xml'])
+    container.getElementsByTagName('rootfile')[0].attributes['full-path'].value
+    opf = minidom.parseString(members['opf'])
+    opf.getElementsByTagName('package')
+    for name, first_only in DC_FIELDS:
+        minidom_dc(opf, name, first_only)
+    for name in HTML_MEMBERS:
+        if name in members:
+            minidom.parseString(members[name])
+
+
+def single_pass_engine(members):
+    parse_container(members['META-INF/container.xml'])
+    opf = parse_opf(members['opf'])
+    opf.version
+    for name, first_only in DC_FIELDS:
+        discovery.__discover_dc(opf, name, first_only)
+    # The HTML fallbacks are only parsed on demand, when the OPF has no
+    # authors or publish date.
+    if not discovery.__discover_dc(opf, 'creator', False):
+        for name in HTML_MEMBERS:
+            if name in members:
+                iterate_elements(members[name], ('strong', 'p', 'span'))
+
+
+def load_members(filepath):
+    zf = zipfile.ZipFile(filepath)
+    container = zf.read('META-INF/container.xml')
+    members = {'META-INF/container.xml': container, 'opf': zf.read(parse_container(container)[0])}
+    for name in HTML_MEMBERS:
+        if name in zf.namelist():
+            members[name] = zf.read(name)
+    return members
+
+
+def measure(engine, corpus, number):
+    seconds = min(timeit.repeat(lambda: [engine(m) for m in corpus], number=number, repeat=5)) / number
+    tracemalloc.start()
+    for members in corpus:
+        engine(members)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main(filepaths):
+    corpus = [load_members(filepath) for filepath in filepaths]
+    print('{} ePub files'.format(len(corpus)))
+    results = {}
+    for name, engine in (('minidom', minidom_engine), ('single-pass', single_pass_engine)):
+        results[name] = measure(engine, corpus, number=20)
+        print('{:>12}: {:8.3f} ms per corpus, peak memory {:8.1f} KiB'.format(
+            name, results[name][0] * 1000, results[name][1] / 1024.0))
+    old, new = results['minidom'], results['single-pass']
+    print('{:>12}: {:.1f}x faster, {:.1f}x less peak memory'.format('speedup', old[0] / new[0], old[1] / float(new[1])))
+
+
+if __name__ == '__main__':
+    samples = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'samples', '*.epub')
+    main(sys.argv[1:] or sorted(glob.glob(samples)))
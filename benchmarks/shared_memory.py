@@ -0,0 +1,46 @@
+'''
+Cover-heavy batches with the process pool: results pickled through the pipe
+versus the cover images and ToCs sent through shared memory.
+
+    python benchmarks/shared_memory.py [copies] [cover size in MiB]
+'''
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from epub_meta import iter_epub_metadata  # noqa: E402
+from stress_epubs import large_cover, ncx_10k  # noqa: E402
+
+
+def run(paths, shared_memory, **options):
+    start = time.time()
+    for path, data in iter_epub_metadata(paths, workers=4, chunksize=1, shared_memory=shared_memory, **options):
+        if shared_memory:
+            data.release()
+    return time.time() - start
+
+
+def main(copies=32, cover_mib=16):
+    dirpath = tempfile.mkdtemp()
+    try:
+        cover = large_cover(os.path.join(dirpath, 'large_cover.epub'), size=cover_mib * 1024 * 1024)
+        toc = ncx_10k(os.path.join(dirpath, 'ncx_10k.epub'))
+        print('{} copies of each book, 4 worker processes'.format(copies))
+        cases = [('{} MiB cover, base64'.format(cover_mib), cover, 'base64'),
+                 ('{} MiB cover, raw'.format(cover_mib), cover, None),
+                 ('11.1k entries ToC', toc, None)]
+        for name, path, encoding in cases:
+            for shared_memory in (False, True):
+                seconds = run([path] * copies, shared_memory, cover_image_encoding=encoding)
+                print('{:>22}, {:>7}: {:.1f} ms per file'.format(
+                    name, 'shared' if shared_memory else 'pickled', seconds * 1000 / copies))
+    finally:
+        shutil.rmtree(dirpath)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
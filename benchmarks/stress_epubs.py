@@ -0,0 +1,121 @@
+'''
+Synthetic ePub files for the benchmarks, built to stress one code path each:
+
+- huge_opf: 20k manifest items / spine entries and thousands of metadata tags
+- ncx_10k: an ePub 2 NCX ToC with 10k entries in 3 levels (11.1k with the parents)
+- deep_nav: an ePub 3 nav ToC nested 200 levels deep
+- large_cover: a 16 MiB (stored) cover image
+
+    python benchmarks/stress_epubs.py output_dir
+'''
+import os
+import random
+import sys
+import zipfile
+
+
+CONTAINER = '''<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>'''
+
+OPF = '''<?xml version="1.0"?>
+<package version="{version}" xmlns="http://www.idpf.org/2007/opf" xmlns:dc="http://purl.org/dc/elements/1.1/">
+  <metadata>
+    <dc:title>{title}</dc:title>
+    <dc:language>en</dc:language>
+    <dc:identifier>urn:uuid:00000000-0000-0000-0000-{number:012d}</dc:identifier>
+    {metadata}
+  </metadata>
+  <manifest>{manifest}</manifest>
+  <spine toc="ncx">{spine}</spine>
+</package>'''
+
+
+def _write_epub(filepath, title, version='2.0', metadata='', manifest='', spine='', members=None, number=0):
+    with zipfile.ZipFile(filepath, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(zipfile.ZipInfo('mimetype'), 'application/epub+zip')
+        zf.writestr('META-INF/container.xml', CONTAINER)
+        zf.writestr('OEBPS/content.opf', OPF.format(version=version, title=title, metadata=metadata,
+                                                    manifest=manifest, spine=spine, number=number))
+        for name, (content, compression) in sorted((members or {}).items()):
+            zf.writestr(name, content, compression)
+    return filepath
+
+
+def _chapters(count):
+    manifest = ''.join('<item id="c{0}" href="text/c{0}.xhtml" media-type="application/xhtml+xml"/>'.format(i)
+                       for i in range(count))
+    spine = ''.join('<itemref idref="c{}"/>'.format(i) for i in range(count))
+    return manifest, spine
+
+
+def huge_opf(filepath):
+    manifest, spine = _chapters(20000)
+    metadata = ''.join('<dc:creator>Author {}</dc:creator>'.format(i) for i in range(500))
+    metadata += ''.join('<dc:subject>Subject {}</dc:subject>'.format(i) for i in range(5000))
+    metadata += ''.join('<meta name="custom{0}" content="value {0}"/>'.format(i) for i in range(5000))
+    return _write_epub(filepath, 'Huge OPF', metadata=metadata, manifest=manifest, spine=spine, number=1)
+
+
+def ncx_10k(filepath):
+    manifest, spine = _chapters(100)
+    manifest += '<item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>'
+
+    # 100 chapters x 10 sections x 10 subsections: 10k entries (+ 1100 parents)
+    nav_points = []
+    for chapter in range(100):
+        sections = []
+        for section in range(10):
+            subsections = ''.join(
+                '<navPoint id="p{0}.{1}.{2}"><navLabel><text>Subsection {0}.{1}.{2}</text></navLabel>'
+                '<content src="text/c{0}.xhtml#s{1}.{2}"/></navPoint>'.format(chapter, section, i)
+                for i in range(10))
+            sections.append('<navPoint id="p{0}.{1}"><navLabel><text>Section {0}.{1}</text></navLabel>'
+                            '<content src="text/c{0}.xhtml#s{1}"/>{2}</navPoint>'.format(chapter, section, subsections))
+        nav_points.append('<navPoint id="p{0}"><navLabel><text>Chapter {0}</text></navLabel>'
+                          '<content src="text/c{0}.xhtml"/>{1}</navPoint>'.format(chapter, ''.join(sections)))
+    nav_map = ''.join(nav_points)
+    ncx = ('<?xml version="1.0"?><ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">'
+           '<docTitle><text>NCX 10k</text></docTitle><navMap>{}</navMap></ncx>').format(nav_map)
+    return _write_epub(filepath, 'NCX 10k', manifest=manifest, spine=spine, number=2,
+                       members={'OEBPS/toc.ncx': (ncx, zipfile.ZIP_DEFLATED)})
+
+
+def deep_nav(filepath, depth=200):
+    manifest, spine = _chapters(depth)
+    manifest += '<item id="nav" properties="nav" href="nav.xhtml" media-type="application/xhtml+xml"/>'
+    nav = ''
+    for level in reversed(range(depth)):
+        nav = '<ol><li><a href="text/c{0}.xhtml">Level {0}</a>{1}</li></ol>'.format(level, nav)
+    nav = ('<?xml version="1.0"?><html xmlns="http://www.w3.org/1999/xhtml" '
+           'xmlns:epub="http://www.idpf.org/2007/ops"><body><nav epub:type="toc">{}</nav></body></html>').format(nav)
+    return _write_epub(filepath, 'Deep nav', version='3.0', manifest=manifest, spine=spine, number=3,
+                       members={'OEBPS/nav.xhtml': (nav, zipfile.ZIP_DEFLATED)})
+
+
+def large_cover(filepath, size=16 * 1024 * 1024):
+    manifest, spine = _chapters(10)
+    manifest += '<item id="cover-image" href="images/cover.jpg" media-type="image/jpeg"/>'
+    # Random bytes: incompressible, like the JPEG data
+    image = b'\xff\xd8\xff\xe0' + random.Random(0).getrandbits(8 * (size - 4)).to_bytes(size - 4, 'little')
+    return _write_epub(filepath, 'Large cover', metadata='<meta name="cover" content="cover-image"/>',
+                       manifest=manifest, spine=spine, number=4,
+                       members={'OEBPS/images/cover.jpg': (image, zipfile.ZIP_STORED)})
+
+
+GENERATORS = [huge_opf, ncx_10k, deep_nav, large_cover]
+
+
+def build_stress_epubs(dirpath):
+    '''
+    Writes the stress ePub files in the directory.
+    Returns a list of (name, file path) tuples.
+    '''
+    return [(generator.__name__, generator(os.path.join(dirpath, generator.__name__ + '.epub')))
+            for generator in GENERATORS]
+
+
+if __name__ == '__main__':
+    for name, filepath in build_stress_epubs(sys.argv[1]):
+        print('{}: {} ({} bytes)'.format(name, filepath, os.path.getsize(filepath)))
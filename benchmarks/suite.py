@@ -0,0 +1,238 @@
+'''
+Benchmark suite of the collector hot paths, over the samples and the
+synthetic stress ePub files (see stress_epubs.py).
+
+For every ePub file, it reports the time (best and median of --repeat runs,
+with the garbage collector disabled like timeit) and the peak memory
+allocations (tracemalloc) of each phase: opening the file, parsing the OPF
+file, each metadata loader (title, authors, cover_image_content, toc...) and
+the whole get_epub_metadata call (total).
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --baseline baseline.json  # exit status 1 on regressions
+
+A phase regresses when its median time is slower than the baseline by more
+than --threshold (relative) and --min-seconds (absolute, to ignore the noise
+of very fast phases), or when its peak memory grows by more than
+--memory-threshold and --min-bytes. The runs of the files are interleaved,
+and the files with a slower phase are measured again (--recheck times)
+before it is reported, to filter out the short slow periods of the machine.
+Compare runs of the same machine, one right after the other: the CI workflow
+runs the suite of the base commit of a pull request, then this one with its
+results as the baseline.
+'''
+import argparse
+import datetime
+import gc
+import glob
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARKS_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..'))
+
+from epub_meta import get_epub_metadata  # noqa: E402
+from epub_meta.discovery import discover_opf_filepath, metadata_loaders, open_epub, parse_opf  # noqa: E402
+from stress_epubs import build_stress_epubs  # noqa: E402
+
+
+def _phases(filepath):
+    '''
+    Yields (phase name, function) pairs, to be called in order.
+    '''
+    state = {}
+
+    def open_book():
+        state['zf'], state['file_size'] = open_epub(filepath)
+        state['opf_filepath'] = discover_opf_filepath(state['zf'])
+
+    def opf():
+        state['opf'] = parse_opf(state['zf'].read(state['opf_filepath']))
+
+    yield 'open', open_book
+    yield 'opf', opf
+    for keys, loader in metadata_loaders(state['file_size'], state['zf'], state['opf'], state['opf_filepath']):
+        yield keys[0], loader
+    state['zf'].close()
+    yield 'total', lambda: get_epub_metadata(filepath)
+
+
+def _measure_times(cases, repeat):
+    # Returns case name -> phase name -> list of the times of each run. The
+    # runs of the cases are interleaved: a slow period of the machine
+    # doesn't spoil every run of a case.
+    times = dict((name, {}) for name, filepath in cases)
+    for _ in range(repeat):
+        for name, filepath in cases:
+            gc.collect()
+            gc.disable()
+            try:
+                for phase, function in _phases(filepath):
+                    start = time.perf_counter()
+                    function()
+                    times[name].setdefault(phase, []).append(time.perf_counter() - start)
+            finally:
+                gc.enable()
+    return times
+
+
+def _measure_memory(filepath):
+    peaks = {}
+    tracemalloc.start()
+    try:
+        for name, function in _phases(filepath):
+            # The garbage of the previous phases (e.g. DOM reference cycles)
+            # would be freed during this one
+            gc.collect()
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            function()
+            peaks[name] = tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def run(cases, repeat):
+    '''
+    cases: (name, file path) pairs
+    Returns the results dict (saved as JSON).
+    '''
+    results = {}
+    for name, times in _measure_times(cases, repeat).items():
+        peaks = _measure_memory(dict(cases)[name])
+        results[name] = dict((phase, {'seconds': min(times[phase]), 'median_seconds': statistics.median(times[phase]),
+                                      'peak_bytes': peaks[phase]}) for phase in times)
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date': datetime.datetime.now().isoformat(),
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def recheck(current, cases, repeat):
+    '''
+    Measures the times of the cases again, keeping the best (and the lowest
+    median) of both series.
+    '''
+    for name, phases in _measure_times(cases, repeat).items():
+        for phase, times in phases.items():
+            values = current['results'][name][phase]
+            values['seconds'] = min(values['seconds'], min(times))
+            values['median_seconds'] = min(_median(values), statistics.median(times))
+
+
+def _median(values):
+    # Baselines saved before the median was recorded have the best time only
+    return values.get('median_seconds', values['seconds'])
+
+
+def _slower(base, values, threshold, min_seconds):
+    delta = _median(values) - _median(base)
+    return delta > min_seconds and delta > _median(base) * threshold
+
+
+def slower_cases(baseline, current, threshold=0.2, min_seconds=0.001):
+    '''
+    Returns the names of the cases with a phase slower than the baseline.
+    '''
+    return set(case for case, phases in current['results'].items() for phase, values in phases.items()
+               if phase in baseline['results'].get(case, {}) and
+               _slower(baseline['results'][case][phase], values, threshold, min_seconds))
+
+
+def compare(baseline, current, threshold=0.2, min_seconds=0.001, memory_threshold=0.1, min_bytes=64 * 1024):
+    '''
+    Returns the regressions: a list of messages.
+    '''
+    regressions = []
+    for case, phases in sorted(current['results'].items()):
+        for phase, values in sorted(phases.items()):
+            base = baseline['results'].get(case, {}).get(phase)
+            if base is None:
+                continue
+            if _slower(base, values, threshold, min_seconds):
+                regressions.append('{} {}: median {:.2f} ms -> {:.2f} ms (+{:.0%})'.format(
+                    case, phase, _median(base) * 1000, _median(values) * 1000, _median(values) / _median(base) - 1))
+            delta = values['peak_bytes'] - base['peak_bytes']
+            if delta > min_bytes and delta > base['peak_bytes'] * memory_threshold:
+                regressions.append('{} {}: peak {:.0f} KiB -> {:.0f} KiB'.format(
+                    case, phase, base['peak_bytes'] / 1024.0, values['peak_bytes'] / 1024.0))
+    return regressions
+
+
+def report(current, baseline=None):
+    for case, phases in sorted(current['results'].items()):
+        print(case)
+        for phase, values in phases.items():
+            line = '  {:<22} {:>10.3f} ms (median {:>10.3f} ms) {:>10.0f} KiB'.format(
+                phase, values['seconds'] * 1000, _median(values) * 1000,
+                values['peak_bytes'] / 1024.0)
+            base = baseline and baseline['results'].get(case, {}).get(phase)
+            if base:
+                line += '   (baseline median {:.3f} ms {:.0f} KiB)'.format(_median(base) * 1000,
+                                                                         base['peak_bytes'] / 1024.0)
+            print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('files', nargs='*', help='ePub files (default: samples/*.epub)')
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--recheck', type=int, default=2, help='measure the slower files again (at most N times)')
+    parser.add_argument('--no-stress', action='store_true', help='skip the synthetic stress ePub files')
+    parser.add_argument('--output', help='save the results (JSON)')
+    parser.add_argument('--baseline', help='results (JSON) to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    parser.add_argument('--min-seconds', type=float, default=0.001)
+    parser.add_argument('--memory-threshold', type=float, default=0.1)
+    parser.add_argument('--min-bytes', type=int, default=64 * 1024)
+    args = parser.parse_args(argv)
+
+    filepaths = args.files or sorted(glob.glob(os.path.join(BENCHMARKS_DIR, '..', 'samples', '*.epub')))
+    cases = [(os.path.basename(filepath), filepath) for filepath in filepaths]
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        if not args.no_stress:
+            cases.extend(build_stress_epubs(tmp_dir))
+        current = run(cases, args.repeat)
+        for _ in range(args.recheck if baseline else 0):
+            slower = slower_cases(baseline, current, threshold=args.threshold, min_seconds=args.min_seconds)
+            if not slower:
+                break
+            recheck(current, [case for case in cases if case[0] in slower], args.repeat)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    report(current, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+
+    if baseline:
+        regressions = compare(baseline, current, threshold=args.threshold, min_seconds=args.min_seconds,
+                              memory_threshold=args.memory_threshold, min_bytes=args.min_bytes)
+        if regressions:
+            print('\nRegressions:')
+            for regression in regressions:
+                print('  ' + regression)
+            return 1
+        print('\nNo regressions')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+'''
+Compares the streaming ToC engine with the previous minidom implementation
+(time and peak memory of the ToC extraction) on the stress ePub files with
+large ToCs (ncx_10k, deep_nav) and the samples/ corpus.
+
+    python benchmarks/toc_parser.py [epub files...]
+'''
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+import tracemalloc
+import zipfile
+from xml.dom import minidom
+
+BENCHMARKS_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..'))
+
+from epub_meta import discovery  # noqa: E402
+from epub_meta.discovery import unquote  # noqa: E402
+from stress_epubs import deep_nav, ncx_10k  # noqa: E402
+
+
+def minidom_nav(content):
+    # Previous implementation: a DOM, then up to 50 parentNode hops per <a>
+    toc = []
+    for n in minidom.parseString(content).getElementsByTagName('a'):
+        if n.firstChild and 'href' in n.attributes.keys():
+            href = unquote(n.attributes['href'].value)
+            if '.html' in href or '.xhtml' in href:
+                title = n.firstChild.nodeValue
+                if not title and n.firstChild.firstChild:
+                    title = n.firstChild.firstChild.nodeValue
+                title = title.strip() if title else None
+                if title:
+                    level = -1
+                    parent_node = n.parentNode
+                    hops = 0
+                    while parent_node and parent_node.nodeName != 'nav' and hops < 50:
+                        if parent_node.nodeName == 'ol':
+                            level += 1
+                        parent_node = parent_node.parentNode
+                        hops += 1
+                    toc.append({'title': title, 'src': href, 'level': max(level, 0)})
+    return toc
+
+
+def minidom_ncx(content):
+    # Previous implementation: a DOM, then a recursion over the navPoints
+    # with a getElementsByTagName('text') per navLabel
+    def read_nav_point(node, level):
+        item = {'title': None, 'src': None, 'level': level}
+        children = []
+        for child in node.childNodes:
+            if child.nodeName in ('navLabel', 'ncx:navLabel'):
+                texts = child.getElementsByTagName('text') or child.getElementsByTagName('ncx:text')
+                text = texts[0].firstChild if texts else None
+                item['title'] = text.nodeValue.strip() if text and text.nodeValue else None
+            elif child.nodeName in ('content', 'ncx:content') and child.hasAttribute('src'):
+                item['src'] = child.attributes['src'].value
+            elif child.nodeName in ('navPoint', 'ncx:navPoint'):
+                children.append(child)
+        if not item['title']:
+            return []
+        items = [item]
+        for child in children:
+            items.extend(read_nav_point(child, level + 1))
+        return items
+
+    xmldoc = minidom.parseString(content)
+    nav_maps = xmldoc.getElementsByTagName('navMap') or xmldoc.getElementsByTagName('ncx:navMap')
+    toc = []
+    for node in nav_maps[0].childNodes if nav_maps else ():
+        if node.nodeName in ('navPoint', 'ncx:navPoint'):
+            toc.extend(read_nav_point(node, 0))
+    return toc
+
+
+def minidom_engine(zf, opf, opf_filepath):
+    xhtml, ncx = discovery.discover_toc_paths(opf, opf_filepath)
+    toc = minidom_nav(zf.read(xhtml)) if xhtml else None
+    if not toc and ncx:
+        toc = minidom_ncx(zf.read(ncx))
+    for index, entry in enumerate(toc or ()):
+        entry['index'] = index
+    return toc
+
+
+def streaming_engine(zf, opf, opf_filepath):
+    return discovery.discover_toc(zf, opf, opf_filepath)
+
+
+def measure(engine, zf, opf, opf_filepath, number):
+    seconds = min(timeit.repeat(lambda: engine(zf, opf, opf_filepath), number=number, repeat=3)) / number
+    tracemalloc.start()
+    engine(zf, opf, opf_filepath)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main(cases):
+    for name, filepath in cases:
+        zf = zipfile.ZipFile(filepath)
+        opf_filepath = discovery.discover_opf_filepath(zf)
+        opf = discovery.parse_opf(zf.read(opf_filepath))
+        results = {}
+        for engine_name, engine in (('minidom', minidom_engine), ('streaming', streaming_engine)):
+            results[engine_name] = measure(engine, zf, opf, opf_filepath, number=3)
+        zf.close()
+        old, new = results['minidom'], results['streaming']
+        print('{:<36} minidom {:9.2f} ms {:9.0f} KiB   streaming {:9.2f} ms {:9.0f} KiB   {:5.1f}x faster'.format(
+            name, old[0] * 1000, old[1] / 1024.0, new[0] * 1000, new[1] / 1024.0, old[0] / new[0]))
+
+
+if __name__ == '__main__':
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        cases = [(generator.__name__, generator(os.path.join(tmp_dir, generator.__name__ + '.epub')))
+                 for generator in (ncx_10k, deep_nav)]
+        samples = sys.argv[1:] or sorted(glob.glob(os.path.join(BENCHMARKS_DIR, '..', 'samples', '*.epub')))
+        cases.extend((os.path.basename(filepath), filepath) for filepath in samples)
+        main(cases)
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,112 @@
+'''
+Counts the file system calls (open, stat, seek, read/pread) needed to open the ePub
+files and read their metadata: previous opener (zipfile.is_zipfile, then
+zipfile.ZipFile, then os.path.getsize) versus epub_meta.archive.open_epub_zip.
+
+    python benchmarks/zip_open.py [epub files...]
+'''
+import builtins
+import glob
+import io
+import os
+import sys
+import time
+import zipfile
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from epub_meta import get_epub_metadata  # noqa: E402
+from epub_meta.archive import open_epub_zip  # noqa: E402
+
+
+calls = Counter()
+
+
+class CountingFileIO(io.FileIO):
+    def seek(self, *args):
+        calls['seek'] += 1
+        return io.FileIO.seek(self, *args)
+
+    def read(self, *args):
+        calls['read'] += 1
+        return io.FileIO.read(self, *args)
+
+    def readinto(self, buffer):
+        calls['read'] += 1
+        return io.FileIO.readinto(self, buffer)
+
+    def readall(self):
+        calls['read'] += 1
+        return io.FileIO.readall(self)
+
+
+real_open = builtins.open
+real_stat = os.stat
+real_pread = getattr(os, 'pread', None)
+
+
+def counting_open(file, mode='r', buffering=-1, *args, **kwargs):
+    if mode != 'rb' or not isinstance(file, str):
+        return real_open(file, mode, buffering, *args, **kwargs)
+    calls['open'] += 1
+    raw = CountingFileIO(file, 'rb')
+    return raw if buffering == 0 else io.BufferedReader(raw)
+
+
+def counting_stat(*args, **kwargs):
+    calls['stat'] += 1
+    return real_stat(*args, **kwargs)
+
+
+def counting_pread(*args):
+    calls['read'] += 1
+    return real_pread(*args)
+
+
+def previous_opener(filepath):
+    if not zipfile.is_zipfile(filepath):
+        raise ValueError('Unknown file')
+    zf = zipfile.ZipFile(filepath, 'r', compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+    os.path.getsize(filepath)
+    return zf
+
+
+def fast_opener(filepath):
+    return open_epub_zip(filepath)[0]
+
+
+def run(opener, filepaths):
+    calls.clear()
+    builtins.open, io.open, os.stat = counting_open, counting_open, counting_stat
+    if real_pread is not None:
+        os.pread = counting_pread
+    try:
+        start = time.time()
+        for filepath in filepaths:
+            zf = opener(filepath)
+            zf.read('META-INF/container.xml')
+            zf.close()
+        seconds = time.time() - start
+    finally:
+        builtins.open, io.open, os.stat = real_open, real_open, real_stat
+        if real_pread is not None:
+            os.pread = real_pread
+    return dict(calls), seconds
+
+
+def main(filepaths):
+    print('{} ePub files, open + container.xml read'.format(len(filepaths)))
+    for name, opener in (('previous', previous_opener), ('fast', fast_opener)):
+        counts, seconds = run(opener, filepaths)
+        print('{:>9}: {} ({:.2f} ms per file)'.format(name, ', '.join(
+            '{} {}'.format(key, counts.get(key, 0)) for key in ('open', 'stat', 'seek', 'read')),
+            seconds * 1000 / len(filepaths)))
+    # Sanity check: whole metadata with the fast opener
+    for filepath in filepaths:
+        get_epub_metadata(filepath, read_cover_image=False, read_toc=False)
+
+
+if __name__ == '__main__':
+    samples = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'samples', '*.epub')
+    main(sys.argv[1:] or sorted(glob.glob(samples)))
@@ -1,4 +1,19 @@
+from epub_meta.aio import async_get_epub_metadata, async_iter_epub_metadata
+from epub_meta.book import EpubBook
+from epub_meta.cache import MetadataCache
+from epub_meta.compact import EpubMetadata, TocEntry
 from epub_meta.collector import get_epub_metadata, get_epub_opf_xml
-from epub_meta.exceptions import EPubException
+from epub_meta.collector import get_epub_cover_image, open_epub_cover_image, get_epub_cover_image_info
+from epub_meta.collector import get_epub_toc, iter_epub_toc, iter_epub_text
+from epub_meta.dedup import DedupIndex, book_fingerprint
+from epub_meta.exceptions import EPubException, EPubLimitError, EPubTimeoutError
+from epub_meta.instrumentation import PhaseStats, instrument
+from epub_meta.limits import Limits
+from epub_meta.scanner import iter_epub_metadata, scan_directory
+from epub_meta.strategies import StrategyRegistry, default_strategies
+from epub_meta.text import TextChunk
+from epub_meta.toc import TocColumns
+from epub_meta.transport import SharedMetadata
+from epub_meta.watcher import DirectoryWatcher, WatchEvent, watch_directory
 
 VERSION = '0.0.7'
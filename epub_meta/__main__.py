@@ -0,0 +1,5 @@
+import sys
+
+from epub_meta.cli import main
+
+sys.exit(main())
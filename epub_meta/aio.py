@@ -0,0 +1,368 @@
+'''
+asyncio API: the metadata is read through ranged reads (only the zip central
+directory, container.xml, the OPF file and, on request, the cover image and
+ToC members are fetched), so ePub files on object storage or on slow
+network file systems don't block the event loop or get fully downloaded.
+
+A reader is any object with two coroutine methods:
+
+    async def get_size(self): returns the file size in bytes
+    async def read_range(self, offset, size): returns the bytes [offset, offset + size)
+
+AsyncFileReader (local or network file systems) and HTTPRangeReader (HTTP
+servers and S3-compatible stores, e.g. presigned URLs) are provided.
+'''
+import asyncio
+import os
+import zipfile
+from urllib.request import Request, urlopen
+
+from epub_meta.archive import TAIL_SIZE, RandomAccessFile, _check_mimetype
+from epub_meta.compact import EpubMetadata
+from epub_meta.discovery import discover_cover_image_path, discover_opf_filepath, discover_toc_paths, odict
+from epub_meta.discovery import check_fields, metadata_loaders, opf_plan, read_opf, update_metadata
+from epub_meta.exceptions import EPubException
+from epub_meta.limits import LimitedZipFile
+
+
+# Smallest ranged read: zipfile reads a local file header in a few small
+# steps, and the next ones are likely close.
+MIN_READ_SIZE = 16 * 1024
+
+# Room for the local file header (name and extra field) of a member, which
+# may differ from the central directory one.
+LOCAL_HEADER_SLACK = 1024
+
+
+class _MissingRange(BaseException):
+    # BaseException, so the collector code can't swallow it (and the
+    # instrumentation doesn't report it as a failed phase)
+    def __init__(self, offset, size):
+        BaseException.__init__(self, offset, size)
+        self.offset = offset
+        self.size = size
+
+
+class _SparseFile(RandomAccessFile):
+    '''
+    Read-only file of a known size of which only some ranges are in memory.
+    Reading anything else raises _MissingRange: the caller fetches it and
+    runs the (synchronous) zipfile code again.
+    '''
+
+    def __init__(self, size, name=None):
+        self.size = size
+        self.name = name
+        self._ranges = []  # sorted, disjoint (offset, bytes) pairs
+
+    def add(self, offset, data):
+        start, end = offset, offset + len(data)
+        ranges = []
+        for range_start, range_data in self._ranges:
+            range_end = range_start + len(range_data)
+            if range_end < start or range_start > end:
+                ranges.append((range_start, range_data))
+                continue
+            # Overlapping or adjacent: merged
+            if range_start < start:
+                data = range_data[:start - range_start] + data
+                start = range_start
+            if range_end > end:
+                data = data + range_data[end - range_start:]
+                end = range_end
+        ranges.append((start, data))
+        ranges.sort(key=lambda r: r[0])
+        self._ranges = ranges
+
+    def has(self, offset, size):
+        end = min(offset + size, self.size)
+        for range_start, range_data in self._ranges:
+            if range_start <= offset and end <= range_start + len(range_data):
+                return True
+        return offset >= end
+
+    def read(self, size=-1):
+        pos = self._pos
+        if size is None or size < 0:
+            size = self.size - pos
+        size = max(0, min(size, self.size - pos))
+        if not size:
+            return b''
+        for range_start, range_data in self._ranges:
+            if range_start <= pos and pos + size <= range_start + len(range_data):
+                self._pos += size
+                return range_data[pos - range_start:pos - range_start + size]
+        raise _MissingRange(pos, size)
+
+
+class AsyncFileReader(object):
+    '''
+    Reader of a local (or NFS, SMB...) file: the blocking calls run in the
+    event loop executor. The file is opened on the first call, close() it.
+    '''
+
+    def __init__(self, path, executor=None):
+        self.path = path
+        self.executor = executor
+        self._fd = None
+
+    def __repr__(self):
+        return 'AsyncFileReader({!r})'.format(self.path)
+
+    def _run(self, function, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    def _open(self):
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        return self._fd
+
+    def _size(self):
+        return os.fstat(self._open()).st_size
+
+    def _read_range(self, offset, size):
+        fd = self._open()
+        if hasattr(os, 'pread'):
+            return os.pread(fd, size, offset)
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, size)
+
+    async def get_size(self):
+        return await self._run(self._size)
+
+    async def read_range(self, offset, size):
+        return await self._run(self._read_range, offset, size)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class HTTPRangeReader(object):
+    '''
+    Reader of a file served over HTTP(S) with Range requests (any web
+    server, S3-compatible stores...). The size comes from the first request,
+    which also fetches the end of the file (where the zip central directory
+    is): no HEAD request. The blocking urllib calls run in the event loop
+    executor.
+    headers: e.g. authorization headers
+    '''
+
+    def __init__(self, url, headers=None, timeout=30, executor=None):
+        self.url = url
+        self.headers = dict(headers or {})
+        self.timeout = timeout
+        self.executor = executor
+        self._size = None
+        self._tail = None  # (offset, bytes)
+
+    def __repr__(self):
+        return 'HTTPRangeReader({!r})'.format(self.url)
+
+    def _request(self, byte_range):
+        headers = dict(self.headers, Range='bytes={}'.format(byte_range))
+        response = urlopen(Request(self.url, headers=headers), timeout=self.timeout)
+        with response:
+            data = response.read()
+            if response.status == 206:
+                # Content-Range: bytes start-end/size
+                content_range = response.headers.get('Content-Range', '')
+                start = int(content_range.split(' ', 1)[1].split('-', 1)[0])
+                size = content_range.rsplit('/', 1)[1]
+                return start, data, int(size) if size != '*' else None
+            # The server ignored the Range header: whole file
+            return 0, data, len(data)
+
+    def _get_size(self):
+        start, data, size = self._request('-{}'.format(TAIL_SIZE))
+        self._tail = (start, data)
+        return size
+
+    async def get_size(self):
+        if self._size is None:
+            self._size = await asyncio.get_running_loop().run_in_executor(self.executor, self._get_size)
+        return self._size
+
+    async def read_range(self, offset, size):
+        if self._tail is not None:
+            start, data = self._tail
+            if start <= offset and offset + size <= start + len(data):
+                return data[offset - start:offset - start + size]
+        start, data, _ = await asyncio.get_running_loop().run_in_executor(
+            self.executor, self._request, '{}-{}'.format(offset, offset + size - 1))
+        return data[offset - start:offset - start + size]
+
+
+def _as_reader(source):
+    # Returns (reader, True if it was created here, so closed here)
+    if isinstance(source, (str, os.PathLike)):
+        source = os.fspath(source)
+        if source.startswith(('http://', 'https://')):
+            return HTTPRangeReader(source), True
+        return AsyncFileReader(source), True
+    return source, False
+
+
+async def _fetch(reader, fp, offset, size):
+    size = min(max(size, MIN_READ_SIZE), fp.size - offset)
+    data = await reader.read_range(offset, size)
+    if len(data) < size:
+        raise EPubException('Truncated read of {} bytes at {} from {!r}'.format(size, offset, reader))
+    fp.add(offset, data)
+
+
+async def _complete(reader, fp, function, budget=None):
+    # Runs the synchronous function, fetching what it misses, until it
+    # returns. budget: the LimitedZipFile, rolled back before each new run
+    while True:
+        checkpoint = budget.checkpoint() if budget is not None else None
+        try:
+            return function()
+        except _MissingRange as missing:
+            if budget is not None:
+                budget.restore(checkpoint)
+            await _fetch(reader, fp, missing.offset, missing.size)
+
+
+async def _prefetch(reader, fp, zf, names):
+    # The members are fetched concurrently (each with one ranged read)
+    fetches = []
+    for name in names:
+        try:
+            zinfo = zf.getinfo(name)
+        except KeyError:
+            continue
+        size = (zipfile.sizeFileHeader + len(zinfo.filename.encode('utf-8')) + len(zinfo.extra) +
+                zinfo.compress_size + LOCAL_HEADER_SLACK)
+        if not fp.has(zinfo.header_offset, size):
+            fetches.append(_fetch(reader, fp, zinfo.header_offset, size))
+    await asyncio.gather(*fetches)
+
+
+async def _read_metadata(reader, read_cover_image, read_toc, cover_image_encoding, fields=None, limits=None,
+                         strategies=None, normalize=False):
+    file_size_in_bytes = await reader.get_size()
+    fp = _SparseFile(file_size_in_bytes, name=getattr(reader, 'url', None) or getattr(reader, 'path', None))
+    tail_offset = max(0, file_size_in_bytes - TAIL_SIZE)
+    await _fetch(reader, fp, tail_offset, file_size_in_bytes - tail_offset)
+
+    def open_zip():
+        zf = zipfile.ZipFile(fp, 'r', compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+        _check_mimetype(zf)
+        return zf
+
+    try:
+        zf = await _complete(reader, fp, open_zip)
+    except (zipfile.BadZipFile, ValueError):
+        raise EPubException('Unknown file')
+    budget = None
+    if limits is not None:
+        zf = budget = LimitedZipFile(zf, limits)
+
+    plan = opf_plan(fields, normalize=normalize)
+    opf_filepath = opf = None
+    if plan[0] is None or plan[0]:
+        await _prefetch(reader, fp, zf, ['META-INF/container.xml'])
+        opf_filepath = await _complete(reader, fp, lambda: discover_opf_filepath(zf), budget)
+        await _prefetch(reader, fp, zf, [opf_filepath])
+        opf = await _complete(reader, fp, lambda: read_opf(zf, opf_filepath, plan), budget)
+
+    names = []
+    if read_cover_image and (fields is None or 'cover_image_content' in fields):
+        names.append(discover_cover_image_path(opf, opf_filepath,
+                                                cover_ids=strategies.cover_ids if strategies else None)[0])
+    if read_toc and (fields is None or 'toc' in fields):
+        names.extend(discover_toc_paths(opf, opf_filepath))
+    await _prefetch(reader, fp, zf, [name for name in names if name])
+
+    loaders = metadata_loaders(file_size_in_bytes, zf, opf, opf_filepath, read_cover_image=read_cover_image,
+                                read_toc=read_toc, cover_image_encoding=cover_image_encoding, fields=fields,
+                                strategies=strategies, normalize=normalize)
+    data = odict()
+    for keys, loader in loaders:
+        # Anything else (e.g. the pr01/pr02.html fallbacks) is fetched when
+        # the loader misses it
+        update_metadata(data, keys, await _complete(reader, fp, loader, budget))
+    return data
+
+
+async def async_get_epub_metadata(source, read_cover_image=True, read_toc=True, cover_image_encoding='base64',
+                                  compact=False, fields=None, limits=None, strategies=None, normalize=False):
+    '''
+    Same as epub_meta.get_epub_metadata, reading the ePub file through
+    ranged reads.
+    source: a reader, a file path (AsyncFileReader) or an http(s) URL
+    (HTTPRangeReader)
+    The XML parsing still runs in the event loop (it only takes a few
+    milliseconds per book).
+    limits: a Limits, the time limit includes the ranged reads
+    '''
+    fields = check_fields(fields)
+    reader, owned = _as_reader(source)
+    try:
+        data = await _read_metadata(reader, read_cover_image, read_toc, cover_image_encoding, fields, limits,
+                                    strategies, normalize)
+    except OSError as e:
+        raise EPubException('Cannot read {!r}: {}'.format(reader, e))
+    finally:
+        if owned and hasattr(reader, 'close'):
+            reader.close()
+    return EpubMetadata.from_dict(data) if compact else data
+
+
+async def async_iter_epub_metadata(sources, concurrency=16, **options):
+    '''
+    async_get_epub_metadata for many ePub files, at most `concurrency` at
+    once. Yields (source, metadata) tuples in completion order, metadata is
+    an EPubException if the file can't be read.
+    sources: an iterable (or async iterable) of readers, paths or URLs
+    options: async_get_epub_metadata arguments
+
+        async for source, data in async_iter_epub_metadata(urls, concurrency=32, read_toc=False):
+            ...
+    '''
+    async def extract(source):
+        try:
+            return source, await async_get_epub_metadata(source, **options)
+        except EPubException as e:
+            return source, e
+        except Exception as e:
+            return source, EPubException('Cannot read {!r}: {!r}'.format(source, e))
+
+    if hasattr(sources, '__aiter__'):
+        iterator = sources.__aiter__()
+
+        async def next_source():
+            try:
+                return True, await iterator.__anext__()
+            except StopAsyncIteration:
+                return False, None
+    else:
+        iterator = iter(sources)
+
+        async def next_source():
+            for source in iterator:
+                return True, source
+            return False, None
+
+    # Only `concurrency` tasks exist at a time: the sources are consumed
+    # lazily.
+    pending = set()
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < concurrency:
+                found, source = await next_source()
+                if not found:
+                    exhausted = True
+                    break
+                pending.add(asyncio.ensure_future(extract(source)))
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,275 @@
+import io
+import mmap
+import os
+import struct
+import zipfile
+
+from epub_meta.exceptions import EPubException
+
+
+# The end of central directory record (22 bytes + a comment of up to 64 KiB)
+# and, for most books, the whole central directory fit in this tail.
+TAIL_SIZE = 128 * 1024
+
+# Small reads (e.g. the local file header, then the file name, then the extra
+# field of a member) are served from a block of this size.
+BLOCK_SIZE = 8 * 1024
+
+# End of central directory record: signature, disk numbers, entry counts,
+# central directory size and offset, comment length
+_END_RECORD = struct.Struct('<4s4H2LH')
+_END_SIGNATURE = b'PK\x05\x06'
+_ZIP64_LOCATOR_SIGNATURE = b'PK\x06\x07'
+_CENTRAL_SIGNATURE = b'PK\x01\x02'
+
+MIMETYPE = b'application/epub+zip'
+MIMETYPE_CRC = zipfile.crc32(MIMETYPE)
+
+
+class RandomAccessFile(io.RawIOBase):
+    '''
+    Base of the read-only, seekable files of a known size given to zipfile.
+    Subclasses implement read(size) from the current position (self._pos).
+    '''
+    size = 0
+    _pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            pos = offset
+        elif whence == os.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == os.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError('Invalid whence: {}'.format(whence))
+        if pos < 0:
+            raise ValueError('Negative seek position {}'.format(pos))
+        self._pos = pos
+        return pos
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class TailBufferedFile(RandomAccessFile):
+    '''
+    Read-only, seekable wrapper of a file object which reads the last
+    `tail_size` bytes of the file at once: zipfile finds the end of central
+    directory record and reads the central directory from memory, instead of
+    issuing a few seeks/reads per step. Reads before the tail go to the file
+    (with os.pread when possible: no seek calls), small ones through a block
+    buffer.
+    '''
+
+    def __init__(self, fp, tail_size=TAIL_SIZE, name=None):
+        self._fp = fp
+        self.name = name if name is not None else getattr(fp, 'name', None)
+        self._fd = None
+        if hasattr(os, 'pread'):
+            try:
+                self._fd = fp.fileno()
+            except (AttributeError, IOError, OSError, ValueError):
+                pass
+        self.size = fp.seek(0, os.SEEK_END)
+        self._tail_offset = max(0, self.size - tail_size)
+        self._tail = self._read_at(self._tail_offset, self.size - self._tail_offset)
+        self._block_offset = 0
+        self._block = b''
+        self._pos = 0
+
+    def _read_at(self, offset, size):
+        if self._fd is None:
+            self._fp.seek(offset)
+            return self._fp.read(size)
+        chunks = []
+        while size > 0:
+            chunk = os.pread(self._fd, size, offset)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            offset += len(chunk)
+            size -= len(chunk)
+        return chunks[0] if len(chunks) == 1 else b''.join(chunks)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = max(0, self.size - self._pos)
+        pos = self._pos
+        if pos >= self._tail_offset:
+            data = self._tail[pos - self._tail_offset:pos - self._tail_offset + size]
+        elif self._block_offset <= pos and pos + size <= self._block_offset + len(self._block):
+            data = self._block[pos - self._block_offset:pos - self._block_offset + size]
+        elif size < BLOCK_SIZE:
+            self._block_offset = pos
+            self._block = self._read_at(pos, min(BLOCK_SIZE, self._tail_offset - pos))
+            data = self._block[:size]
+            if len(data) < size:
+                # Up to the tail
+                data += self._tail[:size - len(data)]
+        else:
+            data = self._read_at(pos, size)
+        self._pos += len(data)
+        return data
+
+    def close(self):
+        if not self.closed:
+            self._fp.close()
+        io.RawIOBase.close(self)
+
+
+class BufferFile(RandomAccessFile):
+    '''
+    File over an in-memory ePub (bytes, bytearray, memoryview, mmap or any
+    buffer): the buffer is not copied, only the bytes read are.
+    The buffer is released on close (e.g. then the mmap can be closed).
+    '''
+
+    def __init__(self, buffer):
+        self.name = '<{}>'.format(type(buffer).__name__)
+        self._buffer = memoryview(buffer).cast('B')
+        self.size = self._buffer.nbytes
+
+    def read(self, size=-1):
+        pos = self._pos
+        if size is None or size < 0:
+            size = self.size - pos
+        data = self._buffer[pos:pos + max(0, size)].tobytes()
+        self._pos += len(data)
+        return data
+
+    def close(self):
+        if not self.closed:
+            self._buffer.release()
+        io.RawIOBase.close(self)
+
+
+class OwningZipFile(zipfile.ZipFile):
+    '''
+    Zip file closing its file object with it (zipfile only closes the files
+    it opened itself). Its member streams must be read before it is closed.
+    '''
+
+    def __init__(self, fp, *args, **kwargs):
+        self.owned_file = fp
+        zipfile.ZipFile.__init__(self, fp, *args, **kwargs)
+
+    def close(self):
+        try:
+            zipfile.ZipFile.close(self)
+        finally:
+            self.owned_file.close()
+
+
+def _check_mimetype(zf):
+    # The mimetype member is optional, but if it is there it must be the ePub
+    # one. The CRC in the central directory is enough for the usual content.
+    try:
+        zinfo = zf.getinfo('mimetype')
+    except KeyError:
+        return
+    if zinfo.CRC == MIMETYPE_CRC and zinfo.file_size == len(MIMETYPE):
+        return
+    if zinfo.file_size > 1024 or zf.read(zinfo).strip() != MIMETYPE:
+        raise EPubException('Unknown file: not an ePub mimetype')
+
+
+def central_directory_complete(filepath):
+    '''
+    True when the file ends with a zip end of central directory record and the
+    central directory it points at is there: a file still being copied or
+    downloaded is not complete. Only the tail of the file is read.
+    '''
+    try:
+        with open(filepath, 'rb') as fp:
+            size = fp.seek(0, os.SEEK_END)
+            tail_offset = max(0, size - _END_RECORD.size - 0xFFFF)
+            fp.seek(tail_offset)
+            tail = fp.read()
+            position = tail.rfind(_END_SIGNATURE)
+            while position >= 0:
+                record = tail[position:position + _END_RECORD.size]
+                if len(record) == _END_RECORD.size:
+                    fields = _END_RECORD.unpack(record)
+                    entries, central_size, comment_size = fields[4], fields[5], fields[7]
+                    # The record ends the file (after its comment)
+                    if position + _END_RECORD.size + comment_size == len(tail):
+                        if 0xFFFFFFFF in fields[5:7] or entries == 0xFFFF:
+                            # Zip64: the locator precedes the record
+                            return tail[position - 20:position - 16] == _ZIP64_LOCATOR_SIGNATURE
+                        if not entries:
+                            return True
+                        # The central directory is just before the record
+                        # (whatever data precedes the archive)
+                        central_offset = tail_offset + position - central_size
+                        if central_offset < 0:
+                            return False
+                        fp.seek(central_offset)
+                        return fp.read(len(_CENTRAL_SIGNATURE)) == _CENTRAL_SIGNATURE
+                position = tail.rfind(_END_SIGNATURE, 0, position)
+    except (IOError, OSError):
+        pass
+    return False
+
+
+def display_name(filename):
+    '''
+    Name of an ePub file (zipfile.ZipFile.filename) in the error messages.
+    '''
+    if isinstance(filename, str):
+        return os.path.basename(filename)
+    return '<file object>'
+
+
+def open_epub_zip(source):
+    '''
+    Opens an ePub (zip) file. source:
+    - a file path: a single open and, usually, a single read for the end of
+      central directory record and the central directory.
+    - bytes, bytearray, memoryview or mmap: read in place,
+      without copying it.
+    - a seekable binary file object: not closed with the zip file.
+    The mimetype member is validated.
+    Returns a tuple: (zipfile.ZipFile, file size in bytes)
+    '''
+    owned = True
+    try:
+        if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+            fp = BufferFile(source)
+        elif hasattr(source, 'read') and hasattr(source, 'seek'):
+            fp, owned = source, False
+        else:
+            raw = open(source, 'rb', buffering=0)
+            try:
+                fp = TailBufferedFile(raw, name=os.fspath(source))
+            except BaseException:
+                raw.close()
+                raise
+    except (IOError, OSError):
+        raise EPubException('Unknown file')
+    zf = None
+    try:
+        size = fp.size if owned else fp.seek(0, os.SEEK_END)
+        zf = (OwningZipFile if owned else zipfile.ZipFile)(fp, 'r', compression=zipfile.ZIP_DEFLATED,
+                                                          allowZip64=True)
+        _check_mimetype(zf)
+    except BaseException as e:
+        if zf is not None:
+            zf.close()
+        elif owned:
+            fp.close()
+        if isinstance(e, (zipfile.BadZipFile, ValueError, IOError, OSError)):
+            raise EPubException('Unknown file')
+        raise
+    return zf, size
@@ -0,0 +1,331 @@
+'''
+An open ePub file: the zip file, container.xml and the OPF file are read
+once and shared by the metadata, OPF, ToC and cover accessors.
+
+    with EpubBook('/path/to/book.epub') as book:
+        book.metadata.title
+        book.opf_xml
+        book.toc
+        content, extension = book.cover()
+        for chunk in book.iter_text(): ...
+        book.read('OEBPS/chapter1.xhtml')
+
+The get_epub_* functions are shortcuts opening an EpubBook for one call.
+'''
+from epub_meta.compact import EpubMetadata
+from epub_meta.discovery import COVER_PLAN, TOC_PLAN, LazyMetadata, odict
+from epub_meta.discovery import check_fields, cover_image_info, cover_image_zipinfo, discover_cover_image
+from epub_meta.discovery import discover_cover_image_path, discover_rootfiles, discover_toc, iter_toc
+from epub_meta.discovery import metadata_loaders, open_epub, opf_plan, read_opf, rendition_path, update_metadata
+from epub_meta.instrumentation import phase
+from epub_meta.parser import DC_ELEMENTS
+from epub_meta.strategies import default_strategies
+from epub_meta.text import TEXT_CHUNK_SIZE, iter_text
+from epub_meta.toc import TocColumns
+
+
+_FULL_PLAN = (None, False, False)
+
+_MISSING = object()
+
+
+class BookStream(object):
+    '''
+    A stream of a member of an EpubBook that owns the book: closing the
+    stream (or the end of its with block) closes the book too. The other
+    methods are those of the member stream (read, seek, tell...).
+    '''
+
+    def __init__(self, stream, book):
+        self._stream = stream
+        self._book = book
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __iter__(self):
+        return iter(self._stream)
+
+    @property
+    def closed(self):
+        return self._stream.closed
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._book.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class EpubBook(object):
+    '''
+    source: a file path, the ePub file in memory (bytes, bytearray,
+    memoryview or mmap) or a seekable binary file object
+    limits: a Limits, for everything read from the book
+    strategies: a StrategyRegistry (fallback rules and cover ids, see
+    epub_meta.strategies), default: epub_meta.default_strategies
+    rendition: the rendition to read, as an index or OPF file path in
+    renditions (default: the first one)
+    container.xml and the OPF file are only read when first needed (the OPF
+    file only collects what the first accessors need, see get_metadata
+    fields, until the whole file is parsed once).
+    '''
+
+    def __init__(self, source, limits=None, strategies=None, rendition=None):
+        self._zf, self.file_size_in_bytes = open_epub(source, limits=limits)
+        self._strategies = default_strategies if strategies is None else strategies
+        self._rendition = rendition
+        self._rootfiles = None
+        self._opf_filepath = None
+        self._opf_xml = None
+        self._packages = {}  # parse_opf plan -> Package
+        self._metadata = None
+        self._toc = _MISSING
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._zf.close()
+
+    @property
+    def filename(self):
+        return self._zf.filename
+
+    @property
+    def renditions(self):
+        '''
+        Paths of the OPF files of the renditions (rootfiles of container.xml),
+        in order.
+        '''
+        if self._rootfiles is None:
+            self._rootfiles = discover_rootfiles(self._zf)
+        return self._rootfiles
+
+    @property
+    def opf_filepath(self):
+        '''
+        Path of the OPF file of the rendition in the zip file.
+        '''
+        if self._opf_filepath is None:
+            self._opf_filepath = rendition_path(self._zf, self.renditions, self._rendition)
+        return self._opf_filepath
+
+    @property
+    def opf_xml(self):
+        '''
+        Contents of the OPF file (bytes).
+        '''
+        if self._opf_xml is None:
+            self._opf_xml = self._zf.read(self.opf_filepath)
+        return self._opf_xml
+
+    @property
+    def opf(self):
+        '''
+        The parsed OPF file (epub_meta.parser.Package).
+        '''
+        return self._package(_FULL_PLAN)
+
+    @property
+    def manifest(self):
+        '''
+        The ManifestIndex of the OPF file: manifest items by id, href,
+        properties token and media-type.
+        '''
+        return self._package(TOC_PLAN).manifest_index
+
+    def load_opf(self, fields=None, normalize=False):
+        '''
+        Parses the OPF file for the fields (default: all of them, see
+        get_metadata), for the accessors called next: e.g. the metadata
+        fields and the cover path from a single parse.
+        '''
+        plan = opf_plan(check_fields(fields), normalize)
+        if plan[0] is None or plan[0]:
+            self._package(plan)
+
+    def _package(self, plan):
+        # A package collecting the elements of the plan (the whole OPF file
+        # collects them all) with the same normalization serves it, unless
+        # the plan needs the manifest and its parsing stopped after the
+        # metadata. A normalized one serves the plans without normalization
+        # too when they don't read the Dublin Core elements (e.g. the cover
+        # image and the ToC).
+        names = frozenset(plan[0]) if plan[0] is not None else None
+        for (package_names, metadata_only, normalize), package in self._packages.items():
+            if ((package_names is None or (names is not None and names <= package_names)) and
+                    (plan[1] or not metadata_only) and
+                    (normalize == plan[2] or (normalize and names is not None and not names & DC_ELEMENTS))):
+                return package
+        package = self._packages[(names, plan[1], plan[2])] = read_opf(self._zf, self.opf_filepath, plan,
+                                                                       content=self._opf_xml)
+        return package
+
+    def _loaders(self, read_cover_image=True, read_toc=True, cover_image_encoding='base64', fields=None,
+                 normalize=False):
+        fields = check_fields(fields)
+        plan = opf_plan(fields, normalize=normalize)
+        # No element to collect: the OPF file is not needed
+        opf = opf_filepath = None
+        if plan[0] is None or plan[0]:
+            opf, opf_filepath = self._package(plan), self.opf_filepath
+        return metadata_loaders(self.file_size_in_bytes, self._zf, opf, opf_filepath,
+                                 read_cover_image=read_cover_image, read_toc=read_toc,
+                                 cover_image_encoding=cover_image_encoding, fields=fields,
+                                 strategies=self._strategies, normalize=normalize)
+
+    def lazy_metadata(self, read_cover_image=True, read_toc=True, cover_image_encoding='base64', fields=None,
+                      normalize=False):
+        '''
+        A LazyMetadata of the book, see get_epub_metadata for the arguments.
+        It owns the book: the book is closed once every value is discovered,
+        or by its close().
+        '''
+        return LazyMetadata(self._loaders(read_cover_image=read_cover_image, read_toc=read_toc,
+                                          cover_image_encoding=cover_image_encoding, fields=fields,
+                                          normalize=normalize),
+                            zf=self._zf)
+
+    @property
+    def metadata(self):
+        '''
+        The metadata dict, like get_epub_metadata(source) (memoized).
+        '''
+        if self._metadata is None:
+            self._metadata = self.get_metadata()
+        return self._metadata
+
+    def get_metadata(self, read_cover_image=True, read_toc=True, cover_image_encoding='base64', compact=False,
+                     fields=None, normalize=False):
+        '''
+        The metadata dict, see get_epub_metadata for the arguments.
+        '''
+        data = odict()
+        for keys, loader in self._loaders(read_cover_image=read_cover_image, read_toc=read_toc,
+                                          cover_image_encoding=cover_image_encoding, fields=fields,
+                                          normalize=normalize):
+            update_metadata(data, keys, loader())
+        if 'toc' in data and self._toc is _MISSING:
+            self._toc = data['toc']
+        if compact:
+            return EpubMetadata.from_dict(data)
+        return data
+
+    @property
+    def toc(self):
+        '''
+        The table of contents, like get_epub_toc(source) (memoized).
+        '''
+        if self._toc is _MISSING:
+            self._toc = discover_toc(self._zf, self._package(TOC_PLAN), self.opf_filepath)
+        return self._toc
+
+    def get_toc(self, max_depth=None, max_entries=None, columnar=False):
+        '''
+        The table of contents, see get_epub_toc for the arguments.
+        '''
+        if max_depth is None and max_entries is None:
+            toc = self.toc
+        else:
+            toc = discover_toc(self._zf, self._package(TOC_PLAN), self.opf_filepath,
+                                max_depth=max_depth, max_entries=max_entries)
+        if columnar and toc is not None:
+            return TocColumns(toc)
+        return toc
+
+    def iter_toc(self, max_depth=None, max_entries=None):
+        '''
+        Generator of the table of contents entries, streamed from the book.
+        '''
+        opf = self._package(TOC_PLAN)
+        with phase('toc', self.filename) as p:
+            for entry in iter_toc(self._zf, opf, self.opf_filepath, p, max_depth=max_depth,
+                                   max_entries=max_entries):
+                yield entry
+
+    def iter_text(self, text_chunk_size=TEXT_CHUNK_SIZE):
+        '''
+        Generator of the text of the spine documents, in reading order:
+        TextChunk(src, path, text) tuples, src being the ToC entry src (see
+        epub_meta.text).
+        '''
+        return iter_text(self._zf, self.opf, self.opf_filepath, self.toc, text_chunk_size=text_chunk_size)
+
+    def cover_path(self):
+        '''
+        Returns a tuple: (cover image path in the zip file, file extension),
+        or (None, None). The member is not read.
+        '''
+        return discover_cover_image_path(self._package(COVER_PLAN), self.opf_filepath,
+                                          cover_ids=self._strategies.cover_ids)
+
+    def cover(self, encoding=None):
+        '''
+        Returns a tuple: (cover image content, file extension), or (None,
+        None). The content is the raw bytes, or base64 with
+        encoding='base64'.
+        '''
+        return discover_cover_image(self._zf, self._package(COVER_PLAN), self.opf_filepath, encoding=encoding,
+                                     cover_ids=self._strategies.cover_ids)
+
+    def open_cover(self):
+        '''
+        Returns a file-like object streaming the (decompressed) cover image,
+        or None. Read it while the book is open (open_epub_cover_image
+        returns a stream owning its book).
+        '''
+        coverpath, extension = self.cover_path()
+        if not coverpath:
+            return None
+        return self._zf.open(cover_image_zipinfo(self._zf, coverpath))
+
+    def cover_info(self):
+        '''
+        Returns a CoverImageInfo (where the cover image is stored in the ePub
+        file, without reading it) or None.
+        '''
+        coverpath, extension = self.cover_path()
+        if not coverpath:
+            return None
+        return cover_image_info(self._zf, coverpath, extension)
+
+    def namelist(self):
+        '''
+        Paths of the members of the zip file.
+        '''
+        return self._zf.namelist()
+
+    def getinfo(self, name):
+        '''
+        zipfile.ZipInfo of a member. KeyError if there is no such member.
+        '''
+        return self._zf.getinfo(name)
+
+    def infolist(self):
+        '''
+        zipfile.ZipInfo of the members (from the zip central directory).
+        '''
+        return self._zf.infolist()
+
+    def read(self, name):
+        '''
+        Returns the (decompressed) content of a member. KeyError if there is
+        no such member.
+        '''
+        return self._zf.read(name)
+
+    def open(self, name):
+        '''
+        Returns a file-like object streaming a member.
+        '''
+        return self._zf.open(name)
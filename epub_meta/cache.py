@@ -0,0 +1,186 @@
+import hashlib
+import inspect
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from epub_meta.collector import get_epub_metadata, odict
+from epub_meta.compact import EpubMetadata
+
+
+_SIGNATURE = inspect.signature(get_epub_metadata)
+
+
+class _SqliteStore(object):
+    # A sqlite database that can be sent to worker processes: each process
+    # (and thread) opens its own connection. Subclasses list their CREATE
+    # statements in _SCHEMA.
+    _SCHEMA = ()
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # No fsync per commit (it is only a cache)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in self._SCHEMA:
+                connection.execute(statement)
+            connection.commit()
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+class MetadataCache(_SqliteStore):
+    '''
+    Persistent (sqlite) cache of get_epub_metadata results.
+    An entry is valid while the file keeps the same path, size, mtime and
+    inode. With use_hash=True, a file whose stat changed but whose content
+    hash is the same is still a hit (the hash is only computed then).
+    With max_size (bytes of stored results), the least recently used entries
+    are evicted.
+    The cache can be sent to worker processes: each process (and thread)
+    opens its own connection.
+
+        cache = MetadataCache('/var/cache/epub_meta.db', max_size=2 * 1024 ** 3)
+        data = cache.get_epub_metadata('/path/to/book.epub', read_toc=False)
+    '''
+    _SCHEMA = (
+        '''CREATE TABLE IF NOT EXISTS metadata (
+            path TEXT, options TEXT, size INTEGER, mtime INTEGER, inode INTEGER, hash TEXT,
+            data BLOB, data_size INTEGER, last_access REAL, PRIMARY KEY (path, options))''',
+        'CREATE INDEX IF NOT EXISTS metadata_last_access ON metadata (last_access)',
+    )
+
+    def __init__(self, path, max_size=None, use_hash=False, timeout=30):
+        _SqliteStore.__init__(self, path, timeout=timeout)
+        self.max_size = max_size
+        self.use_hash = use_hash
+
+    @staticmethod
+    def _options_key(options):
+        # The default values are explicit, so get_epub_metadata(path) and
+        # get_epub_metadata(path, read_toc=True) share the same entry.
+        arguments = _SIGNATURE.bind(None, **options)
+        arguments.apply_defaults()
+        if arguments.arguments['fields'] is not None:
+            # The order of a set is not stable
+            arguments.arguments['fields'] = sorted(arguments.arguments['fields'])
+        return repr(sorted(list(arguments.arguments.items())[1:]))
+
+    @staticmethod
+    def _file_hash(filepath):
+        digest = hashlib.sha1()
+        with open(filepath, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def get(self, filepath, **options):
+        '''
+        Returns the cached metadata of the file or None.
+        '''
+        filepath = os.path.abspath(filepath)
+        stat = os.stat(filepath)
+        key = (filepath, self._options_key(options))
+        row = self._connection.execute(
+            'SELECT size, mtime, inode, hash, data FROM metadata WHERE path = ? AND options = ?', key).fetchone()
+        if row is None:
+            return None
+        size, mtime, inode, file_hash, data = row
+        changed = (size, mtime, inode) != (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        if changed:
+            if not (self.use_hash and file_hash and file_hash == self._file_hash(filepath)):
+                return None
+            self._connection.execute(
+                'UPDATE metadata SET size = ?, mtime = ?, inode = ? WHERE path = ? AND options = ?',
+                (stat.st_size, stat.st_mtime_ns, stat.st_ino) + key)
+        if self.max_size is not None:
+            # The access time is only needed for the LRU eviction
+            self._connection.execute(
+                'UPDATE metadata SET last_access = ? WHERE path = ? AND options = ?', (time.time(),) + key)
+        if changed or self.max_size is not None:
+            self._connection.commit()
+        data = odict(pickle.loads(data))
+        return EpubMetadata.from_dict(data) if options.get('compact') else data
+
+    def set(self, filepath, data, **options):
+        filepath = os.path.abspath(filepath)
+        stat = os.stat(filepath)
+        file_hash = self._file_hash(filepath) if self.use_hash else None
+        blob = pickle.dumps(dict(data), pickle.HIGHEST_PROTOCOL)
+        self._connection.execute(
+            'INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (filepath, self._options_key(options), stat.st_size, stat.st_mtime_ns, stat.st_ino, file_hash,
+             sqlite3.Binary(blob), len(blob), time.time()))
+        if self.max_size is not None:
+            self._evict()
+        self._connection.commit()
+
+    def _evict(self):
+        # Least recently used entries first
+        total = self._connection.execute('SELECT COALESCE(SUM(data_size), 0) FROM metadata').fetchone()[0]
+        if total <= self.max_size:
+            return
+        rows = self._connection.execute('SELECT path, options, data_size FROM metadata ORDER BY last_access')
+        evicted = []
+        for path, options, data_size in rows:
+            if total <= self.max_size:
+                break
+            evicted.append((path, options))
+            total -= data_size
+        self._connection.executemany('DELETE FROM metadata WHERE path = ? AND options = ?', evicted)
+
+    def invalidate(self, filepath=None):
+        '''
+        Removes the entries of a file, or all the entries.
+        '''
+        if filepath is None:
+            self._connection.execute('DELETE FROM metadata')
+        else:
+            self._connection.execute('DELETE FROM metadata WHERE path = ?', (os.path.abspath(filepath),))
+        self._connection.commit()
+
+    def get_epub_metadata(self, filepath, **options):
+        '''
+        Same as epub_meta.get_epub_metadata, but served from the cache when
+        the file didn't change. Failures are not cached.
+        '''
+        try:
+            data = self.get(filepath, **options)
+        except OSError:
+            # Inexistent file: let get_epub_metadata raise the usual exception
+            data = None
+        if data is None:
+            data = get_epub_metadata(filepath, **options)
+            self.set(filepath, data, **options)
+        return data
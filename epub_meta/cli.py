@@ -0,0 +1,279 @@
+'''
+Command-line tool:
+
+    epub-meta show /path/to/book.epub
+    epub-meta scan /library --jobs 16 --format ndjson --output library.ndjson --since-manifest state.db
+    epub-meta watch /drop --jobs 4
+
+scan walks the directories, extracts the metadata in parallel and writes
+one row per ePub file (see epub_meta.export), then prints a summary
+(throughput and errors) on stderr.
+
+With --since-manifest, the size and mtime of the extracted files are stored
+in a sqlite manifest and the files unchanged since the previous runs are
+skipped: each run only outputs the new and modified files. An interrupted
+run (Ctrl-C, SIGTERM) closes its output and records the files written so
+far, so the next run resumes with the remaining files.
+
+watch extracts the ePub files added to or modified in a directory once they
+are completely written (see epub_meta.watcher) and writes one NDJSON line
+per event, with its kind (added, modified, deleted), latency and queue
+depth, until interrupted.
+
+Exit status: 0, 1 if some files couldn't be read, 130 if interrupted.
+'''
+import argparse
+from collections import Counter
+import json
+import os
+from pprint import pprint
+import signal
+import sqlite3
+import sys
+import time
+
+from epub_meta.collector import FIELDS, get_epub_metadata
+from epub_meta.export import DEFAULT_COLUMNS, FORMATS, export_metadata, metadata_rows
+from epub_meta.limits import Limits
+from epub_meta.scanner import iter_epub_files, iter_epub_metadata
+from epub_meta.watcher import watch_directory
+
+
+class Manifest(object):
+    '''
+    sqlite table of the scanned files: path, size, mtime (ns) and the error
+    message of the files that couldn't be read.
+    '''
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, error TEXT, scanned REAL)''')
+        self.connection.commit()
+
+    def unchanged(self, path, stat, retry_errors=False):
+        row = self.connection.execute('SELECT size, mtime, error FROM files WHERE path = ?', (path,)).fetchone()
+        if row is None or (retry_errors and row[2] is not None):
+            return False
+        return row[:2] == (stat.st_size, stat.st_mtime_ns)
+
+    def record(self, path, stat, error=None):
+        self.connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                                (path, stat.st_size, stat.st_mtime_ns, error, time.time()))
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+class _Scan(object):
+    # The files to extract and the counters of the summary
+
+    def __init__(self, roots, extensions, manifest=None, retry_errors=False):
+        self.roots = roots
+        self.extensions = extensions
+        self.manifest = manifest
+        self.retry_errors = retry_errors
+        self.stats = {}  # path -> os.stat_result, of the files being extracted
+        self.seen = set()  # each file is extracted once, e.g. listed twice
+        self.unchanged = 0
+        self.extracted = 0
+        self.bytes = 0
+        self.errors = Counter()
+        self.failed = []
+
+    def paths(self):
+        for root in self.roots:
+            paths = [root] if os.path.isfile(root) else iter_epub_files(root, self.extensions)
+            for path in paths:
+                path = os.path.abspath(path)
+                if path in self.seen:
+                    continue
+                self.seen.add(path)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    stat = None
+                if stat is not None and self.manifest is not None and \
+                        self.manifest.unchanged(path, stat, self.retry_errors):
+                    self.unchanged += 1
+                    continue
+                self.stats[path] = stat
+                yield path
+
+    def results(self, results):
+        for path, data in results:
+            stat = self.stats.pop(path)
+            error = None
+            if isinstance(data, Exception):
+                error = str(data)
+                self.errors[type(data).__name__] += 1
+                self.failed.append((path, error))
+            else:
+                self.extracted += 1
+                self.bytes += stat.st_size if stat is not None else 0
+            yield path, data
+            # Only recorded once the row is handed to the writer
+            if self.manifest is not None and stat is not None:
+                self.manifest.record(path, stat, error)
+
+    def summary(self, seconds, interrupted=False, max_errors=10):
+        files = self.extracted + len(self.failed)
+        lines = ['{} {} files in {:.1f} s ({:.1f} files/s, {:.1f} MiB/s): {} extracted, {} errors, {} unchanged'.format(
+            'Interrupted after' if interrupted else 'Scanned', files, seconds, files / max(seconds, 1e-9),
+            self.bytes / 1024.0 ** 2 / max(seconds, 1e-9), self.extracted, len(self.failed), self.unchanged)]
+        if self.failed:
+            lines.append('Errors: ' + ', '.join('{} {}'.format(count, name) for name, count in self.errors.most_common()))
+            for path, error in self.failed[:max_errors]:
+                lines.append('  {}: {}'.format(path, error))
+            if len(self.failed) > max_errors:
+                lines.append('  ... {} more'.format(len(self.failed) - max_errors))
+        return '\n'.join(lines)
+
+
+def _terminate(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def _megabytes(value):
+    return int(value * 1024 ** 2) if value else None
+
+
+def scan(args):
+    manifest = Manifest(args.since_manifest) if args.since_manifest else None
+    state = _Scan(args.paths, tuple(args.extensions.split(',')), manifest, args.retry_errors)
+    options = {'read_cover_image': False, 'read_toc': not args.no_toc}
+    columns = [column for column in DEFAULT_COLUMNS if not (args.no_toc and column == 'toc')]
+    if args.normalize:
+        options['normalize'] = True
+        columns.insert(columns.index('authors') + 1, 'creators')
+    if args.fields:
+        options['fields'] = args.fields.split(',')
+        columns = ['path', 'error'] + [column for column in FIELDS if column in options['fields']]
+    if args.max_member_mb or args.max_total_mb or args.max_nodes:
+        options['limits'] = Limits(max_member_bytes=_megabytes(args.max_member_mb),
+                                   max_total_bytes=_megabytes(args.max_total_mb), max_nodes=args.max_nodes)
+    results = iter_epub_metadata(state.paths(), workers=args.jobs, executor=args.executor, timeout=args.timeout,
+                                 **options)
+    output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    previous_handler = signal.signal(signal.SIGTERM, _terminate)
+    start = time.perf_counter()
+    interrupted = False
+    try:
+        export_metadata(state.results(results), output, format=args.format, columns=columns,
+                        row_group_size=args.row_group_size)
+    except KeyboardInterrupt:
+        interrupted = True
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
+        results.close()
+        if args.output:
+            output.close()
+        else:
+            output.flush()
+        # After the output is complete
+        if manifest is not None:
+            manifest.commit()
+            manifest.close()
+    print(state.summary(time.perf_counter() - start, interrupted), file=sys.stderr)
+    if interrupted:
+        return 130
+    return 1 if state.failed else 0
+
+
+def watch(args):
+    options = {'read_cover_image': False, 'read_toc': not args.no_toc}
+    columns = [column for column in DEFAULT_COLUMNS if not (args.no_toc and column == 'toc')]
+    events = watch_directory(args.path, extensions=tuple(args.extensions.split(',')), workers=args.jobs,
+                             executor=args.executor, timeout=args.timeout, settle=args.settle,
+                             poll_interval=args.poll_interval, initial=not args.changes_only,
+                             inotify=False if args.poll else None, **options)
+    previous_handler = signal.signal(signal.SIGTERM, _terminate)
+    try:
+        for event in events:
+            row = {'event': event.kind, 'latency': round(event.latency, 3), 'queue_depth': event.queue_depth}
+            if event.kind == 'deleted':
+                row['path'] = event.path
+            else:
+                row.update(zip(columns, next(metadata_rows([(event.path, event.metadata)], columns))))
+            sys.stdout.write(json.dumps(row, ensure_ascii=False) + '\n')
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
+        events.close()
+    return 0
+
+
+def show(args):
+    for path in args.paths:
+        pprint(dict(get_epub_metadata(path, read_cover_image=False, read_toc=not args.no_toc)))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='epub-meta', description='ePub metadata extraction')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    show_parser = commands.add_parser('show', help='print the metadata of ePub files')
+    show_parser.add_argument('paths', nargs='+', metavar='path')
+    show_parser.add_argument('--no-toc', action='store_true', help='skip the table of contents')
+    show_parser.set_defaults(function=show)
+
+    scan_parser = commands.add_parser('scan', help='extract the metadata of directory trees')
+    scan_parser.add_argument('paths', nargs='+', metavar='path', help='directories or ePub files')
+    scan_parser.add_argument('--jobs', '-j', type=int, default=None, help='workers (default: number of CPUs)')
+    scan_parser.add_argument('--executor', choices=('process', 'thread'), default='process')
+    scan_parser.add_argument('--timeout', type=float, default=None, help='seconds per file')
+    scan_parser.add_argument('--format', choices=FORMATS, default=None,
+                             help='default: from the output extension, ndjson on stdout')
+    scan_parser.add_argument('--output', '-o', help='output file (default: stdout)')
+    scan_parser.add_argument('--since-manifest', metavar='DB',
+                             help='sqlite manifest: skip the files unchanged since the previous runs')
+    scan_parser.add_argument('--retry-errors', action='store_true',
+                             help='with --since-manifest, retry the unchanged files that failed')
+    scan_parser.add_argument('--no-toc', action='store_true', help='skip the table of contents')
+    scan_parser.add_argument('--fields', help='comma-separated metadata keys, only these are extracted '
+                                              '(e.g. title,identifiers)')
+    scan_parser.add_argument('--normalize', action='store_true',
+                             help='normalize the text values, with the creators column (roles and file-as)')
+    scan_parser.add_argument('--max-member-mb', type=float, default=None,
+                             help='fail the files with a larger decompressed member (MiB)')
+    scan_parser.add_argument('--max-total-mb', type=float, default=None,
+                             help='fail the files decompressing more (MiB per file)')
+    scan_parser.add_argument('--max-nodes', type=int, default=None, help='fail the files with more XML elements')
+    scan_parser.add_argument('--extensions', default='.epub', help='comma-separated (default: .epub)')
+    scan_parser.add_argument('--row-group-size', type=int, default=10000)
+    scan_parser.set_defaults(function=scan)
+
+    watch_parser = commands.add_parser('watch', help='extract the new and modified ePub files of a directory')
+    watch_parser.add_argument('path', help='directory')
+    watch_parser.add_argument('--jobs', '-j', type=int, default=None, help='workers (default: number of CPUs)')
+    watch_parser.add_argument('--executor', choices=('process', 'thread'), default='process')
+    watch_parser.add_argument('--timeout', type=float, default=None, help='seconds per file')
+    watch_parser.add_argument('--settle', type=float, default=1.0,
+                              help='seconds without change before a file is extracted (default: 1)')
+    watch_parser.add_argument('--poll', action='store_true', help='poll the directory instead of using inotify')
+    watch_parser.add_argument('--poll-interval', type=float, default=2.0, help='seconds (default: 2)')
+    watch_parser.add_argument('--changes-only', action='store_true', help="don't extract the files already there")
+    watch_parser.add_argument('--no-toc', action='store_true', help='skip the table of contents')
+    watch_parser.add_argument('--extensions', default='.epub', help='comma-separated (default: .epub)')
+    watch_parser.set_defaults(function=watch)
+
+    args = parser.parse_args(argv)
+    if getattr(args, 'fields', None):
+        unknown = set(args.fields.split(',')).difference(FIELDS)
+        if unknown:
+            parser.error('unknown fields: {} (expected some of {})'.format(', '.join(sorted(unknown)),
+                                                                          ', '.join(FIELDS)))
+    if args.function is scan and args.format is None and not args.output:
+        args.format = 'ndjson'
+    return args.function(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,168 @@
+'''
+Compact metadata types, for keeping the metadata of many ePub files in
+memory (e.g. a search front end): get_epub_metadata(path, compact=True)
+returns an EpubMetadata instead of an odict.
+
+- The values are __slots__ attributes (no dict per book, nor per ToC entry)
+- The lists are tuples and the ToC is a tuple of TocEntry
+- The repeated strings (version, language, publisher, authors, subjects,
+  cover extension) are interned: the books share a single copy of them
+
+to_dict() returns the usual odict.
+'''
+import sys
+
+from epub_meta.discovery import odict
+
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+class TocEntry(object):
+    '''
+    Table of contents entry: title, src, level and index attributes.
+    '''
+    __slots__ = ('title', 'src', 'level', 'index')
+
+    def __init__(self, title, src, level, index):
+        self.title = title
+        self.src = src
+        self.level = level
+        self.index = index
+
+    @classmethod
+    def from_dict(cls, entry):
+        return cls(entry['title'], entry['src'], entry['level'], entry.get('index'))
+
+    def to_dict(self):
+        return {'title': self.title, 'src': self.src, 'level': self.level, 'index': self.index}
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __eq__(self, other):
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        if isinstance(other, TocEntry):
+            return self.to_dict() == other.to_dict()
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return TocEntry, (self.title, self.src, self.level, self.index)
+
+    def __repr__(self):
+        return 'TocEntry({!r}, {!r}, {!r}, {!r})'.format(self.title, self.src, self.level, self.index)
+
+
+class EpubMetadata(object):
+    '''
+    Compact get_epub_metadata result. The keys of the metadata dict are
+    attributes, None when the key is missing (like odict, e.g. toc with
+    read_toc=False). data['key'], data.get('key'), data.keys() and dict(data)
+    only see the present keys.
+    '''
+    # The keys of get_epub_metadata, in order
+    __slots__ = ('epub_version', 'title', 'language', 'description', 'authors', 'creators', 'publisher',
+                 'publication_date', 'identifiers', 'subject', 'file_size_in_bytes', 'cover_image_content',
+                 'cover_image_extension', 'toc')
+
+    _INTERNED = frozenset(['epub_version', 'language', 'publisher', 'cover_image_extension'])
+    _INTERNED_ITEMS = frozenset(['authors', 'subject'])
+
+    def __init__(self, **fields):
+        for key, value in fields.items():
+            if key not in self.__slots__:
+                raise TypeError('Unknown metadata key: {}'.format(key))
+            if key in self._INTERNED:
+                value = _intern(value)
+            elif isinstance(value, (list, tuple)):
+                if key == 'toc':
+                    value = tuple(entry if isinstance(entry, TocEntry) else TocEntry.from_dict(entry)
+                                  for entry in value)
+                elif key in self._INTERNED_ITEMS:
+                    value = tuple(_intern(item) for item in value)
+                else:
+                    value = tuple(value)
+            object.__setattr__(self, key, value)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def _has(self, key):
+        try:
+            object.__getattribute__(self, key)
+        except AttributeError:
+            return False
+        return True
+
+    def keys(self):
+        return [key for key in self.__slots__ if self._has(key)]
+
+    def to_dict(self):
+        '''
+        Returns the odict that get_epub_metadata returns without compact.
+        '''
+        data = odict()
+        for key in self.keys():
+            value = object.__getattribute__(self, key)
+            if key == 'toc' and value is not None:
+                value = [entry.to_dict() for entry in value]
+            elif isinstance(value, tuple):
+                value = list(value)
+            data[key] = value
+        return data
+
+    def __getattr__(self, key):
+        # Only called for the missing keys
+        if key in self.__slots__:
+            return None
+        raise AttributeError(key)
+
+    def __getitem__(self, key):
+        if key not in self.__slots__ or not self._has(key):
+            raise KeyError(key)
+        return object.__getattribute__(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in self.__slots__ and self._has(key)
+
+    def __eq__(self, other):
+        if isinstance(other, EpubMetadata):
+            other = other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __reduce__(self):
+        # Unpickled strings are interned again
+        return _unpickle_metadata, (dict((key, object.__getattribute__(self, key)) for key in self.keys()),)
+
+    def __repr__(self):
+        return 'EpubMetadata({})'.format(', '.join(
+            '{}={!r}'.format(key, object.__getattribute__(self, key)) for key in self.keys()))
+
+
+def _unpickle_metadata(fields):
+    return EpubMetadata(**fields)
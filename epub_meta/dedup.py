@@ -0,0 +1,194 @@
+'''
+Content-addressed deduplication: copies of a book (same file, or the same
+members repackaged) are recognized from the zip central directory, without
+decompressing anything, and their metadata is extracted only once.
+
+    index = DedupIndex('/var/lib/epub_meta/dedup.db')
+    for path, data in scan_directory('/library', cache=index, read_cover_image=False):
+        ...
+    index.duplicates()        # [[path, path...], ...] identical books
+    index.cover_duplicates()  # [[path, path...], ...] books sharing a cover
+'''
+import hashlib
+import os
+import pickle
+import sqlite3
+
+from epub_meta.book import EpubBook
+from epub_meta.cache import MetadataCache, _SIGNATURE, _SqliteStore
+from epub_meta.collector import get_epub_metadata
+from epub_meta.discovery import check_fields, odict
+from epub_meta.compact import EpubMetadata
+from epub_meta.instrumentation import phase
+
+
+_COVER_FIELDS = frozenset(['cover_image_content'])
+
+
+def _zip_fingerprint(book):
+    digest = hashlib.sha1()
+    members = sorted((zinfo.filename, zinfo.CRC, zinfo.file_size) for zinfo in book.infolist()
+                     if zinfo.filename != 'mimetype' and not zinfo.is_dir())
+    for name, crc, size in members:
+        digest.update('{}\0{:08x}\0{}\n'.format(name, crc, size).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def book_fingerprint(source):
+    '''
+    Returns the fingerprint of an ePub file (hex string): a hash of the names,
+    CRC-32 and sizes of its members, as stored in the zip central directory.
+    Copies of a book have the same fingerprint even when repackaged (other
+    compression, timestamps or member order), and the same metadata but
+    file_size_in_bytes.
+    All the members are included: the cover, ToC and HTML fallback paths are
+    only known from the OPF file, and the central directory is read anyway.
+    source: same as get_epub_metadata
+    '''
+    with EpubBook(source) as book:
+        return _zip_fingerprint(book)
+
+
+def _cover_fingerprint(book):
+    # CRC-32 and size of the stored cover image, or None
+    coverpath = book.cover_path()[0]
+    if not coverpath:
+        return None
+    try:
+        zinfo = book.getinfo(coverpath)
+    except KeyError:
+        return None
+    return '{:08x}-{}'.format(zinfo.CRC, zinfo.file_size)
+
+
+class DedupIndex(_SqliteStore):
+    '''
+    Persistent (sqlite) index of ePub files by content fingerprint (see
+    book_fingerprint). get_epub_metadata extracts the metadata of a book once
+    and serves it to its copies (with their own file_size_in_bytes). Each
+    book also gets a cover fingerprint (CRC-32 and size of the stored image),
+    and the groups of duplicate books or covers can be queried.
+    A path whose size and mtime didn't change is not even opened again.
+    Like MetadataCache, the index can be sent to worker processes, e.g. as
+    the cache of iter_epub_metadata.
+    '''
+    _SCHEMA = (
+        '''CREATE TABLE IF NOT EXISTS books (
+            path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, fingerprint TEXT, cover TEXT)''',
+        'CREATE INDEX IF NOT EXISTS books_fingerprint ON books (fingerprint)',
+        'CREATE INDEX IF NOT EXISTS books_cover ON books (cover)',
+        '''CREATE TABLE IF NOT EXISTS results (
+            fingerprint TEXT, options TEXT, data BLOB, PRIMARY KEY (fingerprint, options))''',
+    )
+
+    def fingerprint(self, filepath):
+        '''
+        Returns the indexed fingerprint of the file, or None.
+        '''
+        row = self._connection.execute('SELECT fingerprint FROM books WHERE path = ?',
+                                       (os.path.abspath(filepath),)).fetchone()
+        return row[0] if row is not None else None
+
+    def get_epub_metadata(self, filepath, **options):
+        '''
+        Same as epub_meta.get_epub_metadata (except lazy=True), served from the
+        results of a copy of the book when there is one. Failures are not
+        indexed.
+        '''
+        if options.get('lazy'):
+            raise ValueError('lazy metadata cannot be indexed')
+        path = os.path.abspath(filepath)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # Let get_epub_metadata raise the usual exception
+            return get_epub_metadata(filepath, **options)
+        key = MetadataCache._options_key(options)
+        arguments = _SIGNATURE.bind(filepath, **options)
+        arguments.apply_defaults()
+        arguments = arguments.arguments
+        fields = check_fields(arguments['fields'])
+
+        connection = self._connection
+        row = connection.execute('SELECT size, mtime, fingerprint, cover FROM books WHERE path = ?',
+                                 (path,)).fetchone()
+        if row is not None and row[:2] == (stat.st_size, stat.st_mtime_ns):
+            data = self._result(row[2], key, stat, arguments['compact'])
+            if data is not None:
+                return data
+
+        with phase('total') as p:
+            with EpubBook(path, limits=arguments['limits'], strategies=arguments['strategies']) as book:
+                p.filename = book.filename
+                fingerprint = _zip_fingerprint(book)
+                data = self._result(fingerprint, key, stat, arguments['compact'])
+                if data is not None:
+                    cover = connection.execute('SELECT cover FROM books WHERE fingerprint = ? LIMIT 1',
+                                               (fingerprint,)).fetchone()
+                    self._record(path, stat, fingerprint, cover[0] if cover is not None else None)
+                    return data
+                # The OPF file is parsed once, for the fields and the cover
+                book.load_opf(fields | _COVER_FIELDS if fields is not None else None, arguments['normalize'])
+                data = book.get_metadata(read_cover_image=arguments['read_cover_image'],
+                                         read_toc=arguments['read_toc'],
+                                         cover_image_encoding=arguments['cover_image_encoding'], fields=fields,
+                                         normalize=arguments['normalize'])
+                cover = _cover_fingerprint(book)
+        connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?)',
+                           (fingerprint, key, sqlite3.Binary(pickle.dumps(dict(data), pickle.HIGHEST_PROTOCOL))))
+        self._record(path, stat, fingerprint, cover)
+        return EpubMetadata.from_dict(data) if arguments['compact'] else data
+
+    def _result(self, fingerprint, key, stat, compact):
+        row = self._connection.execute('SELECT data FROM results WHERE fingerprint = ? AND options = ?',
+                                       (fingerprint, key)).fetchone()
+        if row is None:
+            return None
+        data = odict(pickle.loads(row[0]))
+        if 'file_size_in_bytes' in data:
+            data['file_size_in_bytes'] = stat.st_size
+        return EpubMetadata.from_dict(data) if compact else data
+
+    def _record(self, path, stat, fingerprint, cover):
+        self._connection.execute('INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?, ?)',
+                                 (path, stat.st_size, stat.st_mtime_ns, fingerprint, cover))
+        self._connection.commit()
+
+    def _groups(self, column):
+        rows = self._connection.execute(
+            '''SELECT {0}, path FROM books WHERE {0} IN (
+                SELECT {0} FROM books WHERE {0} IS NOT NULL GROUP BY {0} HAVING COUNT(*) > 1)
+            ORDER BY {0}, path'''.format(column))
+        groups = []
+        previous = None
+        for value, path in rows:
+            if value != previous:
+                groups.append([])
+                previous = value
+            groups[-1].append(path)
+        return groups
+
+    def duplicates(self):
+        '''
+        Returns the groups (lists of paths) of indexed books with the same
+        fingerprint.
+        '''
+        return self._groups('fingerprint')
+
+    def cover_duplicates(self):
+        '''
+        Returns the groups (lists of paths) of indexed books with the same
+        cover image.
+        '''
+        return self._groups('cover')
+
+    def invalidate(self, filepath=None):
+        '''
+        Removes a file from the index, or everything.
+        '''
+        if filepath is None:
+            self._connection.execute('DELETE FROM books')
+            self._connection.execute('DELETE FROM results')
+        else:
+            self._connection.execute('DELETE FROM books WHERE path = ?', (os.path.abspath(filepath),))
+        self._connection.commit()
@@ -0,0 +1,736 @@
+'''
+Discovery of the metadata in an open ePub file: the OPF parsing plans, the
+discovery of each field, of the cover image and of the ToC. Shared by the
+get_epub_* functions (epub_meta.collector), EpubBook and the async API.
+'''
+import base64
+from collections import namedtuple
+import os
+import posixpath
+import struct
+import zipfile
+import sys
+
+from epub_meta.archive import display_name, open_epub_zip
+from epub_meta.exceptions import EPubException
+from epub_meta.instrumentation import phase
+from epub_meta.limits import LimitedZipFile, budget
+from epub_meta.parser import normalize_text, parse_container, parse_opf
+from epub_meta.strategies import default_strategies
+from epub_meta.toc import NavParser, NcxParser
+
+
+IS_PY2 = sys.version_info < (3, 0)
+
+if IS_PY2:
+    from urllib import unquote
+else:
+    from urllib.parse import unquote
+
+
+# Where the cover image is stored in the ePub (zip) file. The member data is
+# the bytes [offset, offset + compressed_size) of the file: when compress_type
+# is zipfile.ZIP_STORED, that is the image itself (no decompression needed,
+# e.g. serve it with mmap or os.sendfile).
+CoverImageInfo = namedtuple('CoverImageInfo', 'path extension offset compressed_size file_size compress_type crc')
+
+# ePub 2.x ToC, found by media-type when its manifest id is not 'ncx' or
+# 'ncxtoc'
+NCX_MEDIA_TYPE = 'application/x-dtbncx+xml'
+
+
+class odict(dict):
+    __setattr__ = dict.__setitem__
+    __delattr__ = dict.__delitem__
+
+    def __getattr__(self, attr):
+        return self.get(attr)
+
+
+# Value of the pending keys of a LazyMetadata in the dict storage
+_PENDING = object()
+
+_MISSING = object()
+
+
+class LazyMetadata(odict):
+    '''
+    Metadata dict whose values are only discovered when first accessed, then
+    memoized. Dict and dot notation behave like odict: keys, iteration, len,
+    ==, dict(data), json.dumps(data), data.copy() etc (the last ones discover
+    every pending value, like pop, popitem and the | operator do for theirs).
+    The ePub file is closed once every value is discovered, or by close()
+    (pending values are then dropped).
+    '''
+    __slots__ = ('_keys', '_loaders', '_zf')
+
+    def __init__(self, loaders, zf=None):
+        odict.__init__(self)
+        # loaders: (keys, function) pairs, function returns the value (or
+        # a tuple of values when there are many keys)
+        object.__setattr__(self, '_keys', [key for keys, loader in loaders for key in keys])
+        object.__setattr__(self, '_loaders', dict((key, (keys, loader)) for keys, loader in loaders for key in keys))
+        object.__setattr__(self, '_zf', zf)
+        # The pending keys are in the dict storage too, for the C code reading
+        # it (e.g. json.dumps checks its size, then calls items())
+        for key in self._keys:
+            dict.__setitem__(self, key, _PENDING)
+
+    def _load(self, key):
+        keys, loader = self._loaders[key]
+        values = loader()
+        if len(keys) == 1:
+            values = (values,)
+        for k, value in zip(keys, values):
+            # Unless it was overwritten in the meantime
+            if self._loaders.pop(k, None) is not None:
+                dict.__setitem__(self, k, value)
+        if not self._loaders:
+            self.close()
+
+    def _load_all(self):
+        while self._loaders:
+            self._load(next(iter(self._loaders)))
+
+    def close(self):
+        for key in self._loaders:
+            dict.__delitem__(self, key)
+        self._loaders.clear()
+        self._keys[:] = [key for key in self._keys if dict.__contains__(self, key)]
+        if self._zf is not None:
+            self._zf.close()
+            object.__setattr__(self, '_zf', None)
+
+    def __getitem__(self, key):
+        if key in self._loaders:
+            self._load(key)
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __setitem__(self, key, value):
+        if key in self._loaders:
+            self._loaders.pop(key)
+        elif not dict.__contains__(self, key):
+            self._keys.append(key)
+        dict.__setitem__(self, key, value)
+
+    __setattr__ = __setitem__
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._loaders.pop(key, None)
+        self._keys.remove(key)
+
+    __delattr__ = __delitem__
+
+    def update(self, *args, **kwargs):
+        for key, value in odict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        self[key] = default
+        return default
+
+    def pop(self, key, default=_MISSING):
+        if key not in self:
+            if default is _MISSING:
+                raise KeyError(key)
+            return default
+        value = self[key]
+        del self[key]
+        return value
+
+    def popitem(self):
+        if not self._keys:
+            raise KeyError('popitem(): dictionary is empty')
+        key = self._keys[-1]
+        return key, self.pop(key)
+
+    def clear(self):
+        self._loaders.clear()
+        dict.clear(self)
+        self.close()
+
+    def __or__(self, other):
+        if not isinstance(other, dict):
+            return NotImplemented
+        data = self.copy()
+        data.update(other)
+        return data
+
+    def __ror__(self, other):
+        if not isinstance(other, dict):
+            return NotImplemented
+        data = odict(other)
+        data.update(self.items())
+        return data
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key)
+
+    def __iter__(self):
+        return iter(list(self._keys))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def keys(self):
+        return list(self._keys)
+
+    def values(self):
+        return [self[key] for key in self._keys]
+
+    def items(self):
+        return [(key, self[key]) for key in self._keys]
+
+    def copy(self):
+        self._load_all()
+        return odict(self.items())
+
+    def __eq__(self, other):
+        self._load_all()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        self._load_all()
+        return dict.__repr__(self)
+
+    def __reduce__(self):
+        # Unpickled as a regular odict
+        return odict, (self.items(),)
+
+
+def find_tag(opf, tag_name, attr, value):
+    # print('Finding tag: <{} {}="{}">'.format(tag_name, attr, value))
+    for tag in opf.get_elements(tag_name):
+        if tag.attributes.get(attr) == value:
+            return tag
+
+
+def find_img_tag(opf, tag_name, attr, value):
+    # print('Finding img tag: <{} {}="{}">'.format(tag_name, attr, value))
+    for tag in opf.get_elements(tag_name):
+        if tag.attributes.get(attr) == value:
+            filepath, file_extension = _image_href(tag)
+            if filepath:
+                return filepath, file_extension
+    return None, None
+
+
+def _image_href(item):
+    # (href, file extension) of a manifest item if it is an image
+    if item is not None and 'href' in item.attributes:
+        filepath = unquote(item.attributes['href'])
+        filename, file_extension = os.path.splitext(filepath)
+        if file_extension in ('.gif', '.jpg', '.jpeg', '.png', '.svg'):
+            return filepath, file_extension
+    return None, None
+
+
+def member_path(opf_filepath, filepath):
+    # Paths in the OPF file are relative to the OPF file. Also, normalize the
+    # path (ie opfpath/../cover.jpg -> cover.jpg)
+    base_dir = posixpath.dirname(opf_filepath)
+    return posixpath.normpath(posixpath.join(base_dir, filepath))
+
+
+def _discover_epub_version(opf):
+    return opf.version
+
+
+def __discover_dc(opf, name, first_only=True):
+    value = None
+    for tag_name in (name, 'dc:{}'.format(name)):
+        tags = opf.get_elements(tag_name)
+        if first_only:
+            value = tags[0].text if tags else None
+        else:
+            value = [tag.text for tag in tags if tag.text is not None]
+        if value:
+            break
+    if first_only:
+        return value.strip() if value else value
+    else:
+        return [v.strip() for v in value]
+
+
+def _discover_title(opf):
+    return __discover_dc(opf, 'title')
+
+
+def _discover_language(opf):
+    return __discover_dc(opf, 'language')
+
+
+def _discover_description(opf):
+    return __discover_dc(opf, 'description')
+
+
+def _find_author_from_html(tags):
+    # Only find a single author now with this algorithm but returning a list
+    # because that's what caller expects
+    authors = []
+
+    # First non-empty child node is author after the author 'tag'
+    found_author_tag = False
+
+    for tag in tags:
+        if not found_author_tag:
+            if tag.name == 'strong' and tag.text in ('Author', 'Authors'):
+                found_author_tag = True
+        else:
+            # Find all paragraph tags BEFORE we find another span tag. Those
+            # are the author(s).
+            if tag.name == 'span':
+                break
+
+            if tag.name == 'p' and tag.text is not None:
+                data = tag.text.strip()
+                if data:
+                    authors.append(data)
+
+    return authors
+
+
+def _creator_refinements(opf):
+    # EPUB 3 refinements of the creators: {id: {'role': ..., 'file-as': ...}}
+    # from <meta refines="#id" property="role">aut</meta>
+    refinements = {}
+    for tag in opf.get_elements('meta'):
+        refines = tag.attributes.get('refines')
+        prop = tag.attributes.get('property')
+        if refines and refines.startswith('#') and prop in ('role', 'file-as') and tag.text:
+            refinements.setdefault(refines[1:], {}).setdefault(prop, normalize_text(tag.text))
+    return refinements
+
+
+def _discover_creators(opf):
+    '''
+    Returns the creators, each an odict {name, role, file_as}: the EPUB 2
+    opf:role and opf:file-as attributes, or the EPUB 3 refinements. Deduped
+    on (name, role), in order.
+    '''
+    creators = odict()
+    refinements = None
+    for tag_name in _dc_elements('creator'):
+        for tag in opf.get_elements(tag_name):
+            name = normalize_text(tag.text) if tag.text else None
+            if name is None:
+                continue
+            role = file_as = None
+            for key, value in tag.attributes.items():
+                # Whatever the prefix of the OPF namespace
+                local_name = key.rpartition(':')[2]
+                if local_name == 'role':
+                    role = normalize_text(value)
+                elif local_name == 'file-as':
+                    file_as = normalize_text(value)
+            if 'id' in tag.attributes and (role is None or file_as is None):
+                if refinements is None:
+                    refinements = _creator_refinements(opf)
+                refined = refinements.get(tag.attributes['id'], {})
+                role = role or refined.get('role')
+                file_as = file_as or refined.get('file-as')
+            creators.setdefault((name, role), odict([('name', name), ('role', role), ('file_as', file_as)]))
+        if creators:
+            break
+    return list(creators.values())
+
+
+def _discover_authors(opf, fallbacks=None, normalize=False):
+    if normalize:
+        # The creators without role or with the author one, else all of them
+        creators = _discover_creators(opf)
+        authors = ([creator['name'] for creator in creators if creator['role'] in (None, 'aut')] or
+                   [creator['name'] for creator in creators])
+    else:
+        authors = __discover_dc(opf, 'creator', first_only=False)
+
+    # The fallback rules (see epub_meta.strategies) only run when the OPF
+    # file has no authors.
+    if not authors and fallbacks is not None:
+        authors = fallbacks.discover('authors') or []
+
+    # Remove the duplicates but keep the order, just in case the author order
+    # in epub is significant.
+    return list(odict.fromkeys(authors))
+
+
+def _discover_publisher(opf):
+    return __discover_dc(opf, 'publisher')
+
+
+def _find_publish_date_from_html(tags):
+    first_pub = 'First published:'
+
+    for tag in tags:
+        if tag.name == 'p' and tag.text is not None and tag.text.startswith(first_pub):
+            return tag.text.split(first_pub)[1].strip()
+
+
+def _discover_publication_date(opf, fallbacks=None):
+    date = __discover_dc(opf, 'date')
+
+    if not date and fallbacks is not None:
+        # Still '' (like the OPF discovery) when no rule finds a date
+        date = fallbacks.discover('publication_date') or date
+
+    return date
+
+
+# We've found large portion of books from specific publishers that store
+# the authors in pr02.html and the publish date in pr01.html in a very
+# specific place.
+default_strategies.register('authors', 'OEBPS/pr02.html', ('strong', 'p', 'span'), _find_author_from_html)
+default_strategies.register('publication_date', 'OEBPS/pr01.html', ('p',), _find_publish_date_from_html)
+
+
+def _discover_identifiers(opf, normalize=False):
+    # ISBN 10, ISBN 13 etc
+    identifiers = __discover_dc(opf, 'identifier', first_only=False)
+    return list(odict.fromkeys(identifiers)) if normalize else identifiers
+
+
+def _discover_subject(opf, normalize=False):
+    subject = __discover_dc(opf, 'subject', first_only=False)
+    return list(odict.fromkeys(subject)) if normalize else subject
+
+
+def discover_cover_image_path(opf, opf_filepath, cover_ids=None):
+    '''
+    Find the cover image path in the OPF file.
+    Returns a tuple: (image path in the ePub file, file extension)
+    cover_ids: the manifest item ids tried without <meta name="cover">
+    (default: those of default_strategies)
+    '''
+    filepath = None
+    extension = None
+
+    # Strategies to discover the cover-image path:
+
+    # The manifest index makes each strategy a hash lookup
+    manifest = opf.manifest_index
+
+    # e.g.: <meta name="cover" content="cover"/>
+    tag = opf.find_meta('cover')
+    if tag is not None and tag.attributes.get('content'):
+        # e.g.: <item href="cover.jpg" id="cover" media-type="image/jpeg"/>
+        filepath, extension = _image_href(manifest.by_id(tag.attributes['content']))
+    # ePub 3.x, e.g.: <item href="cover.jpg" id="c" properties="cover-image"/>
+    for item in manifest.with_property('cover-image'):
+        if filepath:
+            break
+        filepath, extension = _image_href(item)
+    for item_id in default_strategies.cover_ids if cover_ids is None else cover_ids:
+        if filepath:
+            break
+        filepath, extension = _image_href(manifest.by_id(item_id))
+
+    # If we have found the cover image path:
+    if filepath:
+        # The cover image path is relative to the OPF file
+        return member_path(opf_filepath, filepath), extension
+    return None, None
+
+
+def cover_image_zipinfo(zf, coverpath):
+    try:
+        return zf.getinfo(coverpath)
+    except KeyError:
+        raise EPubException("Cannot read {} from EPub file {}".format(
+            coverpath, display_name(zf.filename)))
+
+
+def discover_cover_image(zf, opf, opf_filepath, encoding='base64', cover_ids=None):
+    '''
+    Returns a tuple: (image content, file extension)
+    The content is raw bytes, or base64 with encoding='base64'.
+    '''
+    content = None
+    with phase('cover_image', zf.filename) as p:
+        coverpath, extension = discover_cover_image_path(opf, opf_filepath, cover_ids=cover_ids)
+        if coverpath:
+            content = zf.read(cover_image_zipinfo(zf, coverpath))
+            p.member, p.bytes = coverpath, len(content)
+            if encoding == 'base64':
+                content = base64.b64encode(content)
+    return content, extension
+
+
+def cover_image_info(zf, coverpath, extension):
+    zinfo = cover_image_zipinfo(zf, coverpath)
+    # The member data starts after its local file header, which has its own
+    # (variable) name and extra field lengths.
+    zf.fp.seek(zinfo.header_offset)
+    header = zf.fp.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+        raise EPubException("Bad local file header for {} in EPub file {}".format(
+            coverpath, display_name(zf.filename)))
+    header = struct.unpack(zipfile.structFileHeader, header)
+    offset = (zinfo.header_offset + zipfile.sizeFileHeader +
+              header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH])
+    return CoverImageInfo(coverpath, extension, offset, zinfo.compress_size, zinfo.file_size,
+                          zinfo.compress_type, zinfo.CRC)
+
+
+def discover_toc_paths(opf, opf_filepath):
+    '''
+    Returns a tuple: (ePub 3.x nav file path, ePub 2.x NCX file path)
+    Both may be None.
+    '''
+    xhtml = None
+    ncx = None
+    manifest = opf.manifest_index
+
+    tags = manifest.with_property('nav')
+    if tags and 'href' in tags[0].attributes:
+        # The xhtml file path is relative to the OPF file
+        xhtml = member_path(opf_filepath, unquote(tags[0].attributes['href']))
+
+    tag = manifest.by_id('ncx') or manifest.by_id('ncxtoc')
+    if tag is None:
+        tags = manifest.with_media_type(NCX_MEDIA_TYPE)
+        tag = tags[0] if tags else None
+    if tag is not None and 'href' in tag.attributes:
+        # The ncx file path is relative to the OPF file
+        ncx = member_path(opf_filepath, unquote(tag.attributes['href']))
+
+    return xhtml, ncx
+
+
+def discover_toc(zf, opf, opf_filepath, max_depth=None, max_entries=None):
+    '''
+    Returns a list of objects: {title: str, src: str, level: int, index: int}
+    '''
+    with phase('toc', zf.filename) as p:
+        toc = list(iter_toc(zf, opf, opf_filepath, p, max_depth=max_depth, max_entries=max_entries))
+    if toc:
+        return toc
+    # An NCX file without entries is an empty list
+    return [] if discover_toc_paths(opf, opf_filepath)[1] else None
+
+
+def iter_toc(zf, opf, opf_filepath, p, max_depth=None, max_entries=None):
+    # The ePub 3.x nav document, or the ePub 2.x NCX file if the nav document
+    # has no entries. Both are streamed from the zip file.
+    xhtml, ncx = discover_toc_paths(opf, opf_filepath)
+    index = 0
+    for filepath, parser_class in ((xhtml, NavParser), (ncx, NcxParser)):
+        if not filepath:
+            continue
+        parser = parser_class(max_depth=max_depth)
+        try:
+            with zf.open(filepath) as stream:
+                for entry in parser.iterate(stream, budget=budget(zf)):
+                    if max_entries is not None and index >= max_entries:
+                        return
+                    entry['index'] = index
+                    index += 1
+                    yield entry
+        finally:
+            p.member, p.bytes = filepath, (p.bytes or 0) + parser.bytes_read
+            p.nodes = (p.nodes or 0) + parser.node_count
+        if parser_class is NcxParser and not parser.has_nav_map:
+            print('Failed reading TOC')
+        if index:
+            return
+
+
+def open_epub(filepath, limits=None):
+    '''
+    Returns a tuple: (zip file, file size in bytes)
+    With limits, the zip file is a LimitedZipFile.
+    '''
+    # print('Reading ePub file: {}'.format(filepath))
+    with phase('open') as p:
+        zf, file_size_in_bytes = open_epub_zip(filepath)
+        p.filename = zf.filename
+    if limits is not None:
+        zf = LimitedZipFile(zf, limits)
+    return zf, file_size_in_bytes
+
+
+def discover_rootfiles(zf):
+    # The OPF file paths of the renditions, see parse_container
+    with phase('container', zf.filename) as p:
+        container = zf.read('META-INF/container.xml')
+        p.member, p.bytes = 'META-INF/container.xml', len(container)
+        return parse_container(container, budget=budget(zf))
+
+
+def rendition_path(zf, rootfiles, rendition=None):
+    # rendition: index or OPF file path in rootfiles (default: the first one)
+    if not rootfiles:
+        raise EPubException("Cannot parse raw metadata from {}".format(
+            display_name(zf.filename)))
+    if rendition is None:
+        return rootfiles[0]
+    if rendition in rootfiles:
+        return rendition
+    try:
+        return rootfiles[rendition]
+    except (IndexError, TypeError):
+        raise EPubException("No rendition {!r} in {}".format(rendition, display_name(zf.filename)))
+
+
+def discover_opf_filepath(zf):
+    return rendition_path(zf, discover_rootfiles(zf))
+
+
+def read_opf(zf, opf_filepath, plan=(None, False, False), content=None):
+    # Single pass over the OPF file, no DOM is built. plan: the parse_opf
+    # names, metadata_only and normalize arguments (see opf_plan). content: the OPF
+    # file if already read
+    with phase('opf', zf.filename) as p:
+        if content is None:
+            content = zf.read(opf_filepath)
+        opf = parse_opf(content, *plan, budget=budget(zf))
+        p.member, p.bytes, p.nodes = opf_filepath, len(content), opf.node_count
+        return opf
+
+
+def _dc_elements(name):
+    return (name, 'dc:{}'.format(name))
+
+
+# The metadata keys (in order) and the OPF elements they are discovered from
+_FIELD_ELEMENTS = [
+    ('epub_version', ('package',)),
+    ('title', _dc_elements('title')),
+    ('language', _dc_elements('language')),
+    ('description', _dc_elements('description')),
+    ('authors', _dc_elements('creator')),
+    ('creators', _dc_elements('creator') + ('meta',)),
+    ('publisher', _dc_elements('publisher')),
+    ('publication_date', _dc_elements('date')),
+    ('identifiers', _dc_elements('identifier')),
+    ('subject', _dc_elements('subject')),
+    ('file_size_in_bytes', ()),
+    ('cover_image_content', ('meta', 'item')),
+    ('cover_image_extension', ('meta', 'item')),
+    ('toc', ('item',)),
+]
+
+FIELDS = tuple(field for field, elements in _FIELD_ELEMENTS)
+
+# Elements of the OPF manifest (after the metadata)
+_MANIFEST_ELEMENTS = ('item',)
+
+
+def check_fields(fields):
+    if fields is None:
+        return None
+    fields = frozenset(fields)
+    unknown = fields.difference(FIELDS)
+    if unknown:
+        raise ValueError('Unknown metadata fields: {} (expected some of {})'.format(
+            ', '.join(sorted(unknown)), ', '.join(FIELDS)))
+    return fields
+
+
+def opf_plan(fields, normalize=False):
+    '''
+    Returns the parse_opf (names, metadata_only, normalize) arguments for the
+    fields: only their elements are collected, and the parsing stops after
+    the metadata when they don't need the manifest. names is empty when the
+    OPF file is not needed at all.
+    '''
+    if fields is None:
+        return None, False, normalize
+    names = set()
+    for field, elements in _FIELD_ELEMENTS:
+        if field in fields:
+            names.update(elements)
+    if normalize and 'authors' in fields:
+        # The authors are the creators with the author role
+        names.add('meta')
+    return names, not names.intersection(_MANIFEST_ELEMENTS), normalize
+
+
+COVER_PLAN = opf_plan(frozenset(['cover_image_content']))
+TOC_PLAN = opf_plan(frozenset(['toc']))
+
+
+def _or_fallback(field, loader, fallbacks):
+    def load():
+        value = loader()
+        if not value:
+            value = fallbacks.discover(field) or value
+        return value
+    return load
+
+
+def metadata_loaders(file_size_in_bytes, zf, opf, opf_filepath, read_cover_image=True, read_toc=True,
+                      cover_image_encoding='base64', fields=None, strategies=None, normalize=False):
+    '''
+    Returns the (keys, function) pairs that discover the metadata, in the
+    order of the keys in the metadata dict.
+    fields: only these keys (default: all, creators only with normalize)
+    strategies: a StrategyRegistry (default: default_strategies)
+    normalize: the OPF file was parsed with normalize=True
+    '''
+    if strategies is None:
+        strategies = default_strategies
+    fallbacks = strategies.fallbacks(zf)
+    cover_ids = strategies.cover_ids
+    loaders = [
+        (('epub_version',), lambda: _discover_epub_version(opf)),
+        (('title',), lambda: _discover_title(opf)),
+        (('language',), lambda: _discover_language(opf)),
+        (('description',), lambda: _discover_description(opf)),
+        (('authors',), lambda: _discover_authors(opf, fallbacks=fallbacks, normalize=normalize)),
+        (('publisher',), lambda: _discover_publisher(opf)),
+        (('publication_date',), lambda: _discover_publication_date(opf, fallbacks=fallbacks)),
+        (('identifiers',), lambda: _discover_identifiers(opf, normalize=normalize)),
+        (('subject',), lambda: _discover_subject(opf, normalize=normalize)),
+        (('file_size_in_bytes',), lambda: file_size_in_bytes),
+    ]
+    if normalize or (fields is not None and 'creators' in fields):
+        loaders.insert(5, (('creators',), lambda: _discover_creators(opf)))
+    # The rules of the other fields (authors and publication_date apply them
+    # themselves)
+    for index, (keys, loader) in enumerate(loaders):
+        if keys[0] in strategies.fields and keys[0] not in ('authors', 'publication_date'):
+            loaders[index] = (keys, _or_fallback(keys[0], loader, fallbacks))
+
+    if read_cover_image:
+        loaders.append((('cover_image_content', 'cover_image_extension'),
+                        lambda: discover_cover_image(zf, opf, opf_filepath, encoding=cover_image_encoding,
+                                                      cover_ids=cover_ids)))
+
+    if read_toc:
+        loaders.append((('toc',), lambda: discover_toc(zf, opf, opf_filepath)))
+
+    if fields is not None:
+        loaders = [(keys, loader) for keys, loader in loaders if fields.issuperset(keys)]
+        # Only one of the cover image keys
+        if read_cover_image and 'cover_image_content' in fields and 'cover_image_extension' not in fields:
+            loaders.append((('cover_image_content',),
+                            lambda: discover_cover_image(zf, opf, opf_filepath, encoding=cover_image_encoding,
+                                                          cover_ids=cover_ids)[0]))
+        elif read_cover_image and 'cover_image_extension' in fields and 'cover_image_content' not in fields:
+            # The OPF file is enough
+            loaders.append((('cover_image_extension',), lambda: discover_cover_image_path(opf, opf_filepath,
+                                                                                       cover_ids=cover_ids)[1]))
+        loaders.sort(key=lambda pair: FIELDS.index(pair[0][0]))
+
+    return loaders
+
+
+def update_metadata(data, keys, values):
+    if len(keys) == 1:
+        values = (values,)
+    data.update(zip(keys, values))
@@ -1,3 +1,10 @@
-
 class EPubException(Exception):
-    pass
\ No newline at end of file
+    pass
+
+
+class EPubTimeoutError(EPubException):
+    pass
+
+
+class EPubLimitError(EPubException):
+    pass
@@ -0,0 +1,221 @@
+'''
+Batch export of metadata results to a table: Parquet or Arrow IPC (requires
+pyarrow: pip install pyarrow), NDJSON or CSV.
+
+The results are streamed into per-column builders and written by row groups
+of row_group_size rows, so the memory doesn't depend on the number of books
+and there is no intermediate list of dicts:
+
+    results = epub_meta.scan_directory('/library', read_cover_image=False)
+    export_metadata(results, 'library.parquet')
+
+Besides the metadata columns, each row has the path of the ePub file and the
+error of the files that couldn't be read. authors, identifiers and subject
+are list columns, toc is a list of {title, src, level, index} structs and
+creators (normalize=True) a list of {name, role, file_as} structs (JSON
+arrays in CSV).
+'''
+import base64
+import csv
+import io
+import json
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+FORMATS = ('parquet', 'arrow', 'ndjson', 'csv')
+
+_EXTENSIONS = {
+    '.parquet': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.csv': 'csv',
+}
+
+# The cover image is not exported by default (it would dominate the table)
+DEFAULT_COLUMNS = ('path', 'error', 'title', 'authors', 'language', 'publisher', 'publication_date', 'description',
+                   'epub_version', 'identifiers', 'subject', 'file_size_in_bytes', 'cover_image_extension', 'toc')
+
+_LIST_COLUMNS = ('authors', 'identifiers', 'subject')
+
+
+def _arrow_type(column):
+    if column in _LIST_COLUMNS:
+        return pyarrow.list_(pyarrow.string())
+    if column == 'toc':
+        return pyarrow.list_(pyarrow.struct([('title', pyarrow.string()), ('src', pyarrow.string()),
+                                             ('level', pyarrow.int32()), ('index', pyarrow.int32())]))
+    if column == 'creators':
+        return pyarrow.list_(pyarrow.struct([('name', pyarrow.string()), ('role', pyarrow.string()),
+                                             ('file_as', pyarrow.string())]))
+    if column == 'file_size_in_bytes':
+        return pyarrow.int64()
+    if column == 'cover_image_content':
+        return pyarrow.binary()
+    return pyarrow.string()
+
+
+def arrow_schema(columns=DEFAULT_COLUMNS):
+    '''
+    Returns the pyarrow schema of the exported columns.
+    '''
+    if pyarrow is None:
+        raise ImportError('pyarrow is required for the Arrow and Parquet export: pip install pyarrow')
+    return pyarrow.schema([(column, _arrow_type(column)) for column in columns])
+
+
+def metadata_rows(results, columns=DEFAULT_COLUMNS):
+    '''
+    Generator of the rows of the metadata results ((path, metadata or
+    EPubException) tuples, or metadata dicts): lists of the values of the
+    columns, in order, as exported.
+    '''
+    for result in results:
+        if isinstance(result, tuple):
+            path, data = result
+        else:
+            path, data = None, result
+        error = None
+        if isinstance(data, Exception):
+            error, data = str(data), None
+        row = []
+        for column in columns:
+            if column == 'path':
+                row.append(path)
+            elif column == 'error':
+                row.append(error)
+            elif data is None:
+                row.append(None)
+            else:
+                value = data.get(column)
+                if column == 'toc' and value and not (isinstance(value, list) and isinstance(value[0], dict)):
+                    # TocEntry objects, or a TocColumns (compact or shared
+                    # memory metadata)
+                    value = [entry if isinstance(entry, dict) else entry.to_dict() for entry in value]
+                elif isinstance(value, tuple):
+                    value = list(value)
+                elif isinstance(value, memoryview):
+                    # A view of a shared memory segment
+                    value = value.tobytes()
+                row.append(value)
+        yield row
+
+
+class _ArrowWriter(object):
+    # Appends the rows to column lists and writes them as a record batch
+    # (a Parquet row group) every row_group_size rows.
+
+    def __init__(self, sink, format, columns, row_group_size):
+        self.schema = arrow_schema(columns)
+        self.row_group_size = row_group_size
+        self.columns = [[] for _ in columns]
+        if format == 'parquet':
+            self.writer = pyarrow.parquet.ParquetWriter(sink, self.schema)
+        else:
+            self.writer = pyarrow.ipc.new_file(sink, self.schema)
+
+    def append(self, row):
+        for values, value in zip(self.columns, row):
+            values.append(value)
+        if len(self.columns[0]) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.columns[0]:
+            return
+        arrays = [pyarrow.array(values, type=field.type) for values, field in zip(self.columns, self.schema)]
+        self.writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=self.schema))
+        for values in self.columns:
+            del values[:]
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+class _TextWriter(object):
+    # NDJSON (one object per line) or CSV (list columns as JSON arrays). The
+    # rows are written as they come.
+
+    def __init__(self, stream, format, columns):
+        self.stream = stream
+        self.format = format
+        self.columns = columns
+        if format == 'csv':
+            self.writer = csv.writer(stream)
+            self.writer.writerow(columns)
+
+    def append(self, row):
+        row = [base64.b64encode(value).decode('ascii') if isinstance(value, bytes) else value for value in row]
+        if self.format == 'ndjson':
+            self.stream.write(json.dumps(dict(zip(self.columns, row))) + '\n')
+        else:
+            self.writer.writerow([json.dumps(value) if isinstance(value, list) else value for value in row])
+
+    def close(self):
+        self.stream.flush()
+
+
+def _format(destination, format):
+    if format is not None:
+        if format not in FORMATS:
+            raise ValueError('Unknown format: {} (expected one of {})'.format(format, ', '.join(FORMATS)))
+        return format
+    name = destination if isinstance(destination, str) else getattr(destination, 'name', '')
+    for extension, format in _EXTENSIONS.items():
+        if str(name).lower().endswith(extension):
+            return format
+    return 'parquet' if pyarrow is not None else 'ndjson'
+
+
+def export_metadata(results, destination, format=None, columns=DEFAULT_COLUMNS, row_group_size=10000):
+    '''
+    Writes the metadata results as a table. Returns the number of rows.
+    results: iterable of (path, metadata or exception) tuples, like
+    iter_epub_metadata and scan_directory yield (shared_memory=True
+    included), or of metadata (dicts or EpubMetadata)
+    destination: a file path or a binary file object (not closed)
+    format: parquet, arrow, ndjson or csv. Default: from the file
+    extension, else parquet when pyarrow is installed and ndjson otherwise.
+    columns: path, error and metadata keys. cover_image_content is a binary
+    column, as given (base64, or the raw image with get_epub_metadata
+    cover_image_encoding=None)
+    row_group_size: rows per Parquet row group (or Arrow record batch)
+    '''
+    format = _format(destination, format)
+    if format in ('parquet', 'arrow') and pyarrow is None:
+        raise ImportError('pyarrow is required for the Arrow and Parquet export: pip install pyarrow')
+    columns = tuple(columns)
+
+    owned = isinstance(destination, str)
+    stream = open(destination, 'wb') if owned else destination
+    text_stream = None
+    try:
+        if format in ('parquet', 'arrow'):
+            writer = _ArrowWriter(stream, format, columns, row_group_size)
+        else:
+            text_stream = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+            writer = _TextWriter(text_stream, format, columns)
+        count = 0
+        try:
+            for row in metadata_rows(results, columns):
+                writer.append(row)
+                count += 1
+        finally:
+            # Interrupted (e.g. Ctrl-C), the file is still valid with the
+            # rows written so far
+            writer.close()
+    finally:
+        if text_stream is not None:
+            # Keeps the stream open
+            text_stream.detach()
+        if owned:
+            stream.close()
+    return count
@@ -0,0 +1,234 @@
+'''
+Instrumentation of the metadata extraction: each phase of each ePub file
+(open, container, opf, html_fallback, cover_image, toc, text, total) emits a
+PhaseEvent to the registered listeners. Without listeners, the cost is a
+check per phase. The directory watcher also emits a watch event per result
+(see epub_meta.watcher).
+
+    with epub_meta.instrument(print):
+        epub_meta.get_epub_metadata('/path/to/book.epub')
+
+    stats = epub_meta.PhaseStats()
+    with epub_meta.instrument(stats):
+        for path in paths:
+            epub_meta.get_epub_metadata(path)
+    print(stats.as_dict())
+
+Listeners are per process: with iter_epub_metadata(executor='process') the
+workers don't see the listeners of the main process (use executor='thread').
+'''
+from collections import namedtuple
+from contextlib import contextmanager
+import threading
+import time
+
+
+# filename: the ePub file (zipfile.ZipFile.filename)
+# phase: open, container, opf, html_fallback, cover_image, toc, text (each
+# block of a spine document parsed by iter_epub_text), total or watch (a
+# DirectoryWatcher event)
+# seconds: duration of the phase (watch: latency from the change of the file
+# to the event)
+# member: the member read in the phase, if any
+# bytes: decompressed bytes of the member
+# nodes: XML elements parsed
+# error: the exception raised in the phase, or None
+PhaseEvent = namedtuple('PhaseEvent', 'filename phase seconds member bytes nodes error')
+
+_listeners = []
+_lock = threading.Lock()
+
+
+def add_listener(listener):
+    '''
+    Registers a callable, called with a PhaseEvent at the end of each phase
+    (in the thread running the phase).
+    '''
+    with _lock:
+        _listeners.append(listener)
+
+
+def remove_listener(listener):
+    with _lock:
+        _listeners.remove(listener)
+
+
+@contextmanager
+def instrument(listener):
+    '''
+    Registers the listener in the with block.
+    '''
+    add_listener(listener)
+    try:
+        yield listener
+    finally:
+        remove_listener(listener)
+
+
+class _Phase(object):
+    # Measures a phase, the code in the with block sets the member, bytes and
+    # nodes attributes.
+    __slots__ = ('filename', 'phase', 'member', 'bytes', 'nodes', '_start')
+    enabled = True
+
+    def __init__(self, phase, filename):
+        self.phase = phase
+        self.filename = filename
+        self.member = None
+        self.bytes = None
+        self.nodes = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and not issubclass(exc_type, Exception):
+            # Interrupted (e.g. a scan timeout), not a failure of the phase
+            return
+        event = PhaseEvent(self.filename, self.phase, time.perf_counter() - self._start, self.member,
+                           self.bytes, self.nodes, exc_value)
+        for listener in list(_listeners):
+            listener(event)
+
+
+class _NullPhase(object):
+    # Shared by every phase when there are no listeners: the attributes set
+    # by the instrumented code are ignored.
+    __slots__ = ()
+    enabled = False
+    filename = member = bytes = nodes = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_PHASE = _NullPhase()
+
+
+def phase(name, filename=None):
+    '''
+    Context manager measuring a phase of the extraction, for the collector.
+    '''
+    if not _listeners:
+        return _NULL_PHASE
+    return _Phase(name, filename)
+
+
+def record(name, filename, seconds, error=None):
+    '''
+    Emits the PhaseEvent of a duration measured elsewhere, e.g. the latency of
+    the watcher events.
+    '''
+    if _listeners:
+        event = PhaseEvent(filename, name, seconds, None, None, None, error)
+        for listener in list(_listeners):
+            listener(event)
+
+
+class PhaseStats(object):
+    '''
+    Listener aggregating the events per phase: count, errors, seconds, bytes
+    and nodes (thread-safe).
+    '''
+
+    def __init__(self):
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            stats = self.phases.get(event.phase)
+            if stats is None:
+                stats = self.phases[event.phase] = {'count': 0, 'errors': 0, 'seconds': 0.0, 'bytes': 0, 'nodes': 0}
+            stats['count'] += 1
+            stats['errors'] += event.error is not None
+            stats['seconds'] += event.seconds
+            stats['bytes'] += event.bytes or 0
+            stats['nodes'] += event.nodes or 0
+
+    def as_dict(self):
+        with self._lock:
+            return dict((name, dict(stats)) for name, stats in self.phases.items())
+
+
+class PrometheusListener(object):
+    '''
+    Listener exporting the events as Prometheus metrics (requires
+    prometheus_client):
+    - <prefix>_phase_seconds histogram
+    - <prefix>_decompressed_bytes_total counter
+    - <prefix>_parsed_nodes_total counter
+    - <prefix>_phase_errors_total counter
+    All labeled by phase.
+    '''
+
+    def __init__(self, registry=None, prefix='epub_meta'):
+        try:
+            import prometheus_client
+        except ImportError:
+            raise ImportError('prometheus_client is required for the Prometheus metrics: '
+                              'pip install prometheus_client')
+        options = {'registry': registry} if registry is not None else {}
+        self.seconds = prometheus_client.Histogram(
+            prefix + '_phase_seconds', 'Duration of the ePub metadata extraction phases', ['phase'], **options)
+        self.bytes = prometheus_client.Counter(
+            prefix + '_decompressed_bytes', 'Bytes decompressed from the ePub files', ['phase'], **options)
+        self.nodes = prometheus_client.Counter(
+            prefix + '_parsed_nodes', 'XML elements parsed from the ePub files', ['phase'], **options)
+        self.errors = prometheus_client.Counter(
+            prefix + '_phase_errors', 'Failed ePub metadata extraction phases', ['phase'], **options)
+
+    def __call__(self, event):
+        self.seconds.labels(event.phase).observe(event.seconds)
+        if event.bytes:
+            self.bytes.labels(event.phase).inc(event.bytes)
+        if event.nodes:
+            self.nodes.labels(event.phase).inc(event.nodes)
+        if event.error is not None:
+            self.errors.labels(event.phase).inc()
+
+
+class OpenTelemetryListener(object):
+    '''
+    Listener recording the events with OpenTelemetry metrics (requires
+    opentelemetry-api), with a phase attribute:
+    - <prefix>.phase.duration histogram (s)
+    - <prefix>.decompressed counter (By)
+    - <prefix>.parsed_nodes counter
+    - <prefix>.phase.errors counter
+    meter: default: the meter 'epub_meta' of the global meter provider
+    '''
+
+    def __init__(self, meter=None, prefix='epub_meta'):
+        if meter is None:
+            try:
+                from opentelemetry import metrics
+            except ImportError:
+                raise ImportError('opentelemetry-api is required for the OpenTelemetry metrics: '
+                                  'pip install opentelemetry-api')
+            meter = metrics.get_meter('epub_meta')
+        self.seconds = meter.create_histogram(
+            prefix + '.phase.duration', unit='s', description='Duration of the ePub metadata extraction phases')
+        self.bytes = meter.create_counter(
+            prefix + '.decompressed', unit='By', description='Bytes decompressed from the ePub files')
+        self.nodes = meter.create_counter(
+            prefix + '.parsed_nodes', description='XML elements parsed from the ePub files')
+        self.errors = meter.create_counter(
+            prefix + '.phase.errors', description='Failed ePub metadata extraction phases')
+
+    def __call__(self, event):
+        attributes = {'phase': event.phase}
+        self.seconds.record(event.seconds, attributes)
+        if event.bytes:
+            self.bytes.add(event.bytes, attributes)
+        if event.nodes:
+            self.nodes.add(event.nodes, attributes)
+        if event.error is not None:
+            self.errors.add(1, attributes)
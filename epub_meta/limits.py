@@ -0,0 +1,155 @@
+'''
+Resource limits of the metadata extraction, against pathological ePub files
+(zip bombs, huge nav files, deeply generated XML...):
+
+    limits = epub_meta.Limits(max_member_bytes=16 * 1024 ** 2, max_total_bytes=64 * 1024 ** 2,
+                              max_nodes=500000, max_seconds=5)
+    epub_meta.get_epub_metadata(path, limits=limits)
+
+They are enforced while streaming: the zip members are decompressed in
+chunks and the XML parsers count their elements, so the extraction stops as
+soon as a limit is reached and raises EPubLimitError (an EPubException).
+'''
+import time
+import zipfile
+
+from epub_meta.archive import display_name
+from epub_meta.exceptions import EPubLimitError
+
+
+CHUNK_SIZE = 64 * 1024
+
+# Reported to the budget by the XML parsers every NODE_STEP elements
+NODE_STEP = 1024
+
+
+class Limits(object):
+    '''
+    max_member_bytes: decompressed bytes of a zip member
+    max_total_bytes: decompressed bytes of all the members read for a book
+    max_nodes: XML elements parsed for a book (checked every 1024 elements,
+    and after each chunk of a streamed ToC document)
+    max_seconds: wall time of the extraction of a book, from the opening of
+    the file (checked between chunks and elements, so a single C call like
+    a decompression step is not interrupted)
+    None: no limit.
+    '''
+    __slots__ = ('max_member_bytes', 'max_total_bytes', 'max_nodes', 'max_seconds')
+
+    def __init__(self, max_member_bytes=None, max_total_bytes=None, max_nodes=None, max_seconds=None):
+        self.max_member_bytes = max_member_bytes
+        self.max_total_bytes = max_total_bytes
+        self.max_nodes = max_nodes
+        self.max_seconds = max_seconds
+
+    def __reduce__(self):
+        return Limits, (self.max_member_bytes, self.max_total_bytes, self.max_nodes, self.max_seconds)
+
+    def __repr__(self):
+        return 'Limits(max_member_bytes={!r}, max_total_bytes={!r}, max_nodes={!r}, max_seconds={!r})'.format(
+            self.max_member_bytes, self.max_total_bytes, self.max_nodes, self.max_seconds)
+
+
+class LimitedZipFile(object):
+    '''
+    zipfile.ZipFile wrapper enforcing the limits of a book: read and open
+    count the decompressed bytes, the XML parsers report their elements with
+    add_nodes. Everything else is delegated to the zip file.
+    '''
+
+    def __init__(self, zf, limits):
+        self._zf = zf
+        self.limits = limits
+        self.bytes_read = 0
+        self.node_count = 0
+        self.deadline = time.monotonic() + limits.max_seconds if limits.max_seconds is not None else None
+
+    def __getattr__(self, name):
+        return getattr(self._zf, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._zf.close()
+
+    def _fail(self, message):
+        raise EPubLimitError('{} in {}'.format(message, display_name(self._zf.filename)))
+
+    def check_time(self):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self._fail('Time limit ({}s) exceeded'.format(self.limits.max_seconds))
+
+    def add_bytes(self, name, member_bytes, count):
+        # member_bytes: bytes of the member so far, count included
+        limits = self.limits
+        self.bytes_read += count
+        if limits.max_member_bytes is not None and member_bytes > limits.max_member_bytes:
+            self._fail('Member {} is larger than {} bytes'.format(name, limits.max_member_bytes))
+        if limits.max_total_bytes is not None and self.bytes_read > limits.max_total_bytes:
+            self._fail('More than {} decompressed bytes'.format(limits.max_total_bytes))
+        self.check_time()
+
+    def add_nodes(self, count):
+        self.node_count += count
+        if self.limits.max_nodes is not None and self.node_count > self.limits.max_nodes:
+            self._fail('More than {} XML elements'.format(self.limits.max_nodes))
+        self.check_time()
+
+    def checkpoint(self):
+        return self.bytes_read, self.node_count
+
+    def restore(self, checkpoint):
+        # The code run again after an interruption (see aio) is not counted
+        # twice
+        self.bytes_read, self.node_count = checkpoint
+
+    def open(self, name, mode='r'):
+        zinfo = name if isinstance(name, zipfile.ZipInfo) else self._zf.getinfo(name)
+        # A member declared too large is not even opened (zipfile doesn't
+        # decompress more than the declared size, which is counted again
+        # while reading for the book budget).
+        self.add_bytes(zinfo.filename, zinfo.file_size, 0)
+        return LimitedStream(self, zinfo.filename, self._zf.open(zinfo, mode))
+
+    def read(self, name):
+        with self.open(name) as stream:
+            return b''.join(iter(lambda: stream.read(CHUNK_SIZE), b''))
+
+
+class LimitedStream(object):
+    '''
+    Stream of a zip member, counting the decompressed bytes in the budget of
+    the book.
+    '''
+
+    def __init__(self, zf, name, stream):
+        self._zf = zf
+        self._stream = stream
+        self.name = name
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(CHUNK_SIZE), b''))
+        data = self._stream.read(size)
+        self.bytes_read += len(data)
+        self._zf.add_bytes(self.name, self.bytes_read, len(data))
+        return data
+
+    def close(self):
+        self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def budget(zf):
+    '''
+    Returns the LimitedZipFile (the XML parsers report their elements to
+    it), or None without limits.
+    '''
+    return zf if isinstance(zf, LimitedZipFile) else None
@@ -0,0 +1,302 @@
+from html import unescape
+import re
+import unicodedata
+from xml.parsers import expat
+
+from epub_meta.limits import NODE_STEP
+
+
+# The Dublin Core elements, whose text content is normalized by
+# parse_opf(normalize=True)
+DC_ELEMENTS = frozenset(name for element in ('contributor', 'coverage', 'creator', 'date', 'description', 'format',
+                                             'identifier', 'language', 'publisher', 'relation', 'rights', 'source',
+                                             'subject', 'title', 'type')
+                        for name in (element, 'dc:' + element))
+
+# A character reference left escaped (e.g. &amp;eacute; in the OPF file)
+_ENTITY = re.compile(r'&(#[0-9]+|#x[0-9a-fA-F]+|[A-Za-z][A-Za-z0-9]*);')
+
+# ASCII text is already in NFC (str.isascii needs Python 3.7)
+_NON_ASCII = re.compile(r'[^\x00-\x7f]')
+
+
+def normalize_text(text):
+    '''
+    Returns the text with the remaining HTML character references decoded,
+    the whitespace runs collapsed to a space and stripped, in Unicode NFC, or
+    None if nothing is left.
+    '''
+    if '&' in text and _ENTITY.search(text):
+        text = unescape(text)
+    text = ' '.join(text.split())
+    if not text:
+        return None
+    if _NON_ASCII.search(text):
+        text = unicodedata.normalize('NFC', text)
+    return text
+
+
+class Element(object):
+    '''
+    Flat record of an XML element collected by `iterate_elements`.
+    `text` mirrors `firstChild.nodeValue` of the equivalent minidom node: the
+    character data before the first child node, the data of a first comment,
+    processing instruction or CDATA section, or None if the element is empty
+    or starts with an element. For the `text_content` elements, it is their
+    normalized text content instead (see normalize_text).
+    '''
+    __slots__ = ('name', 'attributes', 'text')
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.text = None
+
+    def __repr__(self):
+        return '<Element {} {!r}>'.format(self.name, self.attributes)
+
+
+class ElementList(list):
+    '''
+    Elements returned by `iterate_elements`. `node_count` is the number of
+    elements parsed (collected or not).
+    '''
+    node_count = 0
+
+
+class _StopParsing(Exception):
+    pass
+
+
+def iterate_elements(content, names=None, stop_after=None, budget=None, text_content=None):
+    '''
+    Parse the XML content in a single pass and return the elements, in
+    document order, whose qualified name (prefix included, like minidom's
+    getElementsByTagName) is in `names`. All elements are returned when
+    `names` is None. No tree is built.
+    The parsing stops at the end of the first element whose name is in
+    `stop_after`, if any.
+    budget: a LimitedZipFile, the elements are reported to it (every
+    NODE_STEP elements) while parsing
+    text_content: names of collected elements whose text is their whole
+    text content (the character data of their descendants too), normalized
+    when they end
+    '''
+    elements = ElementList()
+    # Each frame is [element or None, kind of its first child node ('text',
+    # 'cdata', 'comment', 'pi', 'element') or None, the text_content element
+    # gathering the character data or None, True while the first child node
+    # is the text or CDATA section being read]. Like minidom, a CDATA section
+    # is a node of its own (but an empty one is no node at all).
+    stack = []
+    in_cdata = [False]
+
+    def child_node(kind, value=None):
+        if stack:
+            frame = stack[-1]
+            frame[3] = False
+            if frame[1] is None:
+                frame[1] = kind
+                if frame[0] is not None and frame[2] is None:
+                    frame[0].text = value
+
+    def start_element(name, attributes):
+        elements.node_count += 1
+        if budget is not None and elements.node_count % NODE_STEP == 0:
+            budget.add_nodes(NODE_STEP)
+        child_node('element')
+        element = None
+        if names is None or name in names:
+            element = Element(name, attributes)
+            elements.append(element)
+        if text_content is not None and element is not None and name in text_content:
+            element.text = []
+            stack.append([element, None, element, False])
+        else:
+            stack.append([element, None, stack[-1][2] if stack else None, False])
+
+    def end_element(name):
+        frame = stack.pop()
+        if frame[2] is not None and frame[2] is frame[0]:
+            frame[0].text = normalize_text(''.join(frame[0].text))
+        if stop_after is not None and name in stop_after:
+            raise _StopParsing()
+
+    def character_data(data):
+        frame = stack[-1]
+        if frame[2] is not None:
+            frame[2].text.append(data)
+            return
+        kind = 'cdata' if in_cdata[0] else 'text'
+        if frame[1] is None:
+            frame[1], frame[3] = kind, True
+            if frame[0] is not None:
+                frame[0].text = data
+        elif frame[3] and frame[1] == kind:
+            if frame[0] is not None:
+                frame[0].text += data
+        else:
+            frame[3] = False
+
+    def comment(data):
+        child_node('comment', data)
+
+    def processing_instruction(target, data):
+        child_node('pi', data)
+
+    def start_cdata():
+        in_cdata[0] = True
+
+    def end_cdata():
+        in_cdata[0] = False
+        if stack and stack[-1][1] == 'cdata':
+            stack[-1][3] = False
+
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+    parser.CommentHandler = comment
+    parser.ProcessingInstructionHandler = processing_instruction
+    parser.StartCdataSectionHandler = start_cdata
+    parser.EndCdataSectionHandler = end_cdata
+    try:
+        parser.Parse(content, True)
+    except _StopParsing:
+        pass
+    if budget is not None:
+        budget.add_nodes(elements.node_count % NODE_STEP)
+    return elements
+
+
+class ManifestIndex(object):
+    '''
+    Hash maps of the manifest items (Elements) of an OPF file, built in one
+    pass: by id, by href (as written in the OPF file), by properties token
+    (e.g. 'nav', 'cover-image') and by media-type. Ids and hrefs map to the
+    first item, the others to the items in manifest order.
+    '''
+    __slots__ = ('_ids', '_hrefs', '_properties', '_media_types')
+
+    def __init__(self, items):
+        ids = self._ids = {}
+        hrefs = self._hrefs = {}
+        properties = self._properties = {}
+        media_types = self._media_types = {}
+        # Backwards, so that the first item wins (the lists are reversed at
+        # the end)
+        for item in reversed(items):
+            attributes = item.attributes
+            value = attributes.get('id')
+            if value is not None:
+                ids[value] = item
+            value = attributes.get('href')
+            if value is not None:
+                hrefs[value] = item
+            value = attributes.get('media-type')
+            if value is not None:
+                group = media_types.get(value)
+                if group is None:
+                    group = media_types[value] = []
+                group.append(item)
+            value = attributes.get('properties')
+            if value:
+                for token in value.split():
+                    properties.setdefault(token, []).append(item)
+        for groups in (properties, media_types):
+            for group in groups.values():
+                group.reverse()
+
+    def by_id(self, item_id):
+        return self._ids.get(item_id)
+
+    def by_href(self, href):
+        return self._hrefs.get(href)
+
+    def with_property(self, token):
+        return self._properties.get(token, [])
+
+    def with_media_type(self, media_type):
+        return self._media_types.get(media_type, [])
+
+
+class Package(object):
+    '''
+    Everything the collector needs from an OPF file, gathered in one walk:
+    Dublin Core fields, manifest items, meta tags and spine entries.
+    '''
+
+    def __init__(self, elements):
+        self.node_count = getattr(elements, 'node_count', len(elements))
+        self._elements = {}
+        for element in elements:
+            self._elements.setdefault(element.name, []).append(element)
+        self._manifest_index = None
+        self._meta_names = None
+
+    def get_elements(self, name):
+        return self._elements.get(name, [])
+
+    @property
+    def manifest_index(self):
+        '''
+        The ManifestIndex of the manifest items (built on first access).
+        '''
+        if self._manifest_index is None:
+            self._manifest_index = ManifestIndex(self.manifest)
+        return self._manifest_index
+
+    def find_meta(self, name):
+        '''
+        Returns the first <meta name="..."> element with that name, or None.
+        '''
+        if self._meta_names is None:
+            self._meta_names = {}
+            for tag in self.meta:
+                if 'name' in tag.attributes:
+                    self._meta_names.setdefault(tag.attributes['name'], tag)
+        return self._meta_names.get(name)
+
+    @property
+    def version(self):
+        try:
+            return self.get_elements('package')[0].attributes['version']
+        except (KeyError, IndexError):
+            return None
+
+    @property
+    def manifest(self):
+        return self.get_elements('item')
+
+    @property
+    def meta(self):
+        return self.get_elements('meta')
+
+    @property
+    def spine(self):
+        return [item.attributes['idref'] for item in self.get_elements('itemref')
+                if 'idref' in item.attributes]
+
+
+def parse_container(content, budget=None):
+    '''
+    Returns the list of rootfile paths (OPF files) of META-INF/container.xml,
+    one per rendition, in order
+    e.g.: <rootfile full-path="content.opf" media-type="application/oebps-package+xml"/>
+    '''
+    return [tag.attributes['full-path'] for tag in iterate_elements(content, ('rootfile',), budget=budget)
+            if 'full-path' in tag.attributes]
+
+
+def parse_opf(content, names=None, metadata_only=False, normalize=False, budget=None):
+    '''
+    names: only collect these elements (default: all of them)
+    metadata_only: stop parsing at the end of the <metadata> element (the
+    manifest and the spine are not needed)
+    normalize: the text of the Dublin Core elements is their normalized text
+    content (see normalize_text), in the same pass
+    '''
+    stop_after = ('metadata', 'opf:metadata') if metadata_only else None
+    return Package(iterate_elements(content, names, stop_after=stop_after, budget=budget,
+                                    text_content=DC_ELEMENTS if normalize else None))
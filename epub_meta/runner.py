@@ -1,8 +1,5 @@
-
 if __name__ == '__main__':
     import sys
-    from pprint import pprint
-    from epub_meta import get_epub_metadata
-    dirpath = sys.argv[1]
-    data = get_epub_metadata(dirpath, read_cover_image=False, read_toc=True)
-    pprint(data)
+    from epub_meta.cli import main
+    # Same as: epub-meta show FILE
+    sys.exit(main(['show'] + sys.argv[1:]))
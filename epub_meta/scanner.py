@@ -0,0 +1,330 @@
+import os
+import signal
+import threading
+import time
+from collections import deque
+from concurrent import futures
+from concurrent.futures.process import BrokenProcessPool
+from queue import Queue, Empty
+
+from epub_meta.collector import get_epub_metadata
+from epub_meta.exceptions import EPubException, EPubTimeoutError
+from epub_meta import transport
+
+
+# How often the pending work is checked for files over the timeout
+POLL_INTERVAL = 0.1
+
+
+class _Timeout(BaseException):
+    # BaseException so the collector code can't swallow it
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise _Timeout()
+
+
+def _timeout_error(path, timeout):
+    return EPubTimeoutError('Timeout ({}s) reading {}'.format(timeout, path))
+
+
+def _extract(path, timeout, options, function=None):
+    '''
+    Returns (path, function(path, **options) or EPubException). Never raises.
+    The function is get_epub_metadata by default.
+    '''
+    # A real per-file timeout is only possible in the main thread of a
+    # process (the workers of the process pool).
+    use_alarm = timeout and hasattr(signal, 'setitimer') and (
+        threading.current_thread() is threading.main_thread())
+    try:
+        if use_alarm:
+            previous_handler = signal.signal(signal.SIGALRM, _raise_timeout)
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            return path, (function or get_epub_metadata)(path, **options)
+        finally:
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                signal.signal(signal.SIGALRM, previous_handler)
+    except _Timeout:
+        return path, _timeout_error(path, timeout)
+    except EPubException as e:
+        return path, e
+    except Exception as e:
+        return path, EPubException('Cannot read {}: {!r}'.format(path, e))
+
+
+def _extract_chunk(paths, timeout, options, function=None, shared=False):
+    results = [_extract(path, timeout, options, function) for path in paths]
+    if shared:
+        # The large values go through shared memory (see epub_meta.transport)
+        results = [(path, transport.share_result(data)) for path, data in results]
+    return results
+
+
+def _receive(result):
+    # A shared memory result of a worker process, in the parent
+    path, data = result
+    if isinstance(data, Exception):
+        return result
+    try:
+        return path, transport.SharedMetadata.attach(data)
+    except OSError as e:
+        return path, EPubException('Cannot read the shared result of {}: {!r}'.format(path, e))
+
+
+def _received(results, shared):
+    # Yields the results of a chunk in the parent. The segments of those not
+    # yielded because the iteration was stopped are freed.
+    if not shared:
+        for result in results:
+            yield result
+        return
+    for index, result in enumerate(results):
+        try:
+            yield _receive(result)
+        except GeneratorExit:
+            for path, data in results[index + 1:]:
+                transport.discard_result(data)
+            raise
+
+
+def _discard_results(future):
+    # Done callback of the chunks whose results won't be read
+    if not future.cancelled() and future.exception() is None:
+        for path, data in future.result():
+            transport.discard_result(data)
+
+
+def _chunks(paths, chunksize):
+    chunk = []
+    for path in paths:
+        chunk.append(path)
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _terminate_pool(pool):
+    # There is no public API to stop a running task of a ProcessPoolExecutor:
+    # killing its processes breaks the pool, which is then replaced.
+    for process in list((getattr(pool, '_processes', None) or {}).values()):
+        process.terminate()
+
+
+def _init_worker():
+    # A Python SIGTERM handler inherited from the parent (e.g. the command
+    # line tool) would keep _terminate_pool from killing a stuck worker.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def _iter_processes(paths, workers, chunksize, timeout, options, function, shared=False):
+    if shared:
+        transport.prepare()
+    chunks = _chunks(paths, chunksize)
+    # A crashed or killed worker breaks the whole pool. The files of the
+    # broken chunks are retried one by one. A file that breaks the pool again
+    # is a suspect: it is retried alone in the pool, so a crash can only be
+    # its own fault.
+    retries = deque()
+    suspects = deque()
+    pending = {}
+    pool = futures.ProcessPoolExecutor(workers, initializer=_init_worker)
+    try:
+        while True:
+            # At most one chunk per worker, so the submission time is a good
+            # approximation of the start time.
+            while len(pending) < workers:
+                alone = False
+                if suspects:
+                    if pending:
+                        break
+                    chunk, alone = suspects.popleft(), True
+                else:
+                    chunk = retries.popleft() if retries else next(chunks, None)
+                    if chunk is None:
+                        break
+                deadline = time.time() + timeout * (len(chunk) + 1) if timeout else None
+                pending[pool.submit(_extract_chunk, chunk, timeout, options, function, shared)] = (
+                    chunk, deadline, alone)
+                if alone:
+                    break
+            if not pending:
+                break
+
+            done, _ = futures.wait(pending, timeout=POLL_INTERVAL if timeout else None,
+                                   return_when=futures.FIRST_COMPLETED)
+
+            overdue = set()
+            if timeout:
+                now = time.time()
+                overdue = set(future for future, (chunk, deadline, alone) in pending.items()
+                              if future not in done and now > deadline)
+                if overdue:
+                    # The worker didn't respond to the alarm (e.g. stuck in C code)
+                    _terminate_pool(pool)
+                    futures.wait(pending)
+                    done = set(pending)
+
+            broken = []
+            for future in done:
+                chunk, deadline, alone = pending.pop(future)
+                try:
+                    results = future.result()
+                except BrokenProcessPool:
+                    broken.append((future, chunk, alone))
+                else:
+                    yield from _received(results, shared)
+
+            if broken:
+                for future, chunk, alone in broken:
+                    if len(chunk) > 1:
+                        retries.extend([path] for path in chunk)
+                    elif future in overdue:
+                        yield chunk[0], _timeout_error(chunk[0], timeout)
+                    elif alone:
+                        yield chunk[0], EPubException('Worker crashed reading {}'.format(chunk[0]))
+                    elif overdue:
+                        # Killed with the pool, not its fault
+                        retries.append(chunk)
+                    else:
+                        suspects.append(chunk)
+                # Every other pending chunk is lost with the pool too
+                futures.wait(pending)
+                lost = list(pending.items())
+                pending.clear()
+                for future, (chunk, deadline, alone) in lost:
+                    try:
+                        results = future.result()
+                    except BrokenProcessPool:
+                        retries.extend([path] for path in chunk)
+                    else:
+                        yield from _received(results, shared)
+                pool.shutdown(wait=False)
+                pool = futures.ProcessPoolExecutor(workers, initializer=_init_worker)
+    finally:
+        for future in pending:
+            if not future.cancel() and shared:
+                future.add_done_callback(_discard_results)
+        pool.shutdown(wait=False)
+
+
+def _iter_threads(paths, workers, timeout, options, function):
+    # A thread can't be interrupted: a file over the timeout is reported and
+    # its thread abandoned (and replaced), so it doesn't stall the batch.
+    tasks = Queue()
+    results = Queue()
+    running = {}
+
+    def work():
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            running[task] = time.time()
+            result = _extract(task[1], None, options, function)
+            if running.pop(task, None) is None:
+                # Abandoned after the timeout
+                return
+            results.put(result)
+
+    def start_worker():
+        thread = threading.Thread(target=work)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    threads = [start_worker() for _ in range(workers)]
+    paths = iter(paths)
+    in_flight = 0
+    count = 0
+    try:
+        while True:
+            while in_flight < workers * 2:
+                path = next(paths, None)
+                if path is None:
+                    break
+                count += 1
+                tasks.put((count, path))
+                in_flight += 1
+            if not in_flight:
+                break
+
+            try:
+                result = results.get(timeout=POLL_INTERVAL if timeout else None)
+                in_flight -= 1
+                yield result
+            except Empty:
+                pass
+
+            if timeout:
+                now = time.time()
+                for task, started in list(running.items()):
+                    if now - started > timeout and running.pop(task, None) is not None:
+                        in_flight -= 1
+                        threads.append(start_worker())
+                        yield task[1], _timeout_error(task[1], timeout)
+    finally:
+        for _ in threads:
+            tasks.put(None)
+
+
+def iter_epub_metadata(paths, workers=None, executor='process', chunksize=16, timeout=None, cache=None,
+                       shared_memory=False, **options):
+    '''
+    Extracts the metadata of many ePub files in parallel.
+    Yields (path, metadata) tuples in completion order. If a file can't be
+    read, metadata is an EPubException (EPubTimeoutError if it takes more than
+    `timeout` seconds). A corrupt file never stops the batch.
+    - executor: 'process' or 'thread'
+    - chunksize: number of paths sent to a worker process at once
+    - cache: a MetadataCache, unchanged files are not read again, or a
+      DedupIndex, copies of a book are only read once
+    - shared_memory: the worker processes send the cover image and the ToC
+      through shared memory, the metadata is a SharedMetadata to release
+      (see epub_meta.transport)
+    - options: get_epub_metadata arguments, e.g. read_cover_image=False
+    '''
+    function = cache.get_epub_metadata if cache is not None else None
+    return _iter_results(function, paths, workers, executor, chunksize, timeout, options, shared_memory)
+
+
+def _iter_results(function, paths, workers=None, executor='process', chunksize=16, timeout=None, options=None,
+                  shared_memory=False):
+    # function must be picklable for the process executor (None for
+    # get_epub_metadata)
+    if executor not in ('process', 'thread'):
+        raise ValueError('Unknown executor: {}'.format(executor))
+    options = options or {}
+    if shared_memory:
+        if executor != 'process':
+            raise ValueError("shared_memory requires executor='process'")
+        if options.get('lazy') or options.get('compact'):
+            raise ValueError('shared_memory metadata cannot be lazy or compact')
+        transport.check_available()
+    workers = workers or os.cpu_count() or 1
+    if executor == 'thread':
+        return _iter_threads(paths, workers, timeout, options, function)
+    return _iter_processes(paths, workers, max(1, chunksize), timeout, options, function, shared_memory)
+
+
+def iter_epub_files(dirpath, extensions=('.epub',)):
+    '''
+    Walks the directory tree and yields the ePub file paths (lazily).
+    '''
+    for root, dirnames, filenames in os.walk(dirpath):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(extensions):
+                yield os.path.join(root, filename)
+
+
+def scan_directory(dirpath, extensions=('.epub',), **kwargs):
+    '''
+    iter_epub_metadata over all ePub files of a directory tree.
+    '''
+    return iter_epub_metadata(iter_epub_files(dirpath, extensions), **kwargs)
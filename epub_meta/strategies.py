@@ -0,0 +1,150 @@
+'''
+Fallback discovery strategies, for the books whose OPF file lacks some
+metadata: rules read it from other (HTML) members of the ePub file, e.g.
+some publishers only store the authors in OEBPS/pr02.html.
+
+    registry = epub_meta.default_strategies.copy()
+
+    @registry.rule('publisher', 'OEBPS/copyright.html', ('p',))
+    def copyright_publisher(tags):
+        for tag in tags:
+            if tag.text and tag.text.startswith('Published by '):
+                return tag.text[len('Published by '):]
+
+    epub_meta.get_epub_metadata(path, strategies=registry)
+
+A rule declares the metadata field it discovers, the member it reads and the
+element names it needs; its function gets these elements (see
+epub_meta.parser.Element) in document order and returns the value, or None.
+The rules of a field only run when the OPF discovery came back empty, in
+registration order, until one returns a value. Each member is parsed at most
+once per book, collecting the elements of all its rules, and the members
+missing from the book are skipped from the zip directory: the cost of a book
+doesn't grow with the number of rules that don't apply to it.
+
+The registry also lists the manifest item ids tried for the cover image when
+there is no <meta name="cover"> (add_cover_id).
+'''
+from collections import namedtuple
+
+from epub_meta.instrumentation import phase
+from epub_meta.limits import budget
+from epub_meta.parser import iterate_elements
+
+
+Rule = namedtuple('Rule', 'name field member tags function')
+
+
+class StrategyRegistry(object):
+    '''
+    Ordered fallback rules and cover ids. See the module documentation.
+    '''
+
+    def __init__(self, rules=(), cover_ids=('cover-image', 'cover')):
+        self._rules = list(rules)
+        self.cover_ids = tuple(cover_ids)
+        self._compiled = None
+
+    def register(self, field, member, tags, function, name=None):
+        '''
+        Adds a rule after the others. Returns the function.
+        '''
+        self._rules.append(Rule(name or function.__name__, field, member, frozenset(tags), function))
+        self._compiled = None
+        return function
+
+    def rule(self, field, member, tags, name=None):
+        '''
+        Decorator registering a rule.
+        '''
+        def decorator(function):
+            return self.register(field, member, tags, function, name=name)
+        return decorator
+
+    def add_cover_id(self, item_id):
+        '''
+        Adds a manifest item id to try for the cover image, after the others.
+        '''
+        self.cover_ids += (item_id,)
+
+    def copy(self):
+        return StrategyRegistry(self._rules, self.cover_ids)
+
+    @property
+    def rules(self):
+        return tuple(self._rules)
+
+    @property
+    def fields(self):
+        '''
+        The fields with rules.
+        '''
+        return self._compile()[0].keys()
+
+    def _compile(self):
+        # field -> rules, member -> the elements needed by its rules
+        if self._compiled is None:
+            field_rules = {}
+            member_tags = {}
+            for rule in self._rules:
+                field_rules.setdefault(rule.field, []).append(rule)
+                member_tags[rule.member] = member_tags.get(rule.member, frozenset()).union(rule.tags)
+            self._compiled = (dict((field, tuple(rules)) for field, rules in field_rules.items()), member_tags)
+        return self._compiled
+
+    def fallbacks(self, zf):
+        '''
+        Returns the Fallbacks of a book (its parsed members are shared by
+        the rules).
+        '''
+        field_rules, member_tags = self._compile()
+        return Fallbacks(zf, field_rules, member_tags)
+
+    def __repr__(self):
+        # Stable, for the cache keys
+        return 'StrategyRegistry(rules={!r}, cover_ids={!r})'.format(
+            [(rule.name, rule.field, rule.member) for rule in self._rules], list(self.cover_ids))
+
+
+class Fallbacks(object):
+    '''
+    The rules applied to a book.
+    '''
+
+    def __init__(self, zf, field_rules, member_tags):
+        self._zf = zf
+        self._field_rules = field_rules
+        self._member_tags = member_tags
+        self._members = {}  # member -> parsed elements, or None
+
+    def discover(self, field):
+        '''
+        Returns the first value found by the rules of the field, or None.
+        '''
+        for rule in self._field_rules.get(field, ()):
+            tags = self._tags(rule.member)
+            if tags is None:
+                continue
+            if rule.tags != self._member_tags[rule.member]:
+                # Other rules of the member need other elements
+                tags = [tag for tag in tags if tag.name in rule.tags]
+            value = rule.function(tags)
+            if value:
+                return value
+        return None
+
+    def _tags(self, member):
+        if member not in self._members:
+            with phase('html_fallback', self._zf.filename) as p:
+                try:
+                    content = self._zf.read(member)
+                except KeyError:
+                    self._members[member] = None
+                    return None
+                tags = iterate_elements(content, self._member_tags[member], budget=budget(self._zf))
+                p.member, p.bytes, p.nodes = member, len(content), tags.node_count
+                self._members[member] = tags
+        return self._members[member]
+
+
+default_strategies = StrategyRegistry()
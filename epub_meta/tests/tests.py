@@ -1,14 +1,67 @@
 # coding: utf-8
+import asyncio
+import base64
+import io
 import os
 import json
+import mmap
+import multiprocessing
+import pickle
+import shutil
+import tempfile
+import threading
+import time
 import unittest
+import zipfile
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
 
 from epub_meta import get_epub_metadata, get_epub_opf_xml, EPubException
-from epub_meta.collector import IS_PY2
+from epub_meta import iter_epub_metadata, scan_directory, EPubTimeoutError, MetadataCache
+from epub_meta import get_epub_cover_image, open_epub_cover_image, get_epub_cover_image_info
+from epub_meta import aio, archive, cli, export, instrumentation, scanner, thumbnails, transport, watcher
+from epub_meta import PhaseStats, instrument
+from epub_meta import get_epub_toc, iter_epub_toc, TocColumns
+from epub_meta import EpubMetadata, TocEntry
+from epub_meta import EPubLimitError, Limits
+from epub_meta import DedupIndex, book_fingerprint
+from epub_meta import EpubBook, TextChunk, iter_epub_text
+from epub_meta import StrategyRegistry, default_strategies
+from epub_meta import DirectoryWatcher, WatchEvent, watch_directory
+from epub_meta import SharedMetadata
+from epub_meta.collector import IS_PY2, LazyMetadata, odict
+from epub_meta.text import CHUNK_SIZE
+from epub_meta.parser import iterate_elements, normalize_text, parse_container, parse_opf
 
 
 dir_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../samples')
 
+CONTAINER = b'''<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>'''
+
+OPF = '''<?xml version="1.0"?>
+<package version="3.0" xmlns="http://www.idpf.org/2007/opf" xmlns:dc="http://purl.org/dc/elements/1.1/">
+  <metadata>{metadata}</metadata>
+  <manifest>{manifest}</manifest>
+  <spine>{spine}</spine>
+</package>'''
+
+
+def build_epub(filepath, metadata='<dc:title>Title</dc:title>', manifest='', spine='', members=None,
+               compression=zipfile.ZIP_DEFLATED):
+    '''
+    Writes a minimal ePub file. members: {path: content} (paths in the zip file)
+    '''
+    with zipfile.ZipFile(filepath, 'w', compression) as zf:
+        zf.writestr(zipfile.ZipInfo('mimetype'), b'application/epub+zip')
+        zf.writestr('META-INF/container.xml', CONTAINER)
+        zf.writestr('OEBPS/content.opf', OPF.format(metadata=metadata, manifest=manifest, spine=spine))
+        for name, content in (members or {}).items():
+            zf.writestr(name, content)
+    return filepath
+
 
 class GetEPubMetadataTests(unittest.TestCase):
     def test_inexistent_file(self):
@@ -251,6 +304,90 @@ class GetEPubMetadataTests(unittest.TestCase):
             self.assertEqual(type(data.toc[1]), dict)
 
 
+class LazyMetadataTests(unittest.TestCase):
+    def test_only_accessed_fields_are_discovered(self):
+        filepath = os.path.join(dir_path, 'moby-dick.epub')
+        # The file size comes with the opening of the zip file, not a field
+        # of its own
+        with mock.patch('epub_meta.discovery.discover_toc') as toc, \
+                mock.patch('epub_meta.discovery.discover_cover_image') as cover:
+            data = get_epub_metadata(filepath, lazy=True)
+            self.assertIsInstance(data, LazyMetadata)
+            self.assertEqual(data.title, 'Moby-Dick')
+            self.assertEqual(data['authors'], ['Herman Melville'])
+            self.assertTrue('toc' in data)
+            self.assertFalse(toc.called or cover.called)
+
+    def test_dict_compatibility(self):
+        filepath = os.path.join(dir_path, 'moby-dick.epub')
+        eager = get_epub_metadata(filepath)
+        self.assertEqual(get_epub_metadata(filepath, lazy=True), eager)
+        self.assertEqual(dict(get_epub_metadata(filepath, lazy=True)), eager)
+        self.assertEqual(list(get_epub_metadata(filepath, lazy=True)), list(eager))
+        self.assertEqual(len(get_epub_metadata(filepath, lazy=True, read_toc=False)), len(eager) - 1)
+        self.assertIsNone(get_epub_metadata(filepath, lazy=True).unknown)
+
+    def test_file_is_closed(self):
+        data = get_epub_metadata(os.path.join(dir_path, 'moby-dick.epub'), lazy=True)
+        zf = data._zf
+        data.copy()
+        self.assertIsNone(zf.fp)
+        data = get_epub_metadata(os.path.join(dir_path, 'moby-dick.epub'), lazy=True)
+        data.title
+        data.close()
+        self.assertEqual(list(data), ['title'])
+
+    def lazy(self):
+        return get_epub_metadata(os.path.join(dir_path, 'moby-dick.epub'), lazy=True, read_toc=False)
+
+    def test_update(self):
+        data = self.lazy()
+        data.update({'x': 1}, title='Title')
+        self.assertEqual(list(data)[-1], 'x')
+        self.assertEqual((data.x, data.title, len(data)), (1, 'Title', len(self.lazy()) + 1))
+        data |= {'y': 2}
+        self.assertEqual(data.y, 2)
+
+    def test_pop(self):
+        data = self.lazy()
+        self.assertEqual(data.pop('title'), 'Moby-Dick')
+        self.assertNotIn('title', data)
+        self.assertNotIn('title', list(data))
+        self.assertRaises(KeyError, data.pop, 'title')
+        self.assertEqual(data.pop('title', None), None)
+
+    def test_setdefault(self):
+        data = self.lazy()
+        self.assertEqual(data.setdefault('title', 'X'), 'Moby-Dick')
+        self.assertEqual(data.title, 'Moby-Dick')
+        self.assertEqual(data.setdefault('x', 'X'), 'X')
+        self.assertEqual(data.x, 'X')
+
+    def test_popitem(self):
+        data = self.lazy()
+        expected = list(self.lazy().copy().items())
+        items = [data.popitem() for _ in range(len(expected))]
+        self.assertEqual(items, expected[::-1])
+        self.assertEqual((len(data), list(data)), (0, []))
+        self.assertRaises(KeyError, data.popitem)
+
+    def test_clear(self):
+        data = self.lazy()
+        zf = data._zf
+        data.clear()
+        self.assertEqual((len(data), list(data), data.title), (0, [], None))
+        self.assertIsNone(zf.fp)
+
+    def test_or(self):
+        expected = self.lazy().copy()
+        merged = self.lazy() | {'x': 1}
+        self.assertEqual(merged, dict(expected, x=1))
+        self.assertEqual({'x': 1, 'title': 'X'} | self.lazy(), dict(expected, x=1))
+        filepath = os.path.join(dir_path, 'moby-dick.epub')
+        self.assertEqual(json.dumps(get_epub_metadata(filepath, lazy=True, read_cover_image=False)),
+                         json.dumps(get_epub_metadata(filepath, read_cover_image=False)))
+
+
 class GetOpfXmlTests(unittest.TestCase):
     def test_inexistent_file(self):
         try:
@@ -271,3 +408,1326 @@ class PrintEPubMetadataTests(unittest.TestCase):
         for sample in samples:
             data = get_epub_metadata(os.path.join(dir_path, sample), read_cover_image=False, read_toc=True)
             print(json.dumps(data, indent=4))
+
+
+class ParserTests(unittest.TestCase):
+    def test_element_text_mirrors_minidom_first_child(self):
+        tags = iterate_elements(b'<a><b>One &amp; two<i>x</i>three</b><b><i>x</i>y</b><b/></a>', ('b',))
+        self.assertEqual([tag.text for tag in tags], ['One & two', None, None])
+
+    def test_element_text_parity_with_minidom(self):
+        from xml.dom import minidom
+        for content in ('<t><!--c-->T</t>', '<t>x<![CDATA[cd]]></t>', '<t><![CDATA[a]]>b</t>',
+                        '<t><?pi data?>T</t>', '<t><![CDATA[]]>x</t>', '<t>a<![CDATA[]]>b</t>',
+                        '<t>a&amp;b<!--c-->d</t>', '<t><!---->x</t>', '<t>a<b/>c</t>'):
+            first_child = minidom.parseString(content).documentElement.firstChild
+            self.assertEqual(iterate_elements(content, ('t',))[0].text, first_child.nodeValue, content)
+
+    def test_qualified_names(self):
+        tags = iterate_elements(b'<package xmlns:dc="dc"><dc:title>A</dc:title><title>B</title></package>')
+        self.assertEqual([tag.name for tag in tags], ['package', 'dc:title', 'title'])
+
+    def test_parse_container(self):
+        container = b'''<container><rootfiles>
+            <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+            <rootfile full-path="OEBPS/fixed.opf" media-type="application/oebps-package+xml"/>
+        </rootfiles></container>'''
+        self.assertEqual(parse_container(container), ['OEBPS/content.opf', 'OEBPS/fixed.opf'])
+        self.assertEqual(parse_container(b'<container/>'), [])
+
+    def test_parse_opf(self):
+        opf = parse_opf(b'''<package version="3.0" xmlns:dc="http://purl.org/dc/elements/1.1/">
+            <metadata><dc:title>Title</dc:title><meta name="cover" content="img"/></metadata>
+            <manifest><item id="img" href="cover.jpg"/><item id="c1" href="c1.xhtml"/></manifest>
+            <spine toc="ncx"><itemref idref="c1"/></spine>
+        </package>''')
+        self.assertEqual(opf.version, '3.0')
+        self.assertEqual(opf.get_elements('dc:title')[0].text, 'Title')
+        self.assertEqual([item.attributes['id'] for item in opf.manifest], ['img', 'c1'])
+        self.assertEqual(opf.meta[0].attributes['content'], 'img')
+        self.assertEqual(opf.spine, ['c1'])
+
+    def test_author_and_date_html_fallbacks(self):
+        from epub_meta.discovery import _find_author_from_html, _find_publish_date_from_html
+        tags = iterate_elements(b'''<html><body><div><strong>Authors</strong></div>
+            <p>John Doe</p><p><b>x</b></p><p>Jane Roe</p><span/><p>Other</p>
+            <p>First published: 2001-01-01</p></body></html>''', ('strong', 'p', 'span'))
+        self.assertEqual(_find_author_from_html(tags), ['John Doe', 'Jane Roe'])
+        self.assertEqual(_find_publish_date_from_html(tags), '2001-01-01')
+
+
+def _slow_or_crashing_metadata(path, **kwargs):
+    if path.endswith('.hang'):
+        time.sleep(30)
+    if path.endswith('.crash'):
+        os._exit(1)
+    return get_epub_metadata(path, **kwargs)
+
+
+class ScanTests(unittest.TestCase):
+    samples = sorted(os.path.join(dir_path, sample) for sample in os.listdir(dir_path))
+
+    def test_scan_directory(self):
+        for executor in ('process', 'thread'):
+            results = dict(scan_directory(dir_path, workers=2, executor=executor, chunksize=2, read_cover_image=False))
+            self.assertEqual(sorted(results), self.samples)
+            self.assertEqual(results[os.path.join(dir_path, 'moby-dick.epub')].title, 'Moby-Dick')
+            self.assertNotIn('cover_image_content', results[os.path.join(dir_path, 'moby-dick.epub')])
+
+    def test_errors_do_not_stop_the_batch(self):
+        paths = [os.path.join(dir_path, 'inexistent.epub'), __file__, self.samples[0]]
+        results = dict(iter_epub_metadata(paths, workers=2, executor='thread'))
+        self.assertIsInstance(results[paths[0]], EPubException)
+        self.assertIsInstance(results[paths[1]], EPubException)
+        self.assertEqual(results[paths[2]].epub_version, '2.0')
+
+    def test_thread_timeout(self):
+        paths = [os.path.join(dir_path, 'book.hang'), self.samples[0]]
+        with mock.patch.object(scanner, 'get_epub_metadata', _slow_or_crashing_metadata):
+            results = dict(iter_epub_metadata(paths, workers=1, executor='thread', timeout=0.2))
+        self.assertIsInstance(results[paths[0]], EPubTimeoutError)
+        self.assertEqual(results[paths[1]].epub_version, '2.0')
+
+    @unittest.skipIf(multiprocessing.get_start_method() != 'fork', 'The workers must inherit the mock')
+    def test_process_timeout_and_crash(self):
+        paths = [os.path.join(dir_path, 'book.crash'), self.samples[0],
+                 os.path.join(dir_path, 'book.hang'), self.samples[1]]
+        with mock.patch.object(scanner, 'get_epub_metadata', _slow_or_crashing_metadata):
+            results = dict(iter_epub_metadata(paths, workers=2, chunksize=2, timeout=0.2))
+        self.assertIsInstance(results[paths[0]], EPubException)
+        self.assertIsInstance(results[paths[2]], EPubTimeoutError)
+        self.assertEqual(results[paths[1]].epub_version, '2.0')
+        self.assertEqual(results[paths[3]].epub_version, '3.0')
+
+
+class MetadataCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmp_dir, 'book.epub')
+        shutil.copy(os.path.join(dir_path, 'moby-dick.epub'), self.filepath)
+        self.cache = MetadataCache(os.path.join(self.tmp_dir, 'cache.db'))
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_hit_does_not_read_the_file(self):
+        data = self.cache.get_epub_metadata(self.filepath)
+        with mock.patch('epub_meta.cache.get_epub_metadata') as collector:
+            self.assertEqual(self.cache.get_epub_metadata(self.filepath), data)
+            self.assertEqual(self.cache.get_epub_metadata(self.filepath, read_toc=True), data)
+            self.assertEqual(self.cache.get_epub_metadata(self.filepath).title, 'Moby-Dick')
+            self.assertFalse(collector.called)
+        self.assertIsNone(self.cache.get(self.filepath, read_toc=False))
+
+    def test_changed_file_is_a_miss(self):
+        self.cache.get_epub_metadata(self.filepath)
+        os.utime(self.filepath, (1, 1))
+        self.assertIsNone(self.cache.get(self.filepath))
+
+    def test_content_hash(self):
+        cache = MetadataCache(os.path.join(self.tmp_dir, 'hash.db'), use_hash=True)
+        cache.get_epub_metadata(self.filepath)
+        os.utime(self.filepath, (1, 1))
+        self.assertEqual(cache.get(self.filepath).title, 'Moby-Dick')
+        cache.close()
+
+    def test_invalidate(self):
+        self.cache.get_epub_metadata(self.filepath)
+        self.cache.invalidate(self.filepath)
+        self.assertIsNone(self.cache.get(self.filepath))
+
+    def test_lru_eviction(self):
+        other = os.path.join(self.tmp_dir, 'other.epub')
+        shutil.copy(os.path.join(dir_path, 'mathjax_tests.epub'), other)
+        cache = MetadataCache(os.path.join(self.tmp_dir, 'lru.db'), max_size=1)
+        cache.get_epub_metadata(self.filepath, read_cover_image=False)
+        cache.get_epub_metadata(other, read_cover_image=False)
+        self.assertIsNone(cache.get(self.filepath, read_cover_image=False))
+        cache.close()
+
+    def test_scan_with_cache(self):
+        results = dict(iter_epub_metadata([self.filepath], workers=1, cache=self.cache))
+        self.assertEqual(results[self.filepath].title, 'Moby-Dick')
+        self.assertEqual(self.cache.get(self.filepath).title, 'Moby-Dick')
+
+
+class CompactMetadataTests(unittest.TestCase):
+    def test_same_values_as_the_dict(self):
+        for sample in ('moby-dick.epub', 'georgia-cfi-20120521.epub', 'mathjax_tests.epub'):
+            filepath = os.path.join(dir_path, sample)
+            data = get_epub_metadata(filepath)
+            compact = get_epub_metadata(filepath, compact=True)
+            self.assertIsInstance(compact, EpubMetadata)
+            self.assertEqual(compact.to_dict(), data)
+            self.assertEqual(compact, data)
+            self.assertEqual(list(dict(compact)), list(data))
+            self.assertEqual(compact.title, data.title)
+            self.assertEqual(compact['authors'], tuple(data.authors))
+            self.assertIsInstance(compact.toc[0], TocEntry)
+            self.assertEqual(compact.toc[0].title, data.toc[0]['title'])
+
+    def test_missing_keys(self):
+        compact = get_epub_metadata(os.path.join(dir_path, 'moby-dick.epub'), read_cover_image=False,
+                                    read_toc=False, compact=True)
+        self.assertIsNone(compact.toc)
+        self.assertNotIn('toc', compact)
+        self.assertRaises(KeyError, lambda: compact['toc'])
+        self.assertEqual(compact.get('cover_image_content', 'missing'), 'missing')
+        self.assertNotIn('toc', compact.to_dict())
+        self.assertRaises(AttributeError, lambda: compact.unknown)
+        self.assertRaises(ValueError, get_epub_metadata, os.path.join(dir_path, 'moby-dick.epub'),
+                          lazy=True, compact=True)
+
+    def test_interned_strings(self):
+        a = EpubMetadata.from_dict({'language': ''.join(['e', 'n']), 'authors': [''.join(['A', 'B'])]})
+        b = EpubMetadata.from_dict({'language': ''.join(['e', 'n']), 'authors': [''.join(['A', 'B'])]})
+        self.assertIs(a.language, b.language)
+        self.assertIs(a.authors[0], b.authors[0])
+
+    def test_pickle(self):
+        compact = get_epub_metadata(os.path.join(dir_path, 'moby-dick.epub'), compact=True)
+        copy = pickle.loads(pickle.dumps(compact))
+        self.assertEqual(copy, compact)
+        self.assertIs(copy.language, compact.language)
+        self.assertFalse(hasattr(copy, '__dict__'))
+        self.assertFalse(hasattr(copy.toc[0], '__dict__'))
+
+
+class FieldsTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_same_values(self):
+        filepath = os.path.join(dir_path, 'moby-dick.epub')
+        data = get_epub_metadata(filepath)
+        for fields in (['title', 'identifiers'], ['cover_image_extension'], ['cover_image_content'], ['toc'],
+                       ['file_size_in_bytes', 'authors', 'epub_version']):
+            expected = dict((key, value) for key, value in data.items() if key in fields)
+            self.assertEqual(get_epub_metadata(filepath, fields=fields), expected)
+            self.assertEqual(get_epub_metadata(filepath, fields=fields, lazy=True).copy(), expected)
+        self.assertEqual(list(get_epub_metadata(filepath, fields={'toc', 'title', 'authors'})),
+                         ['title', 'authors', 'toc'])
+        self.assertEqual(get_epub_metadata(filepath, fields=['toc'], read_toc=False), {})
+        self.assertRaises(ValueError, get_epub_metadata, filepath, fields=['title', 'isbn'])
+
+    def test_skipped_work(self):
+        # No authors in the OPF file: the default extraction reads pr02.html
+        filepath = build_epub(os.path.join(self.tmp_dir, 'book.epub'),
+                              metadata='<dc:identifier>isbn</dc:identifier>',
+                              manifest=''.join('<item id="c{0}" href="c{0}.xhtml"/>'.format(i) for i in range(100)),
+                              members={'OEBPS/pr02.html': '<html><strong>Author</strong><p>Someone</p></html>'})
+        events = []
+        with instrument(events.append):
+            data = get_epub_metadata(filepath, fields={'identifiers'})
+        self.assertEqual(data, {'identifiers': ['isbn']})
+        self.assertEqual([event.phase for event in events], ['open', 'container', 'opf', 'total'])
+        # Stopped at the end of the metadata
+        self.assertLess(events[2].nodes, 10)
+
+        events = []
+        with instrument(events.append):
+            data = get_epub_metadata(filepath, fields={'file_size_in_bytes'})
+        self.assertEqual(data, {'file_size_in_bytes': os.path.getsize(filepath)})
+        self.assertEqual([event.phase for event in events], ['open', 'total'])
+
+    def test_async_and_cache(self):
+        filepath = os.path.join(dir_path, 'moby-dick.epub')
+        expected = get_epub_metadata(filepath, fields=['title', 'toc'])
+        self.assertEqual(asyncio.run(aio.async_get_epub_metadata(filepath, fields=['title', 'toc'])), expected)
+        cache = MetadataCache(os.path.join(self.tmp_dir, 'cache.db'))
+        self.assertEqual(cache.get_epub_metadata(filepath, fields={'title', 'toc'}), expected)
+        self.assertEqual(cache.get(filepath, fields={'toc', 'title'}), expected)
+        cache.close()
+
+
+class LimitTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_zip_bomb(self):
+        # 64 MiB of zeros compressed to 64 KiB, as the pr02.html fallback
+        filepath = build_epub(os.path.join(self.tmp_dir, 'bomb.epub'), metadata='',
+                              members={'OEBPS/pr02.html': b'<html>' + b' ' * 64 * 1024 ** 2 + b'</html>'})
+        self.assertEqual(get_epub_metadata(filepath, limits=Limits(max_member_bytes=1024 ** 2),
+                                           fields={'title'}), {'title': None})
+        with self.assertRaises(EPubLimitError) as context:
+            get_epub_metadata(filepath, limits=Limits(max_member_bytes=1024 ** 2))
+        self.assertIn('OEBPS/pr02.html', str(context.exception))
+        self.assertRaises(EPubException, get_epub_metadata, filepath, limits=Limits(max_total_bytes=1024 ** 2))
+
+    def test_nodes(self):
+        filepath = build_epub(os.path.join(self.tmp_dir, 'book.epub'), metadata='<dc:identifier>isbn</dc:identifier>',
+                              manifest='<item id="c" href="c.xhtml"/>' * 5000)
+        limits = Limits(max_nodes=1000)
+        self.assertRaises(EPubLimitError, get_epub_metadata, filepath, limits=limits)
+        # The manifest is not parsed
+        self.assertEqual(get_epub_metadata(filepath, fields={'identifiers'}, limits=limits), {'identifiers': ['isbn']})
+
+        nav = '<html><nav epub:type="toc"><ol>{}</ol></nav></html>'.format(
+            '<li><a href="c.xhtml">Chapter</a></li>' * 2000)
+        filepath = build_epub(os.path.join(self.tmp_dir, 'nav.epub'),
+                              manifest='<item id="nav" href="nav.xhtml" properties="nav"/>',
+                              members={'OEBPS/nav.xhtml': nav})
+        self.assertEqual(len(get_epub_toc(filepath, limits=Limits(max_nodes=10000))), 2000)
+        self.assertRaises(EPubLimitError, get_epub_toc, filepath, limits=limits)
+
+    def test_time(self):
+        filepath = os.path.join(dir_path, 'moby-dick.epub')
+        clock = iter(range(1000))
+        with mock.patch('epub_meta.limits.time.monotonic', lambda: next(clock)):
+            self.assertRaises(EPubLimitError, get_epub_metadata, filepath, limits=Limits(max_seconds=3))
+
+    def test_async_and_scan(self):
+        filepath = os.path.join(dir_path, 'moby-dick.epub')
+        with EpubBook(filepath, limits=Limits()) as book:
+            book.metadata
+            zf = book._zf
+        # The members fetched and parsed again by the ranged reads are not
+        # counted twice
+        limits = Limits(max_total_bytes=zf.bytes_read, max_nodes=zf.node_count)
+        self.assertEqual(asyncio.run(aio.async_get_epub_metadata(filepath, limits=limits)),
+                         get_epub_metadata(filepath, limits=limits))
+        limits = Limits(max_total_bytes=zf.bytes_read - 1)
+        self.assertRaises(EPubLimitError, asyncio.run, aio.async_get_epub_metadata(filepath, limits=limits))
+
+        results = dict(iter_epub_metadata([filepath], workers=2, limits=limits))
+        self.assertIsInstance(results[filepath], EPubLimitError)
+
+
+class DedupTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.original = os.path.abspath(os.path.join(dir_path, 'moby-dick.epub'))
+        self.copy = os.path.join(self.tmp_dir, 'copy.epub')
+        shutil.copy(self.original, self.copy)
+        # Same members, stored without compression and in another order
+        self.repackaged = os.path.join(self.tmp_dir, 'repackaged.epub')
+        with zipfile.ZipFile(self.original) as source, zipfile.ZipFile(self.repackaged, 'w') as destination:
+            for zinfo in reversed(source.infolist()):
+                destination.writestr(zinfo.filename, source.read(zinfo))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_fingerprints(self):
+        self.assertEqual(book_fingerprint(self.original), book_fingerprint(self.copy))
+        self.assertEqual(book_fingerprint(self.original), book_fingerprint(self.repackaged))
+        self.assertNotEqual(book_fingerprint(self.original),
+                            book_fingerprint(os.path.join(dir_path, 'georgia-cfi-20120521.epub')))
+        self.assertRaises(EPubException, book_fingerprint, __file__)
+
+    def test_served_from_copies(self):
+        index = DedupIndex(os.path.join(self.tmp_dir, 'dedup.db'))
+        other = os.path.join(dir_path, 'georgia-cfi-20120521.epub')
+        self.assertEqual(index.get_epub_metadata(self.original), get_epub_metadata(self.original))
+        index.get_epub_metadata(other)
+        events = []
+        with instrument(events.append):
+            data = index.get_epub_metadata(self.repackaged)
+        # Only the central directory is read
+        self.assertEqual([event.phase for event in events], ['open', 'total'])
+        expected = get_epub_metadata(self.repackaged)
+        self.assertEqual(data, expected)
+        self.assertEqual(index.get_epub_metadata(self.copy, compact=True), get_epub_metadata(self.copy, compact=True))
+        # Another options key
+        self.assertEqual(index.get_epub_metadata(self.copy, read_toc=False),
+                         get_epub_metadata(self.copy, read_toc=False))
+        self.assertRaises(ValueError, index.get_epub_metadata, self.copy, lazy=True)
+
+        self.assertEqual(index.duplicates(), [sorted([self.original, self.copy, self.repackaged])])
+        self.assertEqual(index.cover_duplicates(), [sorted([self.original, self.copy, self.repackaged])])
+        index.invalidate(self.copy)
+        self.assertIsNone(index.fingerprint(self.copy))
+        self.assertEqual(index.fingerprint(self.original), book_fingerprint(self.original))
+        index.close()
+
+    def test_opf_parsed_once(self):
+        # For the fields and the cover fingerprint of a miss
+        cases = [{}, {'fields': ['title', 'authors']}, {'normalize': True},
+                 {'fields': ['title'], 'normalize': True, 'read_cover_image': False}]
+        for i, options in enumerate(cases):
+            index = DedupIndex(os.path.join(self.tmp_dir, 'dedup{}.db'.format(i)))
+            events = []
+            with instrument(events.append):
+                data = index.get_epub_metadata(self.original, **options)
+            self.assertEqual([event.phase for event in events].count('opf'), 1, options)
+            self.assertEqual(data, get_epub_metadata(self.original, **options))
+            self.assertEqual(index.cover_duplicates(), [])
+            index.get_epub_metadata(self.copy, **options)
+            self.assertEqual(index.cover_duplicates(), [sorted([self.original, self.copy])])
+            index.close()
+
+    def test_scan(self):
+        index = DedupIndex(os.path.join(self.tmp_dir, 'dedup.db'))
+        results = dict(iter_epub_metadata([self.original, self.copy, self.repackaged, __file__], workers=2,
+                                          cache=index, read_cover_image=False))
+        self.assertEqual(results[self.copy], get_epub_metadata(self.copy, read_cover_image=False))
+        self.assertIsInstance(results[__file__], EPubException)
+        self.assertEqual(len(index.duplicates()[0]), 3)
+        index.close()
+
+
+class EpubBookTests(unittest.TestCase):
+    def test_single_open(self):
+        filepath = os.path.join(dir_path, 'moby-dick.epub')
+        expected = [get_epub_metadata(filepath), get_epub_opf_xml(filepath), get_epub_toc(filepath),
+                    get_epub_toc(filepath, max_depth=0), get_epub_cover_image(filepath),
+                    get_epub_cover_image_info(filepath), {'title': 'Moby-Dick'}, b'application/epub+zip']
+        events = []
+        with instrument(events.append):
+            with EpubBook(filepath) as book:
+                self.assertEqual([book.metadata, book.opf_xml, book.toc, book.get_toc(max_depth=0), book.cover(),
+                                  book.cover_info(), book.get_metadata(fields=['title']), book.read('mimetype')],
+                                 expected)
+                self.assertIn('mimetype', book.namelist())
+        phases = [event.phase for event in events]
+        self.assertEqual(phases.count('open'), 1)
+        self.assertEqual(phases.count('container'), 1)
+        self.assertEqual(phases.count('opf'), 1)
+
+    def test_errors(self):
+        self.assertRaises(EPubException, EpubBook, __file__)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            filepath = os.path.join(tmp_dir, 'book.epub')
+            with zipfile.ZipFile(filepath, 'w') as zf:
+                zf.writestr('mimetype', b'application/epub+zip')
+            with EpubBook(filepath) as book:
+                # container.xml is only read when needed
+                self.assertEqual(book.get_metadata(fields={'file_size_in_bytes'}),
+                                 {'file_size_in_bytes': os.path.getsize(filepath)})
+                self.assertRaises(KeyError, getattr, book, 'opf_xml')
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'), 'needs /proc')
+    def test_no_leaked_files(self):
+        filepath = os.path.join(dir_path, 'moby-dick.epub')
+        before = len(os.listdir('/proc/self/fd'))
+        for _ in range(20):
+            get_epub_opf_xml(filepath)
+            get_epub_metadata(filepath, read_toc=False)
+            self.assertRaises(EPubException, get_epub_metadata, __file__)
+        self.assertEqual(len(os.listdir('/proc/self/fd')), before)
+        # Interrupted while opening
+        for target in ('TailBufferedFile', 'OwningZipFile', '_check_mimetype'):
+            with mock.patch.object(archive, target, side_effect=KeyboardInterrupt):
+                self.assertRaises(KeyboardInterrupt, get_epub_metadata, filepath)
+        self.assertEqual(len(os.listdir('/proc/self/fd')), before)
+        zf, size = archive.open_epub_zip(filepath)
+        with zf, zf.open('mimetype') as stream:
+            self.assertEqual(stream.read(), archive.MIMETYPE)
+        self.assertTrue(zf.owned_file.closed)
+
+
+class TextTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def build(self, chapter2):
+        nav = ('<html><body><nav epub:type="toc"><ol><li><a href="text/c1.xhtml">One</a></li>'
+               '<li><a href="text/c2.xhtml#s2">Two, section 2</a></li></ol></nav></body></html>')
+        chapter1 = ('<?xml version="1.0" encoding="iso-8859-1"?><html><head><title>Skipped</title>'
+                    '<style>p { color: red }</style></head><body><h1>Chapter   one</h1>'
+                    '<p>Caf\xe9 &amp; <em>cr\xe8me</em>\n br\xfbl\xe9e</p><script>var x;</script></body></html>')
+        return build_epub(os.path.join(self.tmp_dir, 'book.epub'),
+                          manifest='<item id="nav" href="nav.xhtml" properties="nav" '
+                                   'media-type="application/xhtml+xml"/>'
+                                   '<item id="c1" href="text/c1.xhtml" media-type="application/xhtml+xml"/>'
+                                   '<item id="c2" href="text/c2.xhtml" media-type="application/xhtml+xml"/>'
+                                   '<item id="img" href="cover.jpg" media-type="image/jpeg"/>',
+                          spine='<itemref idref="img"/><itemref idref="c1"/><itemref idref="c2"/>',
+                          members={'OEBPS/nav.xhtml': nav, 'OEBPS/text/c1.xhtml': chapter1.encode('iso-8859-1'),
+                                   'OEBPS/text/c2.xhtml': chapter2})
+
+    def test_spine_text(self):
+        filepath = self.build('<html><body><p>Section 1</p><h2 id="s2">Section 2</h2><p>Text</p></body></html>')
+        self.assertEqual(list(iter_epub_text(filepath)), [
+            TextChunk('text/c1.xhtml', 'OEBPS/text/c1.xhtml', 'Chapter one\nCaf\xe9 & cr\xe8me br\xfbl\xe9e'),
+            TextChunk('text/c2.xhtml', 'OEBPS/text/c2.xhtml', 'Section 1'),
+            TextChunk('text/c2.xhtml#s2', 'OEBPS/text/c2.xhtml', 'Section 2\nText'),
+        ])
+        srcs = set(entry['src'] for entry in get_epub_toc(filepath))
+        self.assertTrue(srcs.issubset(chunk.src for chunk in iter_epub_text(filepath)))
+
+        filepath = os.path.join(dir_path, 'georgia-cfi-20120521.epub')
+        with EpubBook(filepath) as book:
+            chunks = list(book.iter_text(text_chunk_size=100))
+            self.assertEqual(set(chunk.src for chunk in chunks), set(entry['src'] for entry in book.toc))
+        self.assertTrue(all(len(chunk.text) <= 100 for chunk in chunks))
+        # A long block is split too
+        filepath = self.build('<html><body><p>{}</p></body></html>'.format('word ' * 10000))
+        sizes = [len(chunk.text) for chunk in iter_epub_text(filepath)][1:]
+        self.assertEqual(len(sizes), 13)
+        self.assertTrue(all(size <= 4096 for size in sizes))
+        filepath = self.build('<html><body>{}</body></html>'.format('<p>{}</p>'.format('word ' * 300) * 20))
+        texts = [chunk.text for chunk in iter_epub_text(filepath)][1:]
+        self.assertEqual('\n'.join(texts), '\n'.join([('word ' * 300).strip()] * 20))
+        self.assertTrue(all(4096 - 1500 < len(text) <= 4096 for text in texts[:-1]))
+
+    def test_phases(self):
+        paragraph = '<p>{}</p>'.format('word ' * 200)
+        filepath = self.build('<html><body>{}</body></html>'.format(paragraph * 200))
+        with zipfile.ZipFile(filepath) as zf:
+            sizes = [zf.getinfo(path).file_size for path in ('OEBPS/text/c1.xhtml', 'OEBPS/text/c2.xhtml')]
+        stats = PhaseStats()
+        with instrument(stats):
+            chunks = iter_epub_text(filepath)
+            next(chunks)
+            next(chunks)
+            time.sleep(0.2)
+            chunks.close()
+        text = stats.as_dict()['text']
+        # Stopped in the first block of c2, the consumer time isn't measured
+        self.assertEqual(text['bytes'], sizes[0] + CHUNK_SIZE)
+        self.assertLess(text['seconds'], 0.2)
+        with instrument(stats):
+            list(iter_epub_text(filepath))
+        self.assertEqual(stats.as_dict()['text']['bytes'] - text['bytes'], sum(sizes))
+
+    def test_streaming(self):
+        import tracemalloc
+        paragraph = '<p>{}</p>'.format('word ' * 200)
+        filepath = self.build('<html><body>{}</body></html>'.format(paragraph * 2000))
+        self.assertGreater(zipfile.ZipFile(filepath).getinfo('OEBPS/text/c2.xhtml').file_size, 2 * 1000 ** 2)
+        tracemalloc.start()
+        count = 0
+        for chunk in iter_epub_text(filepath):
+            count += len(chunk.text)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.assertGreater(count, 1.9 * 1000 ** 2)
+        self.assertLess(peak, 512 * 1024)
+        self.assertRaises(EPubLimitError, list, iter_epub_text(filepath, limits=Limits(max_nodes=1000)))
+
+
+def _copyright_publisher(tags):
+    for tag in tags:
+        if tag.text and tag.text.startswith('Published by '):
+            return tag.text[len('Published by '):]
+
+
+class StrategyTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_custom_rules(self):
+        registry = default_strategies.copy()
+        registry.register('publisher', 'OEBPS/missing.html', ('p',), _copyright_publisher)
+        registry.register('publisher', 'OEBPS/pr02.html', ('h1',), lambda tags: None, name='never')
+        registry.register('publisher', 'OEBPS/pr02.html', ('p',), _copyright_publisher)
+        for i in range(1000):
+            registry.register('title', 'OEBPS/title{}.html'.format(i), ('h1',), lambda tags: 'Unused')
+        filepath = build_epub(os.path.join(self.tmp_dir, 'book.epub'), metadata='<dc:title>Title</dc:title>',
+                              members={'OEBPS/pr02.html': '<html><strong>Author</strong><p>Someone</p>'
+                                                          '<span/><p>Published by Someone Else</p></html>'})
+        events = []
+        with instrument(events.append):
+            data = get_epub_metadata(filepath, strategies=registry)
+        self.assertEqual((data.title, data.authors, data.publisher), ('Title', ['Someone'], 'Someone Else'))
+        # pr02.html is parsed once for the authors and publisher rules, the
+        # title rules don't run
+        members = [event.member for event in events if event.phase == 'html_fallback']
+        self.assertEqual(members.count('OEBPS/pr02.html'), 1)
+        self.assertEqual(len(members), 3)  # + pr01.html and missing.html
+        # The default registry is unchanged
+        self.assertIsNone(get_epub_metadata(filepath).publisher)
+        self.assertNotEqual(repr(registry), repr(default_strategies))
+        self.assertEqual(repr(registry.copy()), repr(registry))
+
+    def test_empty_publication_date(self):
+        # The OPF value is kept when no rule finds a date
+        filepath = build_epub(os.path.join(self.tmp_dir, 'book.epub'), metadata='<dc:date> </dc:date>')
+        self.assertEqual(get_epub_metadata(filepath).publication_date, '')
+
+    def test_cover_ids(self):
+        registry = StrategyRegistry()
+        registry.add_cover_id('jacket')
+        filepath = build_epub(os.path.join(self.tmp_dir, 'book.epub'),
+                              manifest='<item id="jacket" href="jacket.png" media-type="image/png"/>',
+                              members={'OEBPS/jacket.png': b'png'})
+        self.assertIsNone(get_epub_metadata(filepath).cover_image_content)
+        data = get_epub_metadata(filepath, strategies=registry, cover_image_encoding=None)
+        self.assertEqual((data.cover_image_content, data.cover_image_extension), (b'png', '.png'))
+        with EpubBook(filepath, strategies=registry) as book:
+            self.assertEqual(book.cover_path(), ('OEBPS/jacket.png', '.png'))
+        self.assertEqual(asyncio.run(aio.async_get_epub_metadata(filepath, strategies=registry,
+                                                                 fields=['cover_image_extension'])),
+                         {'cover_image_extension': '.png'})
+
+
+class ManifestIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_lookups(self):
+        opf = parse_opf(OPF.format(metadata='', spine='', manifest='''
+            <item id="nav" href="nav%20doc.xhtml" media-type="application/xhtml+xml" properties="nav scripted"/>
+            <item id="c1" href="c1.xhtml" media-type="application/xhtml+xml"/>
+            <item id="c1" href="duplicate.xhtml"/>'''))
+        index = opf.manifest_index
+        self.assertIs(opf.manifest_index, index)
+        self.assertEqual(index.by_id('c1').attributes['href'], 'c1.xhtml')
+        self.assertEqual(index.by_href('nav%20doc.xhtml').attributes['id'], 'nav')
+        self.assertEqual([item.attributes['id'] for item in index.with_property('scripted')], ['nav'])
+        self.assertEqual(len(index.with_media_type('application/xhtml+xml')), 2)
+        self.assertIsNone(index.by_id('missing'))
+        self.assertEqual(index.with_property('cover-image'), [])
+
+    def test_epub3_cover_and_ncx_media_type(self):
+        filepath = build_epub(os.path.join(self.tmp_dir, 'book.epub'), manifest='''
+            <item id="img" href="front.jpg" media-type="image/jpeg" properties="cover-image"/>
+            <item id="toc" href="toc.ncx" media-type="application/x-dtbncx+xml"/>''',
+                              members={'OEBPS/front.jpg': b'jpeg', 'OEBPS/toc.ncx': '<ncx><navMap><navPoint>'
+                                       '<navLabel><text>A</text></navLabel><content src="a.xhtml"/>'
+                                       '</navPoint></navMap></ncx>'})
+        data = get_epub_metadata(filepath, cover_image_encoding=None)
+        self.assertEqual((data.cover_image_content, data.cover_image_extension), (b'jpeg', '.jpg'))
+        self.assertEqual([entry['title'] for entry in data.toc], ['A'])
+
+    def test_renditions(self):
+        filepath = os.path.join(self.tmp_dir, 'book.epub')
+        with zipfile.ZipFile(filepath, 'w') as zf:
+            zf.writestr('mimetype', b'application/epub+zip')
+            zf.writestr('META-INF/container.xml', CONTAINER.replace(
+                b'</rootfiles>', b'<rootfile full-path="fixed/content.opf"/></rootfiles>'))
+            zf.writestr('OEBPS/content.opf', OPF.format(metadata='<dc:title>Reflowable</dc:title>',
+                                                         manifest='', spine=''))
+            zf.writestr('fixed/content.opf', OPF.format(metadata='<dc:title>Fixed</dc:title>',
+                                                         manifest='', spine=''))
+        with EpubBook(filepath) as book:
+            self.assertEqual(book.renditions, ['OEBPS/content.opf', 'fixed/content.opf'])
+            self.assertEqual(book.metadata.title, 'Reflowable')
+        for rendition in (1, 'fixed/content.opf'):
+            with EpubBook(filepath, rendition=rendition) as book:
+                self.assertEqual(book.opf_filepath, 'fixed/content.opf')
+                self.assertEqual(book.metadata.title, 'Fixed')
+        with EpubBook(filepath, rendition=2) as book:
+            self.assertRaises(EPubException, getattr, book, 'opf_xml')
+
+
+class WatcherTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.drop_dir = os.path.join(self.tmp_dir, 'drop')
+        os.mkdir(self.drop_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def epub_bytes(self, title):
+        filepath = build_epub(os.path.join(self.tmp_dir, 'build.epub'),
+                              metadata='<dc:title>{}</dc:title>'.format(title))
+        with open(filepath, 'rb') as f:
+            return f.read()
+
+    def watch(self, inotify):
+        # The events are collected by another thread, so that the test can
+        # write files between them
+        from queue import Queue
+        existing = os.path.join(self.drop_dir, 'existing.epub')
+        with open(existing, 'wb') as f:
+            f.write(self.epub_bytes('Existing'))
+        # The corrupt file never gets a central directory
+        watcher = DirectoryWatcher(self.drop_dir, executor='thread', workers=2, settle=0.2, poll_interval=0.05,
+                                   incomplete_timeout=1, inotify=inotify, read_cover_image=False, read_toc=False)
+        events = Queue()
+        thread = threading.Thread(target=lambda: [events.put(event) for event in watcher])
+        thread.start()
+        try:
+            event = events.get(timeout=10)
+            self.assertEqual((event.kind, event.path, event.metadata.title), ('added', existing, 'Existing'))
+
+            # Written in two steps: only extracted once complete
+            content = self.epub_bytes('New')
+            path = os.path.join(self.drop_dir, 'sub', 'new.epub')
+            os.mkdir(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(content[:len(content) // 2])
+                f.flush()
+                time.sleep(0.6)
+                f.write(content[len(content) // 2:])
+            event = events.get(timeout=10)
+            self.assertEqual((event.kind, event.path, event.metadata.title), ('added', path, 'New'))
+            self.assertGreaterEqual(event.latency, 0.6)
+
+            with open(path, 'wb') as f:
+                f.write(self.epub_bytes('Modified'))
+            event = events.get(timeout=10)
+            self.assertEqual((event.kind, event.path, event.metadata.title), ('modified', path, 'Modified'))
+
+            with open(os.path.join(self.drop_dir, 'corrupt.epub'), 'wb') as f:
+                f.write(b'not a zip file')
+            os.remove(existing)
+            received = sorted([events.get(timeout=10), events.get(timeout=10)], key=lambda event: event.kind)
+            self.assertEqual([event.kind for event in received], ['added', 'deleted'])
+            self.assertIsInstance(received[0].metadata, EPubException)
+            self.assertIsNone(received[1].metadata)
+            self.assertTrue(events.empty())
+        finally:
+            watcher.close()
+            thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(watcher.stats['events'], 5)
+        self.assertEqual(watcher.stats['errors'], 1)
+        self.assertGreaterEqual(watcher.stats['max_queue_depth'], 1)
+
+    def test_polling(self):
+        self.watch(False)
+
+    def test_inotify(self):
+        try:
+            watcher._InotifySource(self.drop_dir, ('.epub',)).close()
+        except OSError:
+            self.skipTest('inotify is not available')
+        self.watch(True)
+
+    def watch_timeout(self, executor):
+        stuck = os.path.join(self.drop_dir, 'stuck.epub')
+        shutil.copy(os.path.join(dir_path, 'moby-dick.epub'), stuck)
+        shutil.copy(os.path.join(dir_path, 'moby-dick.epub'), os.path.join(self.drop_dir, 'book.epub'))
+
+        def stuck_metadata(path, **kwargs):
+            if path == stuck:
+                time.sleep(30)
+            return get_epub_metadata(path, **kwargs)
+
+        watcher = DirectoryWatcher(self.drop_dir, executor=executor, workers=2, timeout=0.2, settle=0.05,
+                                   inotify=False, read_cover_image=False, read_toc=False)
+        events = {}
+        started = time.time()
+        with mock.patch.object(scanner, 'get_epub_metadata', stuck_metadata):
+            for event in watcher:
+                self.assertIsInstance(event, WatchEvent)
+                events[event.path] = event
+                if len(events) == 2:
+                    watcher.close()
+        self.assertLess(time.time() - started, 10)
+        self.assertIsInstance(events[stuck].metadata, EPubTimeoutError)
+        self.assertEqual(events[os.path.join(self.drop_dir, 'book.epub')].metadata.title, 'Moby-Dick')
+
+    def test_thread_timeout(self):
+        self.watch_timeout('thread')
+
+    @unittest.skipIf(multiprocessing.get_start_method() != 'fork', 'The workers must inherit the mock')
+    def test_process_timeout(self):
+        # The alarm is disabled: the stuck worker is killed with the pool
+        with mock.patch.object(scanner.signal, 'setitimer', lambda *args: None):
+            self.watch_timeout('process')
+
+    def test_central_directory_complete(self):
+        content = self.epub_bytes('Title')
+        filepath = os.path.join(self.tmp_dir, 'partial.epub')
+        for size, complete in ((len(content) // 2, False), (len(content) - 1, False), (len(content), True)):
+            with open(filepath, 'wb') as f:
+                f.write(content[:size])
+            self.assertEqual(archive.central_directory_complete(filepath), complete)
+
+    def test_watch_directory_and_instrumentation(self):
+        with open(os.path.join(self.drop_dir, 'book.epub'), 'wb') as f:
+            f.write(self.epub_bytes('Title'))
+        stats = PhaseStats()
+        with instrument(stats):
+            events = watch_directory(self.drop_dir, executor='thread', settle=0.05)
+            event = next(events)
+            events.close()
+        self.assertEqual(event.metadata.title, 'Title')
+        self.assertEqual(stats.as_dict()['watch']['count'], 1)
+
+
+class NormalizeTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_normalize_text(self):
+        self.assertEqual(normalize_text(' Café \n  au\tlait '), 'Café au lait')
+        self.assertEqual(normalize_text('Tom &amp;amp; Jerry &eacute;'), 'Tom &amp; Jerry é')
+        self.assertEqual(normalize_text('AT&T'), 'AT&T')
+        self.assertIsNone(normalize_text(' \n '))
+
+    def test_text_content(self):
+        content = OPF.format(metadata='<dc:title>\n  Moby <i>Dick</i>,\n or\tthe Whale </dc:title>',
+                             manifest='', spine='')
+        self.assertEqual(parse_opf(content).get_elements('dc:title')[0].text, '\n  Moby ')
+        self.assertEqual(parse_opf(content, normalize=True).get_elements('dc:title')[0].text,
+                         'Moby Dick, or the Whale')
+
+    def test_creators(self):
+        filepath = build_epub(os.path.join(self.tmp_dir, 'book.epub'), metadata='''
+            <dc:creator opf:role="aut" opf:file-as="Melville, Herman">Herman   Melville</dc:creator>
+            <dc:creator id="ill">Rockwell Kent</dc:creator>
+            <meta refines="#ill" property="role" scheme="marc:relators">ill</meta>
+            <meta refines="#ill" property="file-as">Kent, Rockwell</meta>
+            <dc:creator opf:role="aut">Herman Melville</dc:creator>
+            <dc:subject>Whales</dc:subject>
+            <dc:subject> Whales </dc:subject>''')
+        data = get_epub_metadata(filepath, normalize=True)
+        self.assertEqual(data.creators, [
+            {'name': 'Herman Melville', 'role': 'aut', 'file_as': 'Melville, Herman'},
+            {'name': 'Rockwell Kent', 'role': 'ill', 'file_as': 'Kent, Rockwell'},
+        ])
+        self.assertEqual(data.authors, ['Herman Melville'])
+        self.assertEqual(data.subject, ['Whales'])
+        self.assertEqual(get_epub_metadata(filepath, normalize=True, fields=['authors']).authors,
+                         ['Herman Melville'])
+
+        # Unchanged without normalize
+        data = get_epub_metadata(filepath)
+        self.assertNotIn('creators', data)
+        self.assertEqual(data.authors, ['Herman   Melville', 'Rockwell Kent', 'Herman Melville'])
+        self.assertEqual(data.subject, ['Whales', 'Whales'])
+
+    def test_authors_without_author_role(self):
+        filepath = build_epub(os.path.join(self.tmp_dir, 'book.epub'), metadata='''
+            <dc:creator opf:role="edt">An Editor</dc:creator>
+            <dc:creator opf:role="trl">A Translator</dc:creator>''')
+        self.assertEqual(get_epub_metadata(filepath, normalize=True).authors, ['An Editor', 'A Translator'])
+
+
+class SharedMemoryTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        nav = ''.join('<li><a href="c{0}.xhtml">Chapter {0}</a></li>'.format(i) for i in range(2000))
+        self.filepath = build_epub(
+            os.path.join(self.tmp_dir, 'book.epub'), metadata='<meta name="cover" content="img"/>',
+            manifest='''<item id="img" href="cover.jpg" media-type="image/jpeg"/>
+                <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>''',
+            members={'OEBPS/cover.jpg': os.urandom(64 * 1024),
+                     'OEBPS/nav.xhtml': '<html><body><nav epub:type="toc"><ol>{}</ol></nav></body></html>'.format(
+                         nav)})
+        self.paths = [self.filepath, os.path.join(self.tmp_dir, 'corrupt.epub')]
+        with open(self.paths[1], 'wb') as f:
+            f.write(b'not a zip file')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_views(self):
+        expected = get_epub_metadata(self.filepath, cover_image_encoding=None)
+        results = dict(iter_epub_metadata(self.paths, workers=2, shared_memory=True, cover_image_encoding=None))
+        self.assertIsInstance(results[self.paths[1]], EPubException)
+        data = results[self.filepath]
+        self.assertIsInstance(data, SharedMetadata)
+        self.assertIsInstance(data.cover_image_content, memoryview)
+        self.assertIsInstance(data.toc, TocColumns)
+        self.assertEqual(data.toc[1999], expected.toc[1999])
+        self.assertEqual(data.copy(), expected)
+        self.assertEqual(pickle.loads(pickle.dumps(data)), expected)
+        cover = data.cover_image_content
+        with data:
+            self.assertEqual(cover[:4], expected.cover_image_content[:4])
+        self.assertRaises(ValueError, lambda: cover[0])
+        data.release()
+
+    def test_export(self):
+        expected = get_epub_metadata(self.filepath, cover_image_encoding=None)
+        columns = export.DEFAULT_COLUMNS + ('cover_image_content',)
+        rows = list(export.metadata_rows([('book.epub', expected)], columns))
+        formats = ['ndjson', 'csv'] + (['arrow'] if export.pyarrow is not None else [])
+        for path, data in iter_epub_metadata([self.filepath], workers=1, shared_memory=True,
+                                             cover_image_encoding=None):
+            with data:
+                self.assertEqual(list(export.metadata_rows([('book.epub', data)], columns)), rows)
+                for format in formats:
+                    stream = io.BytesIO()
+                    self.assertEqual(export.export_metadata([(path, data)], stream, format=format,
+                                                            columns=columns), 1)
+
+    def test_base64_cover(self):
+        expected = get_epub_metadata(self.filepath)
+        for path, data in iter_epub_metadata([self.filepath], workers=1, shared_memory=True):
+            with data:
+                self.assertEqual(bytes(data.cover_image_content), expected.cover_image_content)
+                self.assertEqual(data.copy(), expected)
+
+    def test_small_values_are_pickled(self):
+        result = transport.share_result(odict([('title', 'Title'), ('cover_image_content', b'jpeg'), ('toc', None)]))
+        self.assertEqual(result, {'title': 'Title', 'cover_image_content': b'jpeg', 'toc': None})
+        data = SharedMetadata.attach(result)
+        self.assertEqual(data.cover_image_content, b'jpeg')
+        data.release()
+
+    def test_toc_entries_without_source(self):
+        toc = [{'title': 'Chapter {}'.format(i), 'src': None if i % 3 else 'c{}.xhtml'.format(i), 'level': 1,
+                'index': i} for i in range(3000)]
+        toc[1]['title'] = None
+        toc[2]['title'] = ''
+        toc[3]['src'] = ''
+        result = transport.share_result(odict([('title', 'Title'), ('toc', toc)]))
+        self.assertIsInstance(result, transport.SharedResult)
+        with SharedMetadata.attach(result) as data:
+            self.assertEqual((data.toc[1]['title'], data.toc[1]['src'], data.toc[2]['title'], data.toc[3]['src']),
+                             (None, None, '', ''))
+            self.assertEqual(list(data.toc), toc)
+            self.assertEqual(data.copy()['toc'], toc)
+
+    def test_stopped_iteration(self):
+        results = iter_epub_metadata([self.filepath] * 6, workers=2, chunksize=3, shared_memory=True)
+        path, data = next(results)
+        data.release()
+        with mock.patch.object(transport, 'discard_result', wraps=transport.discard_result) as discard:
+            results.close()
+            deadline = time.time() + 10
+            while discard.call_count < 5 and time.time() < deadline:
+                time.sleep(0.05)
+        self.assertEqual(discard.call_count, 5)
+
+    def test_thread_executor(self):
+        self.assertRaises(ValueError, iter_epub_metadata, self.paths, executor='thread', shared_memory=True)
+
+
+class CoverImageTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_raw_bytes_and_base64(self):
+        filepath = os.path.join(dir_path, 'moby-dick.epub')
+        content, extension = get_epub_cover_image(filepath)
+        self.assertEqual(extension, '.jpg')
+        self.assertTrue(content.startswith(b'\xff\xd8'))
+        self.assertEqual(get_epub_cover_image(filepath, encoding='base64')[0], base64.b64encode(content))
+        self.assertEqual(get_epub_metadata(filepath, cover_image_encoding=None).cover_image_content, content)
+        self.assertEqual(get_epub_cover_image(os.path.join(dir_path, 'mathjax_tests.epub')), (None, None))
+
+    def test_stream(self):
+        filepath = os.path.join(dir_path, 'georgia-cfi-20120521.epub')
+        stream = open_epub_cover_image(filepath)
+        with stream:
+            self.assertEqual(stream.read(), get_epub_cover_image(filepath)[0])
+            self.assertIsNotNone(stream._book._zf.fp)
+        self.assertTrue(stream.closed)
+        self.assertIsNone(stream._book._zf.fp)
+        self.assertIsNone(open_epub_cover_image(os.path.join(dir_path, 'mathjax_tests.epub')))
+
+    def test_info_of_stored_cover(self):
+        image = b'\x89PNG fake image'
+        filepath = build_epub(os.path.join(self.tmp_dir, 'book.epub'),
+                              metadata='<meta name="cover" content="img"/>',
+                              manifest='<item id="img" href="images/cover.png" media-type="image/png"/>',
+                              members={'OEBPS/images/cover.png': image}, compression=zipfile.ZIP_STORED)
+        info = get_epub_cover_image_info(filepath)
+        self.assertEqual(info.path, 'OEBPS/images/cover.png')
+        self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+        with open(filepath, 'rb') as f:
+            f.seek(info.offset)
+            self.assertEqual(f.read(info.compressed_size), image)
+        self.assertIsNone(get_epub_cover_image_info(os.path.join(dir_path, 'mathjax_tests.epub')))
+
+
+class TocTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def build_nav(self, depth):
+        nav = ''
+        for level in reversed(range(depth)):
+            nav = '<ol><li><a href="c{0}.xhtml">Level {0}</a>{1}</li></ol>'.format(level, nav)
+        nav = '<html xmlns="http://www.w3.org/1999/xhtml"><body><nav>{}</nav></body></html>'.format(nav)
+        return build_epub(os.path.join(self.tmp_dir, 'nav.epub'),
+                          manifest='<item id="nav" properties="nav" href="nav.xhtml" media-type="application/xhtml+xml"/>',
+                          members={'OEBPS/nav.xhtml': nav})
+
+    def build_ncx(self, nav_points):
+        ncx = '<ncx><navMap>{}</navMap></ncx>'.format(nav_points)
+        return build_epub(os.path.join(self.tmp_dir, 'ncx.epub'),
+                          manifest='<item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>',
+                          members={'OEBPS/toc.ncx': ncx})
+
+    def test_same_toc_as_the_metadata(self):
+        for sample in ('moby-dick.epub', 'georgia-cfi-20120521.epub', 'mathjax_tests.epub'):
+            filepath = os.path.join(dir_path, sample)
+            toc = get_epub_metadata(filepath, read_cover_image=False).toc
+            self.assertEqual(get_epub_toc(filepath), toc)
+            self.assertEqual(list(iter_epub_toc(filepath)), toc or [])
+
+    def test_nav_levels_are_not_limited(self):
+        toc = get_epub_toc(self.build_nav(120))
+        self.assertEqual([entry['level'] for entry in toc], list(range(120)))
+        self.assertEqual(toc[-1], {'title': 'Level 119', 'src': 'c119.xhtml', 'level': 119, 'index': 119})
+
+    def test_ncx_label_after_the_children(self):
+        filepath = self.build_ncx('<navPoint><content src="a.xhtml"/><navPoint><navLabel><text>B</text></navLabel>'
+                                  '<content src="b.xhtml"/></navPoint><navLabel><text> A </text></navLabel></navPoint>')
+        self.assertEqual(get_epub_toc(filepath), [
+            {'title': 'A', 'src': 'a.xhtml', 'level': 0, 'index': 0},
+            {'title': 'B', 'src': 'b.xhtml', 'level': 1, 'index': 1},
+        ])
+
+    def test_caps(self):
+        filepath = self.build_nav(10)
+        self.assertEqual([entry['level'] for entry in get_epub_toc(filepath, max_depth=3)], [0, 1, 2, 3])
+        self.assertEqual(len(get_epub_toc(filepath, max_entries=4)), 4)
+        entries = iter_epub_toc(filepath, max_entries=2)
+        self.assertEqual([entry['index'] for entry in entries], [0, 1])
+
+    def test_columnar(self):
+        filepath = self.build_nav(5)
+        columns = get_epub_toc(filepath, columnar=True)
+        self.assertIsInstance(columns, TocColumns)
+        self.assertEqual(columns, get_epub_toc(filepath))
+        self.assertEqual(list(columns.levels), [0, 1, 2, 3, 4])
+        self.assertEqual(columns[-1]['title'], 'Level 4')
+        self.assertIsNone(get_epub_toc(build_epub(os.path.join(self.tmp_dir, 'book.epub')), columnar=True))
+
+
+class ExportTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.paths = [os.path.join(dir_path, 'moby-dick.epub'), os.path.join(dir_path, 'mathjax_tests.epub'), __file__]
+        self.results = list(iter_epub_metadata(self.paths, executor='thread', read_cover_image=False))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_ndjson(self):
+        filepath = os.path.join(self.tmp_dir, 'library.ndjson')
+        self.assertEqual(export.export_metadata(self.results, filepath), 3)
+        with open(filepath) as f:
+            rows = dict((row['path'], row) for row in map(json.loads, f))
+        data = get_epub_metadata(self.paths[0], read_cover_image=False)
+        self.assertEqual(rows[self.paths[0]]['title'], data.title)
+        self.assertEqual(rows[self.paths[0]]['authors'], data.authors)
+        self.assertEqual(rows[self.paths[0]]['toc'], data.toc)
+        self.assertIsNone(rows[self.paths[0]]['error'])
+        self.assertIsNone(rows[__file__]['title'])
+        self.assertTrue(rows[__file__]['error'])
+
+    def test_csv_to_a_file_object(self):
+        output = io.BytesIO()
+        export.export_metadata([get_epub_metadata(self.paths[0], compact=True)], output, format='csv',
+                               columns=('title', 'authors'))
+        self.assertFalse(output.closed)
+        self.assertEqual(output.getvalue().decode('utf-8').splitlines(),
+                         ['title,authors', 'Moby-Dick,"[""Herman Melville""]"'])
+        self.assertRaises(ValueError, export.export_metadata, [], output, format='xls')
+
+    @unittest.skipIf(export.pyarrow is None, 'pyarrow is not installed')
+    def test_parquet_row_groups(self):
+        import pyarrow.parquet
+        filepath = os.path.join(self.tmp_dir, 'library.parquet')
+        export.export_metadata(self.results * 2, filepath, row_group_size=4)
+        parquet_file = pyarrow.parquet.ParquetFile(filepath)
+        self.assertEqual(parquet_file.metadata.num_row_groups, 2)
+        table = parquet_file.read()
+        self.assertEqual(table.num_rows, 6)
+        self.assertEqual(table.schema, export.arrow_schema())
+        row = [row for row in table.to_pylist() if row['path'] == self.paths[0]][0]
+        data = get_epub_metadata(self.paths[0], read_cover_image=False)
+        self.assertEqual(row['authors'], data.authors)
+        self.assertEqual(row['toc'], data.toc)
+
+    @unittest.skipIf(export.pyarrow is None, 'pyarrow is not installed')
+    def test_arrow_cover_image(self):
+        import pyarrow.ipc
+        output = io.BytesIO()
+        data = get_epub_metadata(self.paths[0], cover_image_encoding=None)
+        export.export_metadata([(self.paths[0], data)], output, format='arrow',
+                               columns=('path', 'cover_image_content'))
+        table = pyarrow.ipc.open_file(pyarrow.BufferReader(output.getvalue())).read_all()
+        self.assertEqual(table.column('cover_image_content')[0].as_py(), data.cover_image_content)
+
+
+class CliTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.library = os.path.join(self.tmp_dir, 'library')
+        os.makedirs(os.path.join(self.library, 'sub'))
+        shutil.copy(os.path.join(dir_path, 'moby-dick.epub'), self.library)
+        shutil.copy(os.path.join(dir_path, 'mathjax_tests.epub'), os.path.join(self.library, 'sub'))
+        with open(os.path.join(self.library, 'broken.epub'), 'wb') as f:
+            f.write(b'not a zip file')
+        self.manifest = os.path.join(self.tmp_dir, 'state.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def scan(self, *args):
+        output = os.path.join(self.tmp_dir, 'output.ndjson')
+        stderr = io.StringIO()
+        with mock.patch('sys.stderr', stderr):
+            status = cli.main(['scan', self.library, '--executor', 'thread', '--output', output,
+                               '--since-manifest', self.manifest] + list(args))
+        with open(output) as f:
+            rows = [json.loads(line) for line in f]
+        return status, dict((os.path.basename(row['path']), row) for row in rows), stderr.getvalue()
+
+    def test_incremental_scan(self):
+        status, rows, summary = self.scan()
+        self.assertEqual(status, 1)
+        self.assertEqual(sorted(rows), ['broken.epub', 'mathjax_tests.epub', 'moby-dick.epub'])
+        self.assertEqual(rows['moby-dick.epub']['title'], 'Moby-Dick')
+        self.assertTrue(rows['broken.epub']['error'])
+        self.assertIn('2 extracted, 1 errors, 0 unchanged', summary)
+        self.assertIn('broken.epub', summary)
+
+        status, rows, summary = self.scan()
+        self.assertEqual((status, rows), (0, {}))
+        self.assertIn('0 extracted, 0 errors, 3 unchanged', summary)
+
+        os.utime(os.path.join(self.library, 'moby-dick.epub'), (0, 0))
+        status, rows, summary = self.scan('--retry-errors')
+        self.assertEqual(sorted(rows), ['broken.epub', 'moby-dick.epub'])
+
+    def test_resume_after_interruption(self):
+        results = iter_epub_metadata
+
+        def interrupted(*args, **kwargs):
+            for i, result in enumerate(results(*args, **kwargs)):
+                if i == 2:
+                    raise KeyboardInterrupt()
+                yield result
+
+        with mock.patch.object(cli, 'iter_epub_metadata', interrupted):
+            status, first_rows, summary = self.scan('--jobs', '1')
+        self.assertEqual((status, len(first_rows)), (130, 2))
+        self.assertIn('Interrupted after 2 files', summary)
+        status, rows, summary = self.scan()
+        self.assertEqual(len(rows), 1)
+        self.assertFalse(set(rows) & set(first_rows))
+
+    def test_duplicate_paths(self):
+        # A file given twice, or in a given directory, is extracted once
+        output = os.path.join(self.tmp_dir, 'output.ndjson')
+        moby_dick = os.path.join(self.library, 'moby-dick.epub')
+        with mock.patch('sys.stderr', io.StringIO()) as stderr:
+            status = cli.main(['scan', moby_dick, self.library, moby_dick, '--executor', 'thread', '--output', output])
+        with open(output) as f:
+            paths = [json.loads(line)['path'] for line in f]
+        self.assertEqual(status, 1)
+        self.assertEqual(sorted(paths), sorted(set(paths)))
+        self.assertEqual(len(paths), 3)
+        self.assertIn('2 extracted, 1 errors', stderr.getvalue())
+
+    def test_show(self):
+        stdout = io.StringIO()
+        with mock.patch('sys.stdout', stdout):
+            self.assertEqual(cli.main(['show', '--no-toc', os.path.join(dir_path, 'moby-dick.epub')]), 0)
+        self.assertIn("'title': 'Moby-Dick'", stdout.getvalue())
+
+
+class ArchiveTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_tail_buffered_reads(self):
+        filepath = os.path.join(dir_path, 'moby-dick.epub')
+        with open(filepath, 'rb') as f:
+            content = f.read()
+        fp = archive.TailBufferedFile(open(filepath, 'rb', buffering=0), tail_size=1000)
+        with fp:
+            self.assertEqual(fp.size, len(content))
+            for offset, size in ((0, 30), (30, 10), (100, 20000), (len(content) - 1010, 50), (len(content) - 22, -1)):
+                fp.seek(offset)
+                self.assertEqual(fp.read(size), content[offset:offset + size] if size >= 0 else content[offset:])
+
+    def test_open_epub_zip(self):
+        filepath = os.path.join(dir_path, 'moby-dick.epub')
+        zf, size = archive.open_epub_zip(filepath)
+        with zf:
+            self.assertEqual(size, os.path.getsize(filepath))
+            self.assertIn(b'full-path', zf.read('META-INF/container.xml'))
+        self.assertEqual(get_epub_metadata(filepath).file_size_in_bytes, size)
+
+    def test_mimetype(self):
+        filepath = os.path.join(self.tmp_dir, 'book.epub')
+        with zipfile.ZipFile(filepath, 'w') as zf:
+            zf.writestr('META-INF/container.xml', CONTAINER)
+            zf.writestr('OEBPS/content.opf', OPF.format(metadata='<dc:title>T</dc:title>', manifest='', spine=''))
+        self.assertEqual(get_epub_metadata(filepath).title, 'T')
+        with zipfile.ZipFile(filepath, 'a') as zf:
+            zf.writestr('mimetype', b'application/zip')
+        self.assertRaises(EPubException, get_epub_metadata, filepath)
+        self.assertRaises(EPubException, archive.open_epub_zip, __file__)
+
+    def test_in_memory_inputs(self):
+        filepath = os.path.join(dir_path, 'moby-dick.epub')
+        expected = get_epub_metadata(filepath)
+        with open(filepath, 'rb') as f:
+            content = f.read()
+            for source in (content, bytearray(content), memoryview(content), io.BytesIO(content), f):
+                self.assertEqual(get_epub_metadata(source), expected)
+            # File objects are not closed
+            self.assertFalse(f.closed)
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            data = get_epub_metadata(buffer, read_cover_image=False)
+            # The buffer is released
+            buffer.close()
+        self.assertEqual(data.file_size_in_bytes, len(content))
+        self.assertEqual(get_epub_cover_image(content), get_epub_cover_image(filepath))
+        self.assertRaises(EPubException, get_epub_metadata, content[:1000])
+
+
+class InstrumentationTests(unittest.TestCase):
+    def test_phase_events(self):
+        events = []
+        with instrument(events.append):
+            get_epub_metadata(os.path.join(dir_path, 'moby-dick.epub'))
+        self.assertEqual([event.phase for event in events],
+                         ['open', 'container', 'opf', 'html_fallback', 'cover_image', 'toc', 'total'])
+        events = dict((event.phase, event) for event in events)
+        self.assertEqual(events['opf'].member, 'OPS/package.opf')
+        self.assertGreater(events['opf'].nodes, 100)
+        self.assertEqual(events['cover_image'].bytes, len(get_epub_cover_image(
+            os.path.join(dir_path, 'moby-dick.epub'))[0]))
+        self.assertGreater(events['toc'].nodes, 100)
+        self.assertGreaterEqual(events['total'].seconds, events['toc'].seconds)
+        self.assertTrue(all(event.error is None for event in events.values()))
+
+    def test_disabled(self):
+        self.assertIs(instrumentation.phase('opf'), instrumentation._NULL_PHASE)
+        with instrument(PhaseStats()):
+            self.assertIsNot(instrumentation.phase('opf'), instrumentation._NULL_PHASE)
+        self.assertIs(instrumentation.phase('opf'), instrumentation._NULL_PHASE)
+
+    def test_stats_and_errors(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            filepath = build_epub(os.path.join(tmp_dir, 'book.epub'), metadata='<meta name="cover" content="img"/>',
+                                  manifest='<item id="img" href="missing.png" media-type="image/png"/>')
+            stats = PhaseStats()
+            with instrument(stats):
+                get_epub_metadata(os.path.join(dir_path, 'mathjax_tests.epub'))
+                self.assertRaises(EPubException, get_epub_metadata, filepath)
+        finally:
+            shutil.rmtree(tmp_dir)
+        stats = stats.as_dict()
+        self.assertEqual(stats['open']['count'], 2)
+        self.assertEqual(stats['cover_image']['errors'], 1)
+        self.assertEqual(stats['total']['errors'], 1)
+
+    def test_open_telemetry_listener(self):
+        meter = mock.Mock()
+        listener = instrumentation.OpenTelemetryListener(meter)
+        with instrument(listener):
+            get_epub_metadata(os.path.join(dir_path, 'moby-dick.epub'), read_toc=False)
+        listener.seconds.record.assert_any_call(mock.ANY, {'phase': 'cover_image'})
+        listener.nodes.add.assert_any_call(mock.ANY, {'phase': 'opf'})
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    # Serves the samples with Range requests, counting the bytes sent
+    sent = []
+
+    def do_GET(self):
+        filepath = os.path.join(dir_path, os.path.basename(self.path))
+        if not os.path.exists(filepath):
+            return self.send_error(404)
+        size = os.path.getsize(filepath)
+        start, end = self.headers['Range'].split('=')[1].split('-')
+        if not start:
+            start, end = max(0, size - int(end)), size - 1
+        start, end = int(start), min(int(end), size - 1)
+        with open(filepath, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start + 1)
+        self.sent.append(len(data))
+        self.send_response(206)
+        self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, size))
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class AsyncTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+        cls.url = 'http://127.0.0.1:{}/'.format(cls.server.server_port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        del RangeRequestHandler.sent[:]
+
+    def test_http_ranged_reads(self):
+        data = asyncio.run(aio.async_get_epub_metadata(self.url + 'moby-dick.epub'))
+        self.assertEqual(data, get_epub_metadata(os.path.join(dir_path, 'moby-dick.epub')))
+        # Only the zip tail, container.xml, the OPF file, the cover and the ToC
+        # members are downloaded (the cover is 20% of the file)
+        self.assertLess(sum(RangeRequestHandler.sent), os.path.getsize(os.path.join(dir_path, 'moby-dick.epub')) / 3)
+        self.assertLessEqual(len(RangeRequestHandler.sent), 5)
+
+    def test_file_reader(self):
+        filepath = os.path.join(dir_path, 'georgia-cfi-20120521.epub')
+        data = asyncio.run(aio.async_get_epub_metadata(filepath, cover_image_encoding=None))
+        self.assertEqual(data, get_epub_metadata(filepath, cover_image_encoding=None))
+        self.assertRaises(EPubException, asyncio.run, aio.async_get_epub_metadata(__file__))
+
+    def test_concurrent_scan(self):
+        sources = [self.url + name for name in ('moby-dick.epub', 'mathjax_tests.epub', 'inexistent.epub')]
+        sources.append(aio.AsyncFileReader(os.path.join(dir_path, 'georgia-cfi-20120521.epub')))
+
+        async def scan():
+            return dict([result async for result in aio.async_iter_epub_metadata(sources, concurrency=2,
+                                                                                 read_toc=False)])
+        results = asyncio.run(scan())
+        sources[3].close()
+        self.assertEqual(results[sources[0]].title, 'Moby-Dick')
+        self.assertEqual(results[sources[1]].toc, None)
+        self.assertIsInstance(results[sources[2]], EPubException)
+        self.assertEqual(results[sources[3]].title, 'Georgia')
+
+
+@unittest.skipIf(thumbnails.Image is None, 'Pillow is not installed')
+class ThumbnailTests(unittest.TestCase):
+    def test_fixed_size_thumbnail(self):
+        from PIL import Image
+        for sample in ('moby-dick.epub', 'georgia-cfi-20120521.epub'):
+            thumbnail = thumbnails.make_cover_thumbnail(os.path.join(dir_path, sample), size=(60, 90))
+            image = Image.open(io.BytesIO(thumbnail))
+            self.assertEqual((image.format, image.size), ('JPEG', (60, 90)))
+        thumbnail = thumbnails.make_cover_thumbnail(os.path.join(dir_path, 'moby-dick.epub'), size=(32, 32),
+                                                    format='PNG', crop=True)
+        self.assertEqual(Image.open(io.BytesIO(thumbnail)).size, (32, 32))
+        self.assertIsNone(thumbnails.make_cover_thumbnail(os.path.join(dir_path, 'mathjax_tests.epub')))
+
+    def test_jpeg_draft_mode(self):
+        from PIL import JpegImagePlugin
+        draft = JpegImagePlugin.JpegImageFile.draft
+        with mock.patch.object(JpegImagePlugin.JpegImageFile, 'draft', autospec=True, side_effect=draft) as spy:
+            thumbnails.make_cover_thumbnail(os.path.join(dir_path, 'moby-dick.epub'), size=(60, 90))
+            self.assertEqual(spy.call_args_list[0][0][1:], ('RGB', (60, 90)))
+
+    def test_batch(self):
+        paths = [os.path.join(dir_path, 'moby-dick.epub'), os.path.join(dir_path, 'mathjax_tests.epub'), __file__]
+        results = dict(thumbnails.iter_cover_thumbnails(paths, workers=2, size=(10, 10)))
+        self.assertIsInstance(results[paths[0]], bytes)
+        self.assertIsNone(results[paths[1]])
+        self.assertIsInstance(results[paths[2]], EPubException)
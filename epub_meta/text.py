@@ -0,0 +1,214 @@
+'''
+Full-text extraction for search indexing: the spine documents (XHTML) are
+streamed in reading order and their text is yielded in chunks, each with the
+src of the ToC entry it belongs to:
+
+    with EpubBook('/path/to/book.epub') as book:
+        for chunk in book.iter_text():
+            index.add(chunk.src, chunk.text)
+
+Each member is decompressed and parsed incrementally (html.parser, so
+invalid XHTML is read too): at most one chunk of text and one block of the
+compressed member are in memory, never a whole chapter.
+'''
+import codecs
+from collections import deque, namedtuple
+import re
+
+from html.parser import HTMLParser
+
+from epub_meta.discovery import discover_toc_paths, member_path, unquote
+from epub_meta.instrumentation import phase
+from epub_meta.limits import budget
+
+
+CHUNK_SIZE = 64 * 1024
+
+# Text chunks have at most that many characters: a chunk ends before the
+# block that would make it longer (a longer block is split, at a space if
+# possible), and when the ToC entry changes
+TEXT_CHUNK_SIZE = 4096
+
+HTML_MEDIA_TYPES = ('application/xhtml+xml', 'text/html')
+
+# src: the ToC entry src (e.g. chapter1.xhtml#section2) of the text, or the
+# manifest href of the document when the ToC doesn't point at it
+# path: the member path of the document in the zip file
+TextChunk = namedtuple('TextChunk', 'src path text')
+
+_SKIPPED = frozenset(['head', 'script', 'style', 'template'])
+
+_BLOCKS = frozenset(['address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt', 'figcaption',
+                     'figure', 'footer', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 'nav', 'ol',
+                     'p', 'pre', 'section', 'table', 'td', 'th', 'tr', 'ul', 'body'])
+
+_ENCODING = re.compile(br'''^\s*<\?xml[^>]*encoding=["']([A-Za-z0-9._-]+)["']''')
+
+_SPACES = re.compile(r'\s+')
+
+_LAST_SPACE = re.compile(r'\s(?=\S*$)')
+
+
+class _TextParser(HTMLParser):
+    # Collects the text of the blocks, switching the src when an element
+    # with a ToC anchor starts. The chunks are appended to self.chunks.
+
+    def __init__(self, src, path, anchors, text_chunk_size):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.src = src
+        self.path = path
+        self.anchors = anchors  # id (or <a name>) -> ToC src
+        self.text_chunk_size = text_chunk_size
+        self.chunks = deque()
+        self.node_count = 0
+        self._skipped = 0
+        self._block = []  # text of the current block
+        self._block_size = 0
+        self._text = []  # blocks of the current chunk
+        self._size = 0
+
+    def handle_starttag(self, tag, attrs):
+        self.node_count += 1
+        if tag in _SKIPPED:
+            self._skipped += 1
+            return
+        if tag in _BLOCKS:
+            self._end_block()
+        if self.anchors:
+            for name, value in attrs:
+                if name in ('id', 'name') and value in self.anchors:
+                    self._end_block()
+                    self._flush()
+                    self.src = self.anchors[value]
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in _SKIPPED:
+            self._skipped = max(self._skipped - 1, 0)
+        elif tag in _BLOCKS:
+            self._end_block()
+
+    def handle_data(self, data):
+        if self._skipped:
+            return
+        self._block.append(data)
+        self._block_size += len(data)
+        if self._block_size >= self.text_chunk_size:
+            # A long block is split (at a space if possible)
+            text = ''.join(self._block)
+            while len(text) >= self.text_chunk_size:
+                match = _LAST_SPACE.search(text, 0, self.text_chunk_size)
+                cut = match.start() if match is not None and match.start() > 0 else self.text_chunk_size
+                self._add_text(text[:cut])
+                self._flush()
+                text = text[cut:]
+            self._block = [text]
+            self._block_size = len(text)
+
+    def _end_block(self):
+        text = ''.join(self._block)
+        del self._block[:]
+        self._block_size = 0
+        self._add_text(text)
+
+    def _add_text(self, text):
+        text = _SPACES.sub(' ', text).strip()
+        if text:
+            if self._size + len(text) > self.text_chunk_size:
+                self._flush()
+            self._text.append(text)
+            self._size += len(text) + 1
+            if self._size >= self.text_chunk_size:
+                self._flush()
+
+    def _flush(self):
+        if self._text:
+            self.chunks.append(TextChunk(self.src, self.path, '\n'.join(self._text)))
+        self._text = []
+        self._size = 0
+
+    def close(self):
+        HTMLParser.close(self)
+        self._end_block()
+        self._flush()
+
+
+def _decoder(head):
+    encoding = 'utf-8'
+    match = _ENCODING.match(head)
+    if match is not None:
+        try:
+            encoding = codecs.lookup(match.group(1).decode('ascii')).name
+        except LookupError:
+            pass
+    return codecs.getincrementaldecoder(encoding)(errors='replace')
+
+
+def _toc_anchors(zf, toc, bases):
+    # member path -> {fragment or None: ToC src}. The ToC srcs are relative
+    # to the nav or NCX document.
+    names = set(zf.namelist())
+    anchors = {}
+    for entry in toc or ():
+        href, _, fragment = (entry['src'] or '').partition('#')
+        for base in bases:
+            path = member_path(base, unquote(href))
+            if path in names:
+                anchors.setdefault(path, {}).setdefault(fragment or None, entry['src'])
+                break
+    return anchors
+
+
+def spine_documents(opf, opf_filepath):
+    '''
+    Yields the (manifest href, member path) of the spine XHTML documents, in
+    reading order.
+    '''
+    manifest = opf.manifest_index
+    for idref in opf.spine:
+        item = manifest.by_id(idref)
+        if item is None or 'href' not in item.attributes:
+            continue
+        attributes = item.attributes
+        if attributes.get('media-type', HTML_MEDIA_TYPES[0]) not in HTML_MEDIA_TYPES:
+            continue
+        yield attributes['href'], member_path(opf_filepath, unquote(attributes['href']))
+
+
+def iter_text(zf, opf, opf_filepath, toc, text_chunk_size=TEXT_CHUNK_SIZE):
+    '''
+    Generator of the TextChunk of the spine documents.
+    toc: the ToC entries (list of dicts, see discover_toc), their srcs are
+    relative to the nav or NCX document
+    '''
+    anchors = _toc_anchors(zf, toc, [path for path in discover_toc_paths(opf, opf_filepath) if path])
+    limits = budget(zf)
+    for href, path in spine_documents(opf, opf_filepath):
+        document_anchors = anchors.get(path, {})
+        parser = _TextParser(document_anchors.get(None, href), path, document_anchors, text_chunk_size)
+        try:
+            stream = zf.open(path)
+        except KeyError:
+            continue
+        with stream:
+            decoder = None
+            chunk = True
+            while chunk:
+                # A phase per block: the time of the consumer of the chunks
+                # isn't measured
+                with phase('text', zf.filename) as p:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if decoder is None:
+                        decoder = _decoder(chunk)
+                    node_count = parser.node_count
+                    parser.feed(decoder.decode(chunk, not chunk))
+                    if not chunk:
+                        parser.close()
+                    if limits is not None:
+                        limits.add_nodes(parser.node_count - node_count)
+                    p.member, p.bytes, p.nodes = path, len(chunk), parser.node_count - node_count
+                while parser.chunks:
+                    yield parser.chunks.popleft()
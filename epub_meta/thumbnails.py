@@ -0,0 +1,73 @@
+'''
+Cover thumbnails. Requires Pillow (pip install Pillow).
+'''
+import io
+
+from epub_meta.collector import open_epub_cover_image
+from epub_meta.exceptions import EPubException
+from epub_meta.scanner import _iter_results
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+
+def make_cover_thumbnail(filepath, size=(200, 300), format='JPEG', crop=False, background=(255, 255, 255),
+                         **save_options):
+    '''
+    Returns the cover image of the ePub file as a thumbnail of exactly `size`
+    pixels (bytes in the given format), or None if there is no cover.
+    The image is streamed from the ePub file and, for JPEG covers, decoded
+    directly at a reduced scale (draft mode), so the full-size image is never
+    in memory.
+    The aspect ratio is kept: the image is centered on a `background` canvas,
+    or cropped to fill it with crop=True.
+    save_options: Pillow options, e.g. quality=85
+    '''
+    if Image is None:
+        raise ImportError('Pillow is required for the cover thumbnails: pip install Pillow')
+
+    stream = open_epub_cover_image(filepath)
+    if stream is None:
+        return None
+    with stream:
+        try:
+            image = Image.open(stream)
+            # Only effective for JPEG: the decoder scales by 1/2, 1/4 or 1/8
+            # while decoding, the result is at least as big as `size`.
+            image.draft('RGB', size)
+            image.load()
+        except (IOError, SyntaxError, ValueError) as e:
+            # e.g. SVG covers
+            raise EPubException('Cannot decode the cover image of {}: {}'.format(filepath, e))
+
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGBA')
+        canvas = Image.new('RGB', image.size, background)
+        canvas.paste(image, mask=image.split()[-1])
+        image = canvas
+    if crop:
+        thumbnail = ImageOps.fit(image, size, Image.LANCZOS)
+    else:
+        image.thumbnail(size, Image.LANCZOS)
+        thumbnail = Image.new('RGB', size, background)
+        thumbnail.paste(image, ((size[0] - image.size[0]) // 2, (size[1] - image.size[1]) // 2))
+
+    output = io.BytesIO()
+    thumbnail.save(output, format, **save_options)
+    return output.getvalue()
+
+
+def iter_cover_thumbnails(paths, workers=None, executor='process', chunksize=16, timeout=None, **options):
+    '''
+    make_cover_thumbnail for many ePub files in parallel, with the same
+    behavior as epub_meta.iter_epub_metadata: yields (path, thumbnail) tuples
+    in completion order, thumbnail is the bytes, None (no cover) or an
+    EPubException. Each worker only holds one (reduced) image at a time.
+    options: make_cover_thumbnail arguments
+    '''
+    if Image is None:
+        raise ImportError('Pillow is required for the cover thumbnails: pip install Pillow')
+    return _iter_results(make_cover_thumbnail, paths, workers=workers, executor=executor,
+                         chunksize=chunksize, timeout=timeout, options=options)
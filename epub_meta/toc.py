@@ -0,0 +1,360 @@
+'''
+Streaming table of contents parser: the ePub 3 nav document and the ePub 2
+NCX file are parsed in a single pass (expat), reading the member in chunks.
+No tree is built and the entries are produced as soon as they are complete
+(for the NCX file, at the end of each top-level navPoint), so the time is
+linear in the document size and the depth is not limited.
+
+The entries are the same as the previous minidom implementation:
+- nav: every <a> with an href to a .html/.xhtml file and a title (its first
+  child text, or the first child text of its first child element). The
+  level is the number of <ol> ancestors below the <nav> element, minus one.
+- NCX: the navPoints of the (first) navMap, depth first. A navPoint without
+  a title is skipped with its children.
+'''
+from array import array
+from collections import deque
+from xml.parsers import expat
+
+try:
+    from urllib.parse import unquote
+except ImportError:
+    from urllib import unquote
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _Frame(object):
+    # An open element. Tracks its first child node, whose nodeValue minidom
+    # would return for element.firstChild.nodeValue: the (merged) text, the
+    # comment, CDATA or processing instruction data, or None for an element
+    # (then first_frame is the element).
+    __slots__ = ('name', 'attributes', 'first_kind', 'first_value', 'first_frame', 'text_open', 'cdata_open',
+                 'level', 'entry')
+
+    def __init__(self, name, attributes, level=None):
+        self.name = name
+        self.attributes = attributes
+        self.first_kind = None
+        self.first_value = None
+        self.first_frame = None
+        self.text_open = False
+        self.cdata_open = False
+        self.level = level
+        self.entry = None
+
+    def child_node(self, kind, value=None, frame=None):
+        self.text_open = False
+        if self.first_kind is None:
+            self.first_kind = kind
+            self.first_value = value
+            self.first_frame = frame
+            self.cdata_open = kind == 'cdata'
+
+    def character_data(self, data):
+        if self.first_kind is None:
+            self.first_kind = 'text'
+            self.first_value = data
+            self.text_open = True
+        elif self.text_open or self.cdata_open:
+            self.first_value += data
+
+    def end_cdata(self):
+        self.cdata_open = False
+
+
+class _TocParser(object):
+    '''
+    Base of the streaming parsers: feeds expat with the chunks of a stream and
+    yields the entries (dicts: title, src, level) produced by the handlers.
+    '''
+
+    def __init__(self, max_depth=None):
+        self.max_depth = max_depth
+        self.node_count = 0
+        self.bytes_read = 0
+        self._entries = deque()
+        self._stack = []
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = self._start_element
+        parser.EndElementHandler = self._end_element
+        parser.CharacterDataHandler = self._character_data
+        parser.CommentHandler = self._comment
+        parser.ProcessingInstructionHandler = self._processing_instruction
+        parser.StartCdataSectionHandler = self._start_cdata
+        parser.EndCdataSectionHandler = self._end_cdata
+        self._parser = parser
+
+    def iterate(self, stream, budget=None):
+        '''
+        Yields the entries of the document read from the stream (a file-like
+        object or bytes).
+        budget: a LimitedZipFile, the elements of each chunk are reported to
+        it
+        '''
+        if isinstance(stream, bytes):
+            stream = _BytesStream(stream)
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            self.bytes_read += len(chunk)
+            node_count = self.node_count
+            self._parser.Parse(chunk, not chunk)
+            if budget is not None:
+                budget.add_nodes(self.node_count - node_count)
+            while self._entries:
+                yield self._entries.popleft()
+            if not chunk:
+                break
+        for entry in self._finish():
+            yield entry
+
+    def _finish(self):
+        return ()
+
+    def _start_element(self, name, attributes):
+        self.node_count += 1
+        parent = self._stack[-1] if self._stack else None
+        frame = _Frame(name, attributes)
+        if parent is not None:
+            parent.child_node('element', frame=frame)
+        self._stack.append(frame)
+        self._start(frame, parent)
+
+    def _end_element(self, name):
+        self._end(self._stack.pop())
+
+    def _character_data(self, data):
+        if self._stack:
+            self._stack[-1].character_data(data)
+
+    def _comment(self, data):
+        if self._stack:
+            self._stack[-1].child_node('comment', data)
+
+    def _processing_instruction(self, target, data):
+        if self._stack:
+            self._stack[-1].child_node('pi', data)
+
+    def _start_cdata(self):
+        if self._stack:
+            self._stack[-1].child_node('cdata', '')
+
+    def _end_cdata(self):
+        if self._stack:
+            self._stack[-1].end_cdata()
+
+    def _start(self, frame, parent):
+        pass
+
+    def _end(self, frame):
+        pass
+
+
+class _BytesStream(object):
+    def __init__(self, content):
+        self._content = memoryview(content)
+        self._pos = 0
+
+    def read(self, size):
+        chunk = self._content[self._pos:self._pos + size].tobytes()
+        self._pos += len(chunk)
+        return chunk
+
+
+class NavParser(_TocParser):
+    '''
+    ePub 3.x nav document.
+    '''
+
+    def __init__(self, max_depth=None):
+        _TocParser.__init__(self, max_depth)
+        # <a> frames in document order, until they are complete (an <a> may
+        # contain another one)
+        self._links = deque()
+
+    def _start(self, frame, parent):
+        # Number of <ol> ancestors (the element included) below the nearest
+        # <nav> element
+        if frame.name == 'nav':
+            frame.level = 0
+        else:
+            frame.level = parent.level if parent is not None else 0
+            if frame.name == 'ol':
+                frame.level += 1
+        if frame.name == 'a':
+            self._links.append(frame)
+
+    def _end(self, frame):
+        if frame.name != 'a':
+            return
+        frame.entry = self._link_entry(frame) or False
+        while self._links and self._links[0].entry is not None:
+            entry = self._links.popleft().entry
+            if entry:
+                self._entries.append(entry)
+
+    def _link_entry(self, frame):
+        if frame.first_kind is None or 'href' not in frame.attributes:
+            return None
+        href = unquote(frame.attributes['href'])
+        # Discarding CFI links
+        if '.html' not in href and '.xhtml' not in href:
+            return None
+        title = frame.first_value
+        # try the second node too (maybe the first child is an empty span)
+        if not title and frame.first_frame is not None and frame.first_frame.first_kind is not None:
+            title = frame.first_frame.first_value
+        title = title.strip() if title else None
+        if not title:
+            return None
+        # The <a> itself is not an <ol>. The root level is 0, not -1
+        level = max(frame.level - 1, 0)
+        if self.max_depth is not None and level > self.max_depth:
+            return None
+        return {'title': title, 'src': href, 'level': level}
+
+
+class _NavPoint(object):
+    # A navPoint of the navMap. Its entry is only complete at its end (a
+    # navLabel or a content may follow the children): the entries of its
+    # children are buffered until then. So the output is streamed per
+    # top-level navPoint.
+    __slots__ = ('parent', 'entry', 'buffer', 'skipped')
+
+    def __init__(self, parent, entry, skipped):
+        self.parent = parent
+        self.entry = entry
+        self.buffer = []
+        self.skipped = skipped
+
+
+class NcxParser(_TocParser):
+    '''
+    ePub 2.x NCX file.
+    '''
+
+    def __init__(self, max_depth=None):
+        _TocParser.__init__(self, max_depth)
+        self.found_nav_map = False
+        self._nav_map = None  # frame of the navMap being read
+        self._prefixed_entries = None  # entries of an ncx:navMap, used if there is no navMap
+        self._points = {}  # navPoint frame -> _NavPoint
+        self._labels = {}  # navLabel frame -> [first text frame, first ncx:text frame]
+
+    @property
+    def has_nav_map(self):
+        return self.found_nav_map or self._prefixed_entries is not None
+
+    def _start(self, frame, parent):
+        name = frame.name
+        if self._nav_map is None:
+            # The first navMap, or the first ncx:navMap while there is no navMap
+            if self.found_nav_map:
+                return
+            if name == 'navMap':
+                self.found_nav_map = True
+                self._prefixed_entries = None
+            elif name != 'ncx:navMap' or self._prefixed_entries is not None:
+                return
+            else:
+                self._prefixed_entries = []
+            self._nav_map = frame
+            frame.level = -1
+            return
+
+        if parent.level is not None:
+            # Direct child of the navMap or of a navPoint
+            point = self._points.get(parent)
+            if name in ('navPoint', 'ncx:navPoint'):
+                frame.level = parent.level + 1
+                skipped = (point is not None and point.skipped) or (
+                    self.max_depth is not None and frame.level > self.max_depth)
+                self._points[frame] = _NavPoint(point, {'title': None, 'src': None, 'level': frame.level}, skipped)
+            elif point is None:
+                pass
+            elif name in ('navLabel', 'ncx:navLabel'):
+                self._labels[frame] = [None, None]
+            elif name in ('content', 'ncx:content') and 'src' in frame.attributes:
+                point.entry['src'] = frame.attributes['src']
+        elif name in ('text', 'ncx:text'):
+            # The first <text> (or <ncx:text>) anywhere in a navLabel
+            index = 0 if name == 'text' else 1
+            for ancestor in reversed(self._stack[:-1]):
+                if ancestor.level is not None:
+                    break
+                texts = self._labels.get(ancestor)
+                if texts is not None and texts[index] is None:
+                    texts[index] = frame
+
+    def _end(self, frame):
+        if frame is self._nav_map:
+            self._nav_map = None
+            return
+        texts = self._labels.pop(frame, None)
+        if texts is not None:
+            text = texts[0] or texts[1]
+            value = text.first_value if text is not None else None
+            self._points[self._stack[-1]].entry['title'] = value.strip() if value else None
+            return
+        point = self._points.pop(frame, None)
+        if point is None or point.skipped or not point.entry['title']:
+            # Skipped with its children
+            return
+        point.buffer.insert(0, point.entry)
+        if point.parent is not None:
+            point.parent.buffer.extend(point.buffer)
+        elif self._nav_map.name == 'navMap':
+            self._entries.extend(point.buffer)
+        else:
+            self._prefixed_entries.extend(point.buffer)
+
+    def _finish(self):
+        if not self.found_nav_map and self._prefixed_entries:
+            return self._prefixed_entries
+        return ()
+
+
+class TocColumns(object):
+    '''
+    Compact, columnar table of contents: titles and srcs (lists of strings)
+    and levels (array of ints). len(columns), columns[i] and iteration give
+    the usual entry dicts (title, src, level, index).
+    '''
+    __slots__ = ('titles', 'srcs', 'levels')
+
+    def __init__(self, entries=()):
+        self.titles = []
+        self.srcs = []
+        self.levels = array('i')
+        for entry in entries:
+            self.append(entry)
+
+    def append(self, entry):
+        self.titles.append(entry['title'])
+        self.srcs.append(entry['src'])
+        self.levels.append(entry['level'])
+
+    def __len__(self):
+        return len(self.titles)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        return {'title': self.titles[index], 'src': self.srcs[index], 'level': self.levels[index], 'index': index}
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'TocColumns({} entries)'.format(len(self))
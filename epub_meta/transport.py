@@ -0,0 +1,289 @@
+'''
+Shared memory transport of the results of the worker processes, for
+iter_epub_metadata(executor='process', shared_memory=True): instead of
+pickling the large values (the cover image and the ToC) through the pipe of
+the process pool, the worker writes them in a shared memory segment and only
+sends its name and their offsets. The parent maps the segment and gets
+zero-copy, read-only views:
+
+- cover_image_content: a memoryview (of the raw bytes, or of the base64
+  bytes with the default cover_image_encoding)
+- toc: a TocColumns whose titles and srcs are decoded on access
+
+    for path, data in epub_meta.iter_epub_metadata(paths, shared_memory=True, cover_image_encoding=None):
+        with data:
+            thumbnail(data.cover_image_content)
+
+The segment lives until the metadata is released: release() (or the end of
+the with block) unmaps and frees it, and the views can't be used anymore.
+data.copy() returns the usual odict (bytes and lists) to keep. A
+metadata dict that is garbage collected without being released frees the
+segment name, the memory is returned once the views are gone too.
+Values smaller than SHARED_MIN_BYTES are pickled as usual.
+'''
+from array import array
+from collections import namedtuple
+import weakref
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    # Python < 3.8
+    resource_tracker = shared_memory = None
+
+from epub_meta.discovery import odict
+from epub_meta.toc import TocColumns
+
+
+# Smaller values are pickled with the rest of the metadata
+SHARED_MIN_BYTES = 16 * 1024
+
+# Sent by the worker instead of the metadata dict. segment: name of the
+# shared memory segment, keys: the metadata keys in order, values: the
+# pickled values, refs: key -> (kind, spans), spans are the (offset, size) of
+# the buffers of the value in the segment.
+SharedResult = namedtuple('SharedResult', 'segment keys values refs')
+
+_OFFSET_TYPE = 'q'
+_LEVEL_TYPE = 'i'
+_NULLS_TYPE = 'B'
+
+# Bits of the nulls column: the title or src of the entry is None
+_NULL_TITLE = 1
+_NULL_SRC = 2
+
+
+def check_available():
+    if shared_memory is None:
+        raise ImportError('multiprocessing.shared_memory (Python 3.8+) is required for shared_memory=True')
+
+
+def prepare():
+    '''
+    Called by the parent before starting the worker processes: they share
+    its resource tracker. Otherwise each worker starts its own, which frees
+    the segments of the worker when it exits, results not yet read included.
+    '''
+    check_available()
+    if hasattr(resource_tracker, 'ensure_running'):
+        resource_tracker.ensure_running()
+
+
+def _pack_toc(toc):
+    # Buffers of the columns: title offsets, src offsets, levels, titles and
+    # srcs (UTF-8), nulls (None titles and srcs, see _NULL_TITLE)
+    title_offsets, src_offsets, levels = array(_OFFSET_TYPE, [0]), array(_OFFSET_TYPE, [0]), array(_LEVEL_TYPE)
+    nulls = array(_NULLS_TYPE)
+    titles, srcs = [], []
+    title_size = src_size = 0
+    for entry in toc:
+        nulls.append((_NULL_TITLE if entry['title'] is None else 0) | (_NULL_SRC if entry['src'] is None else 0))
+        title = (entry['title'] or '').encode('utf-8')
+        src = (entry['src'] or '').encode('utf-8')
+        titles.append(title)
+        srcs.append(src)
+        title_size += len(title)
+        src_size += len(src)
+        title_offsets.append(title_size)
+        src_offsets.append(src_size)
+        levels.append(entry['level'])
+    return [title_offsets, src_offsets, levels, b''.join(titles), b''.join(srcs), nulls]
+
+
+def _nbytes(buffer):
+    return memoryview(buffer).nbytes
+
+
+def share_result(data, min_bytes=SHARED_MIN_BYTES):
+    '''
+    Worker side: returns a SharedResult with the large values of the
+    metadata dict moved to a new shared memory segment, or the data as is
+    (nothing large enough, or an exception).
+    '''
+    if not isinstance(data, dict):
+        return data
+    shared = []  # (key, kind, buffers)
+    cover = data.get('cover_image_content')
+    if cover is not None and _nbytes(cover) >= min_bytes:
+        shared.append(('cover_image_content', 'bytes', [cover]))
+    toc = data.get('toc')
+    if toc:
+        buffers = _pack_toc(toc)
+        if sum(_nbytes(buffer) for buffer in buffers) >= min_bytes:
+            shared.append(('toc', 'toc', buffers))
+    if not shared:
+        return data
+
+    refs = {}
+    layout = []
+    size = 0
+    for key, kind, buffers in shared:
+        spans = []
+        for buffer in buffers:
+            # 8-byte aligned arrays
+            size += -size % 8
+            spans.append((size, _nbytes(buffer)))
+            layout.append((size, buffer))
+            size += _nbytes(buffer)
+        refs[key] = (kind, spans)
+    segment = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        for offset, buffer in layout:
+            buffer = memoryview(buffer).cast('B')
+            segment.buf[offset:offset + buffer.nbytes] = buffer
+    except BaseException:
+        segment.close()
+        segment.unlink()
+        raise
+    # The worker doesn't keep it mapped, the parent unlinks it
+    segment.close()
+    values = odict((key, value) for key, value in data.items() if key not in refs)
+    return SharedResult(segment.name, list(data), values, refs)
+
+
+def discard_result(result):
+    '''
+    Parent side: frees the segment of a SharedResult that won't be attached
+    (e.g. the iteration was stopped).
+    '''
+    if isinstance(result, SharedResult):
+        try:
+            segment = shared_memory.SharedMemory(name=result.segment)
+        except FileNotFoundError:
+            return
+        segment.close()
+        segment.unlink()
+
+
+class _StringColumn(object):
+    # Read-only sequence of the strings of a packed ToC column, decoded on
+    # access. None where the null bit is set in nulls.
+    __slots__ = ('_offsets', '_data', '_nulls', '_null_bit')
+
+    def __init__(self, offsets, data, nulls, null_bit):
+        self._offsets = offsets
+        self._data = data
+        self._nulls = nulls
+        self._null_bit = null_bit
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('column index out of range')
+        if self._nulls[index] & self._null_bit:
+            return None
+        return str(self._data[self._offsets[index]:self._offsets[index + 1]], 'utf-8')
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+class SharedMetadata(odict):
+    '''
+    Metadata dict of a SharedResult, whose large values are views of the
+    shared memory segment (see the module documentation). Also a context
+    manager releasing it.
+    '''
+    __slots__ = ('_segment', '_views', '_kinds', '_finalizer')
+
+    def __init__(self, items=(), segment=None, views=(), kinds=None):
+        odict.__init__(self, items)
+        object.__setattr__(self, '_segment', segment)
+        object.__setattr__(self, '_views', list(views))
+        object.__setattr__(self, '_kinds', kinds or {})
+        object.__setattr__(self, '_finalizer', weakref.finalize(self, _unlink, segment) if segment else None)
+
+    @classmethod
+    def attach(cls, result):
+        '''
+        Parent side: maps the segment of a SharedResult. A plain metadata
+        dict (nothing was shared) is wrapped as is.
+        '''
+        if not isinstance(result, SharedResult):
+            return cls(result.items())
+        segment = shared_memory.SharedMemory(name=result.segment)
+        buf = segment.buf
+        views = []
+
+        def view(span, format=None):
+            offset, size = span
+            value = buf[offset:offset + size].toreadonly()
+            views.append(value)
+            if format is not None:
+                value = value.cast(format)
+                views.append(value)
+            return value
+
+        kinds = {}
+        items = []
+        for key in result.keys:
+            if key not in result.refs:
+                items.append((key, result.values[key]))
+                continue
+            kind, spans = result.refs[key]
+            kinds[key] = kind
+            if kind == 'toc':
+                toc = TocColumns.__new__(TocColumns)
+                nulls = view(spans[5], _NULLS_TYPE)
+                toc.titles = _StringColumn(view(spans[0], _OFFSET_TYPE), view(spans[3]), nulls, _NULL_TITLE)
+                toc.srcs = _StringColumn(view(spans[1], _OFFSET_TYPE), view(spans[4]), nulls, _NULL_SRC)
+                toc.levels = view(spans[2], _LEVEL_TYPE)
+                items.append((key, toc))
+            else:
+                items.append((key, view(spans[0])))
+        return cls(items, segment, views, kinds)
+
+    def release(self):
+        '''
+        Unmaps and frees the shared memory segment. The views of the values
+        can't be used anymore (BufferError while other views of them exist).
+        '''
+        segment = self._segment
+        if segment is None:
+            return
+        object.__setattr__(self, '_segment', None)
+        self._finalizer.detach()
+        try:
+            # The casts first, they are views of the other views
+            for view in reversed(self._views):
+                view.release()
+            segment.close()
+        finally:
+            _unlink(segment)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def copy(self):
+        '''
+        Returns the metadata as get_epub_metadata would: an odict of bytes,
+        str and lists, independent of the segment.
+        '''
+        data = odict()
+        for key, value in self.items():
+            kind = self._kinds.get(key)
+            if kind == 'toc':
+                value = list(value)
+            elif kind == 'bytes':
+                value = value.tobytes()
+            data[key] = value
+        return data
+
+    def __reduce__(self):
+        # Unpickled as a regular odict
+        return odict, (list(self.copy().items()),)
+
+
+def _unlink(segment):
+    try:
+        segment.unlink()
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,475 @@
+'''
+Watch mode for drop folders: the ePub files added to or modified in a
+directory tree are extracted once they are completely written, and the
+results are yielded as an event stream.
+
+    for event in epub_meta.watch_directory('/drop', workers=4, read_cover_image=False):
+        if isinstance(event.metadata, epub_meta.EPubException):
+            ...
+        print(event.kind, event.path, event.latency, event.queue_depth)
+
+The changes come from inotify on Linux (no dependency, through ctypes), and
+from polling the tree elsewhere (or when inotify is not available, e.g. out
+of watches). A changed file is only extracted once it is settled: no change
+(size, mtime) for `settle` seconds and a complete zip central directory, so
+a file being copied or downloaded is read once, when it is complete. Files
+whose size, mtime and inode didn't change since their extraction are not
+extracted again.
+
+The extraction runs in a pool of `workers` processes (or threads), with at
+most one file per worker: the other settled files wait in a queue. A file
+over the `timeout` is reported as an EPubTimeoutError: a process worker that
+doesn't respond to its alarm is killed with the pool (which is replaced), a
+thread can't be interrupted and is abandoned. Each event
+has its latency (from the first change of the file to the event) and the
+queue depth when it was emitted, to size the pool. The latency is also
+emitted as a 'watch' PhaseEvent to the instrumentation listeners (e.g. the
+Prometheus histogram), and DirectoryWatcher.stats aggregates both.
+'''
+from collections import deque, namedtuple
+from concurrent import futures
+from concurrent.futures.process import BrokenProcessPool
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import signal
+import struct
+import sys
+import threading
+import time
+
+from epub_meta.archive import central_directory_complete
+from epub_meta.exceptions import EPubException
+from epub_meta.instrumentation import record
+from epub_meta.scanner import (POLL_INTERVAL, _extract, _init_worker, _terminate_pool, _timeout_error,
+                               iter_epub_files)
+
+
+# kind: 'added', 'modified' or 'deleted'
+# metadata: the get_epub_metadata result, an EPubException if the file
+# couldn't be read, None for 'deleted'
+# latency: seconds from the first change of the file to the event
+# queue_depth: settled files waiting for a worker when the event was emitted
+WatchEvent = namedtuple('WatchEvent', 'kind path metadata latency queue_depth')
+
+# inotify(7)
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_IN_MASK = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+_IN_EVENT = struct.Struct('iIII')
+
+
+def _init_worker_process():
+    # Ctrl-C stops the watcher, which shuts the pool down: the workers don't
+    # need a KeyboardInterrupt of their own
+    _init_worker()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class _ThreadExecutor(object):
+    # A daemon thread per extraction: a thread over the timeout can't be
+    # interrupted, it is abandoned without holding a slot of the pool (or the
+    # interpreter exit, like a ThreadPoolExecutor thread would).
+
+    def submit(self, function, *args):
+        future = futures.Future()
+
+        def run():
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(function(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def _stat_key(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+class _PollingSource(object):
+    # Changes found by comparing snapshots of the tree (path -> stat key)
+    # every interval seconds.
+
+    def __init__(self, dirpath, extensions, interval):
+        self._dirpath = dirpath
+        self._extensions = extensions
+        self._interval = interval
+        self._snapshot = self._scan()
+        self._next = time.monotonic() + interval
+
+    def _scan(self):
+        snapshot = {}
+        for path in iter_epub_files(self._dirpath, self._extensions):
+            key = _stat_key(path)
+            if key is not None:
+                snapshot[path] = key
+        return snapshot
+
+    def changes(self, timeout):
+        wait = self._next - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set()
+        time.sleep(max(wait, 0))
+        self._next = time.monotonic() + self._interval
+        snapshot = self._scan()
+        changed = set(path for path, key in snapshot.items() if self._snapshot.get(path) != key)
+        changed.update(path for path in self._snapshot if path not in snapshot)
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+class _InotifySource(object):
+    # Changes reported by inotify, with a watch per directory of the tree.
+    # changes() returns None when events were lost (queue overflow, moved
+    # directory): anything may have changed.
+
+    def __init__(self, dirpath, extensions):
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            self._libc.inotify_init1
+        except (OSError, AttributeError):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._extensions = extensions
+        self._directories = {}  # watch descriptor -> directory
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        try:
+            self._add_tree(dirpath)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_tree(self, dirpath):
+        # Returns the ePub files already in the new directories
+        paths = set()
+        for root, dirnames, filenames in os.walk(dirpath):
+            descriptor = self._libc.inotify_add_watch(self._fd, os.fsencode(root), _IN_MASK)
+            if descriptor < 0:
+                error = ctypes.get_errno()
+                raise OSError(error, 'Cannot watch {}: {}'.format(root, os.strerror(error)))
+            self._directories[descriptor] = root
+            paths.update(os.path.join(root, filename) for filename in filenames
+                         if filename.lower().endswith(self._extensions))
+        return paths
+
+    def changes(self, timeout):
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return set()
+        paths = set()
+        lost = False
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                descriptor, mask, cookie, size = _IN_EVENT.unpack_from(data, offset)
+                name = data[offset + _IN_EVENT.size:offset + _IN_EVENT.size + size].rstrip(b'\0')
+                offset += _IN_EVENT.size + size
+                if mask & _IN_Q_OVERFLOW:
+                    lost = True
+                    continue
+                directory = self._directories.get(descriptor)
+                if mask & _IN_IGNORED:
+                    self._directories.pop(descriptor, None)
+                    continue
+                if directory is None:
+                    continue
+                path = os.path.join(directory, os.fsdecode(name))
+                if mask & _IN_ISDIR:
+                    if mask & (_IN_CREATE | _IN_MOVED_TO):
+                        try:
+                            paths.update(self._add_tree(path))
+                        except OSError:
+                            lost = True
+                    elif mask & _IN_MOVED_FROM:
+                        # Its files are gone, without an event each
+                        lost = True
+                elif path.lower().endswith(self._extensions):
+                    paths.add(path)
+        return None if lost else paths
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class DirectoryWatcher(object):
+    '''
+    Iterable of the WatchEvents of a directory tree, see the module
+    documentation. The iteration runs until close() is called (from another
+    thread, or after breaking out of the loop).
+    - executor: 'process' (the timeout kills a stuck extraction) or 'thread'
+      (a stuck extraction is abandoned, its thread keeps running)
+    - workers: size of the pool (default: number of CPUs)
+    - timeout: seconds per file, the file is then reported as an
+      EPubTimeoutError
+    - cache: like iter_epub_metadata, e.g. a MetadataCache so that a restarted
+      watcher doesn't extract the unchanged files again
+    - settle: seconds without change before a file is extracted
+    - poll_interval: seconds between two scans of the tree without inotify
+    - incomplete_timeout: a settled file whose central directory is still
+      incomplete after that many seconds is extracted anyway (and reported
+      as an EPubException)
+    - initial: extract the files already in the tree (else only the changes)
+    - inotify: True (required), False (polling) or None (inotify when
+      available)
+    - options: get_epub_metadata arguments, e.g. read_cover_image=False
+    '''
+
+    def __init__(self, dirpath, extensions=('.epub',), workers=None, executor='process', timeout=None, cache=None,
+                 settle=1.0, poll_interval=2.0, incomplete_timeout=60.0, initial=True, inotify=None, **options):
+        if executor not in ('process', 'thread'):
+            raise ValueError('Unknown executor: {}'.format(executor))
+        self.dirpath = dirpath
+        self.extensions = tuple(extensions)
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = executor
+        self.timeout = timeout
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.incomplete_timeout = incomplete_timeout
+        self.initial = initial
+        self.inotify = inotify
+        self.options = options
+        self.stats = {'events': 0, 'errors': 0, 'latency_seconds': 0.0, 'max_latency_seconds': 0.0,
+                      'max_queue_depth': 0}
+        self._function = cache.get_epub_metadata if cache is not None else None
+        self._closed = False
+        self._known = {}  # path -> stat key of the extracted version
+        self._pending = {}  # path -> [first change, last change, stat key, last check]
+        self._ready = deque()  # settled files: (path, first change, stat key, kind, attempt)
+        self._running = {}  # future -> (path, first change, stat key, kind, attempt)
+        self._deadlines = {}  # future -> time after which the extraction is stopped
+
+    @property
+    def queue_depth(self):
+        '''
+        Settled files waiting for a worker.
+        '''
+        return len(self._ready)
+
+    @property
+    def in_flight(self):
+        '''
+        Files being extracted.
+        '''
+        return len(self._running)
+
+    def close(self):
+        '''
+        Stops the iteration (at its next wake-up, within POLL_INTERVAL).
+        '''
+        self._closed = True
+
+    def _source(self):
+        if self.inotify or self.inotify is None:
+            try:
+                return _InotifySource(self.dirpath, self.extensions)
+            except OSError:
+                if self.inotify:
+                    raise
+        return _PollingSource(self.dirpath, self.extensions, self.poll_interval)
+
+    def _pool(self):
+        if self.executor == 'thread':
+            return _ThreadExecutor()
+        return futures.ProcessPoolExecutor(self.workers, initializer=_init_worker_process)
+
+    def __iter__(self):
+        # The source is watching before the initial walk: no change is missed
+        source = self._source()
+        pool = self._pool()
+        try:
+            now = time.monotonic()
+            for path in iter_epub_files(self.dirpath, self.extensions):
+                if self.initial:
+                    self._changed(path, now)
+                else:
+                    key = _stat_key(path)
+                    if key is not None:
+                        self._known[path] = key
+            while not self._closed:
+                changed = source.changes(self._wait())
+                now = time.monotonic()
+                if changed is None:
+                    changed = set(iter_epub_files(self.dirpath, self.extensions)).union(self._known)
+                for path in changed:
+                    self._changed(path, now)
+                for event in self._settle(now):
+                    yield event
+                while self._ready and len(self._running) < self.workers:
+                    task = self._ready.popleft()
+                    future = pool.submit(_extract, task[0], self.timeout, self.options, self._function)
+                    self._running[future] = task
+                    if self.timeout:
+                        # A process worker gets the time of its alarm first
+                        grace = 1 if self.executor == 'thread' else 2
+                        self._deadlines[future] = time.monotonic() + self.timeout * grace
+                for event in self._expire(pool):
+                    if isinstance(event, BrokenProcessPool):
+                        pool.shutdown(wait=False)
+                        pool = self._pool()
+                    else:
+                        yield event
+                for event in self._collect():
+                    if isinstance(event, BrokenProcessPool):
+                        pool.shutdown(wait=False)
+                        pool = self._pool()
+                    else:
+                        yield event
+        finally:
+            for future in self._running:
+                future.cancel()
+            self._running.clear()
+            self._deadlines.clear()
+            pool.shutdown(wait=False)
+            source.close()
+
+    def _wait(self):
+        # Until the next pending file may be settled, at most POLL_INTERVAL
+        # (the results and close() are checked on each wake-up)
+        wait = POLL_INTERVAL
+        now = time.monotonic()
+        for first, changed, key, checked in self._pending.values():
+            wait = min(wait, max(changed, checked) + self.settle - now)
+        return max(wait, 0)
+
+    def _changed(self, path, now):
+        entry = self._pending.get(path)
+        if entry is None:
+            self._pending[path] = [now, now, _stat_key(path), now]
+        else:
+            entry[1], entry[2] = now, _stat_key(path)
+
+    def _settle(self, now):
+        # Moves the settled files to the queue, yields the deletions
+        running = set(task[0] for task in self._running.values())
+        for path, entry in list(self._pending.items()):
+            first, changed, key, checked = entry
+            if now - max(changed, checked) < self.settle or path in running:
+                continue
+            current = _stat_key(path)
+            if current is None:
+                del self._pending[path]
+                if self._known.pop(path, None) is not None:
+                    yield self._event('deleted', path, None, first)
+                continue
+            if current != key:
+                # Still being written
+                entry[1], entry[2] = now, current
+                continue
+            if now - changed < self.incomplete_timeout and not central_directory_complete(path):
+                entry[3] = now
+                continue
+            del self._pending[path]
+            if self._known.get(path) == current:
+                continue
+            self._ready.append((path, first, current, 'modified' if path in self._known else 'added', 0))
+            self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], len(self._ready))
+
+    def _expire(self, pool):
+        # Yields the events of the extractions over the timeout, and a
+        # BrokenProcessPool if the pool was killed and must be replaced
+        now = time.monotonic()
+        overdue = set(future for future, deadline in self._deadlines.items() if now > deadline and not future.done())
+        if not overdue:
+            return
+        if self.executor == 'process':
+            # The worker didn't respond to the alarm (e.g. stuck in C code).
+            # The other files lost with the killed pool are extracted again,
+            # the finished ones are left to _collect.
+            _terminate_pool(pool)
+            futures.wait(self._running)
+            killed = set(future for future in self._running
+                         if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool))
+            overdue &= killed
+            for future in killed - overdue:
+                del self._deadlines[future]
+                self._ready.appendleft(self._running.pop(future))
+        for future in overdue:
+            del self._deadlines[future]
+            path, first, key, kind, attempt = self._running.pop(future)
+            self._known[path] = key
+            yield self._event(kind, path, _timeout_error(path, self.timeout), first)
+        if self.executor == 'process':
+            yield BrokenProcessPool('Pool killed over the timeout')
+
+    def _collect(self):
+        # Yields the events of the finished extractions, and a
+        # BrokenProcessPool if the pool must be replaced
+        broken = None
+        for future in [future for future in self._running if future.done()]:
+            path, first, key, kind, attempt = task = self._running.pop(future)
+            self._deadlines.pop(future, None)
+            if future.cancelled():
+                continue
+            try:
+                metadata = future.result()[1]
+            except BrokenProcessPool as e:
+                broken = e
+                if not attempt:
+                    # Maybe another file crashed the pool
+                    self._ready.appendleft(task[:4] + (1,))
+                    continue
+                metadata = EPubException('Worker crashed reading {}'.format(path))
+            self._known[path] = key
+            yield self._event(kind, path, metadata, first)
+        if broken is not None:
+            yield broken
+
+    def _event(self, kind, path, metadata, first):
+        latency = time.monotonic() - first
+        error = metadata if isinstance(metadata, Exception) else None
+        self.stats['events'] += 1
+        self.stats['errors'] += error is not None
+        self.stats['latency_seconds'] += latency
+        self.stats['max_latency_seconds'] = max(self.stats['max_latency_seconds'], latency)
+        record('watch', path, latency, error)
+        return WatchEvent(kind, path, metadata, latency, len(self._ready))
+
+
+def watch_directory(dirpath, **kwargs):
+    '''
+    Generator of the WatchEvents of a directory tree, see DirectoryWatcher for
+    the arguments. Runs until the caller stops iterating.
+    '''
+    events = iter(DirectoryWatcher(dirpath, **kwargs))
+    try:
+        for event in events:
+            yield event
+    finally:
+        events.close()
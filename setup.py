@@ -45,11 +45,20 @@ setup(name='epub_meta',
 
       version=VERSION,
       install_requires=install_requires,
+      extras_require={
+          # Cover thumbnails (epub_meta.thumbnails)
+          'thumbnails': ['Pillow'],
+          # Arrow and Parquet export (epub_meta.export)
+          'arrow': ['pyarrow'],
+          'test': tests_require,
+      },
 
       test_suite='tests',
       tests_require=tests_require,
-      extras_require={'test': tests_require},
 
       packages=find_packages(),
+      entry_points={
+          'console_scripts': ['epub-meta = epub_meta.cli:main'],
+      },
 )
 